@@ -0,0 +1,69 @@
+import os
+import json
+import hashlib
+import zipfile
+
+import numpy as np
+
+
+def hash_files(*paths):
+    sha1 = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(2 ** 20), b""):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Saves the arrays each analysis stage outputs to cache_dir/<stage>/<key>.npz. A stage's key is a hash of
+    everything its output depends on: the hash of the experiment file, the lookup table version, the
+    parameters the stage uses and the keys of the stages it builds on. Changing a parameter only changes
+    the keys of the stages that use it and the ones after them, so the earlier stages are loaded instead
+    of rerun.
+
+    Entries are written to a temporary file and renamed into place, so several processes (see
+    batch_analysis.py) can share a cache.
+    """
+
+    def __init__(self, cache_dir="analysis_cache"):
+        self.cache_dir = cache_dir
+        self.file_hashes = {}  # path -> (modification time, size, hash) so unchanged files aren't rehashed
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        cached = self.file_hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+
+        file_hash = hash_files(path)
+        self.file_hashes[path] = stat.st_mtime, stat.st_size, file_hash
+        return file_hash
+
+    @staticmethod
+    def key(stage, **params):
+        return hashlib.sha1(json.dumps(dict(params, stage=stage), sort_keys=True).encode()).hexdigest()
+
+    def get_path(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key + ".npz")
+
+    def load(self, stage, key):
+        path = self.get_path(stage, key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None  # a damaged entry is recomputed and overwritten
+
+    def save(self, stage, key, arrays):
+        path = self.get_path(stage, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(temp_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, path)
@@ -0,0 +1,166 @@
+import os
+import csv
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from experiment_info import ExperimentInfo
+from experiment_catalog import ExperimentCatalog
+
+RESULT_COLUMNS = ("path", "brake_type", "conical_annulus_params", "experiment_time", "length", "outer_diameter",
+                  "wall_thickness", "slope", "intercept", "settled_slope", "settled_intercept", "num_points",
+                  "num_settled_samples", "error")
+
+
+def analyze_run(brake_type, conical_annulus_params, experiment_time):
+    """Runs in a worker process. Returns the run's row of the results table"""
+    from data_analyzer import analyze_experiment
+
+    results = analyze_experiment(brake_type, conical_annulus_params, experiment_time)
+    return {
+        "length": results.length,
+        "outer_diameter": results.outer_diameter,
+        "wall_thickness": results.wall_thickness,
+        "slope": float(results.lin_reg_coeffs[0]),
+        "intercept": float(results.lin_reg_coeffs[1]),
+        "settled_slope": float(results.settled_lin_reg_coeffs[0]),
+        "settled_intercept": float(results.settled_lin_reg_coeffs[1]),
+        "num_points": len(results.torque_input),
+        "num_settled_samples": int(np.sum(results.step_deflection.count)),
+    }
+
+
+def analyze_run_safely(brake_type, conical_annulus_params, experiment_time):
+    """Errors come back as text along with their traceback, which doesn't survive being pickled otherwise"""
+    try:
+        return analyze_run(brake_type, conical_annulus_params, experiment_time)
+    except Exception as error:
+        return {"error": "%s: %s" % (error.__class__.__name__, error), "traceback": traceback.format_exc()}
+
+
+def analyze_entries(entries, workers=None, verbose=True):
+    """
+    Analyze catalog entries in a process pool. Returns one row per entry, in the same order. A run that
+    fails gets an error message in its row instead of stopping the others
+    """
+    rows = []
+    for entry in entries:
+        row = dict.fromkeys(RESULT_COLUMNS)
+        row.update(path=entry.path, brake_type=ExperimentInfo.get_paths(entry.brake_type),
+                   conical_annulus_params=entry.conical_annulus_params, experiment_time=entry.experiment_time,
+                   length=entry.length, outer_diameter=entry.outer_diameter, wall_thickness=entry.wall_thickness)
+        rows.append(row)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(analyze_run_safely, entry.brake_type, entry.conical_annulus_params,
+                            entry.experiment_time): index
+            for index, entry in enumerate(entries)
+        }
+        for num_finished, future in enumerate(as_completed(futures)):
+            row = rows[futures[future]]
+            try:
+                result = future.result()
+            except Exception as error:  # the worker itself died
+                result = {"error": "%s: %s" % (error.__class__.__name__, error)}
+
+            error_traceback = result.pop("traceback", None)
+            if verbose and error_traceback is not None:
+                print(error_traceback)
+            row.update(result)
+
+            if verbose:
+                if row["error"] is None:
+                    print("[%s/%s] %s: m=%0.4f, b=%0.4f" % (
+                        num_finished + 1, len(entries), row["path"], row["slope"], row["intercept"]))
+                else:
+                    print("[%s/%s] %s failed: %s" % (num_finished + 1, len(entries), row["path"], row["error"]))
+
+    return rows
+
+
+def write_csv(path, rows):
+    with open(path, 'w+', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_npz(path, rows):
+    """One array per column. Failed runs have nan for their numbers"""
+    columns = {}
+    for column in RESULT_COLUMNS:
+        values = [row[column] for row in rows]
+        if column in ("path", "brake_type", "conical_annulus_params", "experiment_time", "error"):
+            columns[column] = np.array(["" if value is None else str(value) for value in values])
+        elif column in ("num_points", "num_settled_samples"):
+            columns[column] = np.array([-1 if value is None else value for value in values], dtype=np.int64)
+        else:
+            columns[column] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    np.savez(path, **columns)
+
+
+def write_results(path, rows):
+    if path.endswith(".npz"):
+        write_npz(path, rows)
+    elif path.endswith(".csv"):
+        write_csv(path, rows)
+    else:
+        raise ValueError("Results can be written to .csv or .npz files, not '%s'" % path)
+
+
+def parse_brake_type(brake):
+    if brake == "large":
+        return ExperimentInfo.LARGE_BRAKE
+    elif brake == "small":
+        return ExperimentInfo.SMALL_BRAKE
+    raise argparse.ArgumentTypeError("Brake type must be large or small, got '%s'" % brake)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a selection of experiments in parallel")
+    parser.add_argument("--brake", type=parse_brake_type, help="large or small")
+    parser.add_argument("--length", type=float, help="conical annulus length (in)")
+    parser.add_argument("--outer-diameter", type=float, help="conical annulus outer diameter (in)")
+    parser.add_argument("--wall-thickness", type=float, help="conical annulus wall thickness (in)")
+    parser.add_argument("--after", type=float, help="only runs started after this unix time")
+    parser.add_argument("--before", type=float, help="only runs started before this unix time")
+    parser.add_argument("--done", action="store_true", default=None,
+                        help="only sizes marked as done in conical_annulus_sizes.csv")
+    parser.add_argument("--latest", action="store_true", help="only the latest run of each size")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to the number of CPUs")
+    parser.add_argument("--output", default="analysis_results.csv", help="a .csv or .npz file")
+    args = parser.parse_args()
+
+    if not args.output.endswith(".csv") and not args.output.endswith(".npz"):
+        parser.error("--output must be a .csv or .npz file")
+
+    catalog = ExperimentCatalog()
+    catalog.update()
+
+    filters = dict(brake_type=args.brake, length=args.length, outer_diameter=args.outer_diameter,
+                   wall_thickness=args.wall_thickness, after=args.after, before=args.before, done=args.done)
+    if args.latest:
+        entries = catalog.latest(**filters)
+    else:
+        entries = catalog.query(**filters)
+
+    if len(entries) == 0:
+        print("No experiments match")
+        return
+
+    print("Analyzing %s experiments with %s workers" % (len(entries), args.workers or os.cpu_count()))
+    start_time = time.time()
+    rows = analyze_entries(entries, args.workers)
+    write_results(args.output, rows)
+
+    num_failed = sum(1 for row in rows if row["error"] is not None)
+    print("%s analyzed, %s failed in %0.1fs. Results written to '%s'" % (
+        len(rows) - num_failed, num_failed, time.time() - start_time, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import math
+import time
+import argparse
+
+import numpy as np
+
+from experiment_info import ExperimentInfo
+from brake_lookup import get_lookup_tables
+from data_analyzer import format_torque_data
+from smoothing import savitzky_golay, StreamingSavitzkyGolay
+from segment_statistics import SegmentStatistics
+
+
+def legacy_format_torque_data(experiment_info, ascending_command_to_torque, descending_command_to_torque,
+                              settling_time):
+    """format_torque_data as it was before it was vectorized, kept to check the results against"""
+    torque_timestamps = experiment_info.commanded_torque_data.column("timestamp") + settling_time
+    torque_commands = experiment_info.commanded_torque_data.column("command")
+
+    repeating_indices = np.where(np.diff(torque_commands) == 0)
+    torque_timestamps = np.delete(torque_timestamps, repeating_indices)
+    torque_commands = np.delete(torque_commands, repeating_indices)
+
+    all_indices_of_zero_torque = np.where(torque_commands == 0)[0]
+    prev_index = all_indices_of_zero_torque[0]
+    zero_torque_valleys = [prev_index]
+    for index in all_indices_of_zero_torque:
+        if index - prev_index > 1:
+            zero_torque_valleys.append(index)
+        prev_index = index
+
+    if len(zero_torque_valleys) > experiment_info.repeats:
+        direction_transition = zero_torque_valleys[experiment_info.repeats]
+    else:
+        direction_transition = len(torque_commands)
+
+    rising_indices = np.where(np.diff(torque_commands) > 0)[0]
+
+    commanded_torque_nm_data = []
+    for torque_index in range(len(torque_commands)):
+        commanded_torque = torque_commands[torque_index]
+        if torque_index in rising_indices:
+            commanded_torque_nm_data.append(ascending_command_to_torque[int(commanded_torque)])
+        else:
+            commanded_torque_nm_data.append(descending_command_to_torque[int(commanded_torque)])
+
+        if torque_index >= direction_transition:
+            commanded_torque_nm_data[-1] *= -1
+
+        if experiment_info.commanded_motor_speed < 0:
+            commanded_torque_nm_data[-1] *= -1
+
+    commanded_torque_nm_data = np.array(commanded_torque_nm_data)
+
+    if len(experiment_info.commanded_motor_data) > 0:
+        selected_index = 0
+        for index in range(0, len(experiment_info.commanded_motor_data) - 1):
+            current_motor_command = experiment_info.commanded_motor_data[index][1]
+            prev_motor_command = experiment_info.commanded_motor_data[index + 1][1]
+            if current_motor_command != prev_motor_command:
+                selected_index = index + 1
+                break
+
+        direction_change_timestamp = experiment_info.commanded_motor_data[selected_index][0]
+    else:
+        direction_change_timestamp = 0.0
+
+    return torque_timestamps, commanded_torque_nm_data, direction_change_timestamp
+
+
+def legacy_savitzky_golay(y, window_size, order, deriv=0, rate=1):
+    """savitzky_golay as it was before smoothing.py, with np.mat and np.int swapped out so it still runs"""
+    order_range = range(order + 1)
+    half_window = (window_size - 1) // 2
+    b = np.array([[k ** i for i in order_range] for k in range(-half_window, half_window + 1)])
+    m = np.linalg.pinv(b)[deriv] * rate ** deriv * math.factorial(deriv)
+    firstvals = y[0] - np.abs(y[1:half_window + 1][::-1] - y[0])
+    lastvals = y[-1] + np.abs(y[-half_window - 1:-1][::-1] - y[-1])
+    y = np.concatenate((firstvals, y, lastvals))
+    return np.convolve(m[::-1], y, mode='valid')
+
+
+def make_synthetic_experiment(repeats, max_torque_command, motor_command=255, time_interval=0.5):
+    """
+    A long staircase experiment with no encoder data: every command from 0 up to max_torque_command and back
+    down, each sent twice like repeated commands in real recordings, for repeats cycles in each direction
+    """
+    experiment_info = ExperimentInfo()
+    experiment_info.repeats = repeats
+    experiment_info.commanded_motor_speed = motor_command
+    experiment_info.time_interval = time_interval
+
+    staircase = np.concatenate((np.arange(max_torque_command), np.arange(max_torque_command, 0, -1)))
+    staircase = np.repeat(staircase, 2)
+
+    timestamp = 0.0
+    for direction in (1, -1):
+        experiment_info.record_motor_command(timestamp, direction * motor_command)
+        for cycle in range(repeats):
+            for command in staircase.tolist():
+                experiment_info.record_torque_command(timestamp, command)
+                timestamp += time_interval
+    experiment_info.record_torque_command(timestamp, 0)
+    experiment_info.record_motor_command(timestamp, 0)
+
+    return experiment_info
+
+
+def time_function(function, args, runs):
+    best_time = None
+    for run in range(runs):
+        start_time = time.perf_counter()
+        result = function(*args)
+        run_time = time.perf_counter() - start_time
+        if best_time is None or run_time < best_time:
+            best_time = run_time
+    return best_time, result
+
+
+def benchmark_format_torque_data(repeats, max_torque_command, runs):
+    ascending_command_to_torque, descending_command_to_torque = get_lookup_tables(ExperimentInfo.LARGE_BRAKE)
+    experiment_info = make_synthetic_experiment(repeats, max_torque_command)
+    args = (experiment_info, ascending_command_to_torque, descending_command_to_torque,
+            experiment_info.time_interval / 3)
+
+    legacy_time, legacy_results = time_function(legacy_format_torque_data, args, runs)
+    vectorized_time, vectorized_results = time_function(format_torque_data, args, runs)
+
+    for legacy_result, vectorized_result in zip(legacy_results, vectorized_results):
+        if not np.array_equal(legacy_result, vectorized_result):
+            raise ValueError("format_torque_data's results don't match the legacy version's")
+
+    print("format_torque_data, %s torque commands:" % len(experiment_info.commanded_torque_data))
+    print("    legacy loop: %0.2fms" % (legacy_time * 1000.0))
+    print("    vectorized: %0.2fms (%0.1fx faster, results match)" % (
+        vectorized_time * 1000.0, legacy_time / vectorized_time))
+
+
+def benchmark_savitzky_golay(num_samples, chunk_size, runs, window_size=501, order=5):
+    """Smooth a random walk the length of a long recording, like format_encoder_data does"""
+    y = np.cumsum(np.random.RandomState(0).normal(size=num_samples))
+
+    legacy_time, legacy_result = time_function(legacy_savitzky_golay, (y, window_size, order), runs)
+    direct_time, direct_result = time_function(savitzky_golay, (y, window_size, order, 0, 1, "direct"), runs)
+    fft_time, fft_result = time_function(savitzky_golay, (y, window_size, order, 0, 1, "fft"), runs)
+
+    def smooth_in_chunks():
+        smoothing = StreamingSavitzkyGolay(window_size, order)
+        chunks = [smoothing.process(y[start:start + chunk_size]) for start in range(0, len(y), chunk_size)]
+        chunks.append(smoothing.flush())
+        return np.concatenate(chunks)
+
+    streaming_time, streaming_result = time_function(smooth_in_chunks, (), runs)
+
+    scale = np.max(np.abs(legacy_result))
+    print("savitzky_golay, %s samples, window %s, order %s:" % (num_samples, window_size, order))
+    print("    legacy: %0.2fms" % (legacy_time * 1000.0))
+    print("    direct: %0.2fms (%0.1fx faster, max relative error %0.1e)" % (
+        direct_time * 1000.0, legacy_time / direct_time, np.max(np.abs(direct_result - legacy_result)) / scale))
+    print("    overlap-add: %0.2fms (%0.1fx faster, max relative error %0.1e)" % (
+        fft_time * 1000.0, legacy_time / fft_time, np.max(np.abs(fft_result - legacy_result)) / scale))
+    print("    streaming, %s sample chunks: %0.2fms (max relative error %0.1e)" % (
+        chunk_size, streaming_time * 1000.0, np.max(np.abs(streaming_result - legacy_result)) / scale))
+
+
+def benchmark_segment_statistics(num_samples, num_steps, runs):
+    """Per-step statistics of a long recording, against masking out each step in a loop"""
+    timestamps = np.arange(num_samples) / 1000.0
+    values = np.cumsum(np.random.RandomState(0).normal(size=num_samples))
+    step_times = np.linspace(0.0, timestamps[-1], num_steps + 1)
+    starts = step_times[:-1] + (step_times[1] - step_times[0]) / 3
+    ends = step_times[1:]
+
+    def loop_statistics():
+        statistics = []
+        for start, end in zip(starts, ends):
+            samples = values[(timestamps >= start) & (timestamps < end)]
+            statistics.append((len(samples), samples.mean(), samples.std(), samples.min(), samples.max()))
+        return np.array(statistics).T
+
+    loop_time, loop_result = time_function(loop_statistics, (), runs)
+    vectorized_time, result = time_function(SegmentStatistics.from_time_windows,
+                                            (timestamps, values, starts, ends), runs)
+
+    vectorized_result = np.array([result.count, result.mean, result.std, result.min, result.max])
+    print("segment statistics, %s samples, %s steps:" % (num_samples, num_steps))
+    print("    loop: %0.2fms" % (loop_time * 1000.0))
+    print("    searchsorted/reduceat: %0.2fms (%0.1fx faster, max difference %0.1e)" % (
+        vectorized_time * 1000.0, loop_time / vectorized_time, np.max(np.abs(vectorized_result - loop_result))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the analysis functions against their original versions")
+    parser.add_argument("--repeats", type=int, default=20, help="staircase cycles in each motor direction")
+    parser.add_argument("--max-torque-command", type=int, default=255)
+    parser.add_argument("--num-samples", type=int, default=400000, help="encoder samples to smooth")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="samples per chunk when smoothing as a stream")
+    parser.add_argument("--num-steps", type=int, default=2000, help="steps to split the samples into")
+    parser.add_argument("--runs", type=int, default=3, help="the best of this many runs is reported")
+    args = parser.parse_args()
+
+    benchmark_format_torque_data(args.repeats, args.max_torque_command, args.runs)
+    benchmark_savitzky_golay(args.num_samples, args.chunk_size, args.runs)
+    benchmark_segment_statistics(args.num_samples, args.num_steps, args.runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Binary framing for the enc stream. Enabled on the device with the f1 command (f0 goes back to text enc
+packets).
+
+Instead of one text enc packet per sample, Prototype2.ino packs FRAME_RECORDS samples into a frame and
+sends it base64 encoded as the only field of an encb packet. All values are little endian:
+
+    header   uint16 sequence number, uint8 record count, uint32 micros() of the first record,
+             uint32 micros() when the frame was sent
+    records  float32 encoder 1 angle, float32 encoder 2 angle, uint16 encoder 1 analog value,
+             uint16 encoder 2 analog value, uint16 microseconds since the first record
+    trailer  uint16 Fletcher-16 checksum of everything before it
+
+The encb packet's timestamp is when the frame was sent, record timestamps are worked out from the
+difference between each record's micros() and the send micros() so they're on the same clock as every
+other packet.
+"""
+
+import base64
+
+import numpy as np
+
+FRAME_RECORDS = 8  # must match Prototype2.ino
+
+HEADER_DTYPE = np.dtype([
+    ("sequence", "<u2"), ("count", "u1"), ("first_us", "<u4"), ("send_us", "<u4"),
+])
+RECORD_DTYPE = np.dtype([
+    ("encoder1", "<f4"), ("encoder2", "<f4"), ("analog1", "<u2"), ("analog2", "<u2"), ("offset_us", "<u2"),
+])
+CHECKSUM_SIZE = 2
+
+
+class FrameError(Exception):
+    pass
+
+
+def fletcher16(data):
+    """Fletcher-16 of a bytes object, summed in one pass with numpy instead of byte by byte"""
+    values = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+    sum1 = int(values.sum()) % 255
+    # every byte is added into sum2 once for itself and each byte after it
+    sum2 = int(np.dot(values, np.arange(len(values), 0, -1))) % 255
+    return (sum2 << 8) | sum1
+
+
+def encode_frame(sequence, first_us, send_us, records):
+    """Pack a RECORD_DTYPE array into a frame. This is what the firmware does, used by the simulator"""
+    header = np.array([(sequence & 0xffff, len(records), first_us & 0xffffffff, send_us & 0xffffffff)],
+                      dtype=HEADER_DTYPE)
+    frame = header.tobytes() + np.asarray(records, dtype=RECORD_DTYPE).tobytes()
+    frame += np.array([fletcher16(frame)], dtype="<u2").tobytes()
+    return base64.b64encode(frame).decode()
+
+
+class FrameDecoder:
+    """
+    Decodes encb packets into arrays. Frames with a bad checksum or the wrong length raise a FrameError and
+    are counted. Gaps in the sequence numbers are counted as lost frames.
+    """
+
+    def __init__(self):
+        self.next_sequence = None
+        self.num_frames = 0
+        self.lost_frames = 0
+        self.bad_frames = 0
+
+    def decode(self, payload, timestamp):
+        """
+        Returns (timestamps, data) where timestamps is an (n,) array and data is an (n, 4) array laid out
+        like the enc packet's data: encoder 1 angle, encoder 2 angle, encoder 1 analog, encoder 2 analog
+        """
+        try:
+            frame = base64.b64decode(payload, validate=True)
+        except (ValueError, TypeError):
+            self.bad_frames += 1
+            raise FrameError("Frame isn't valid base64")
+
+        if len(frame) < HEADER_DTYPE.itemsize + CHECKSUM_SIZE:
+            self.bad_frames += 1
+            raise FrameError("Frame is too short (%s bytes)" % len(frame))
+
+        checksum = int(np.frombuffer(frame, dtype="<u2", offset=len(frame) - CHECKSUM_SIZE)[0])
+        if checksum != fletcher16(frame[:-CHECKSUM_SIZE]):
+            self.bad_frames += 1
+            raise FrameError("Frame checksum doesn't match")
+
+        header = np.frombuffer(frame, dtype=HEADER_DTYPE, count=1)[0]
+        count = int(header["count"])
+        if len(frame) != HEADER_DTYPE.itemsize + count * RECORD_DTYPE.itemsize + CHECKSUM_SIZE:
+            self.bad_frames += 1
+            raise FrameError("Frame length doesn't match its record count (%s)" % count)
+
+        sequence = int(header["sequence"])
+        if self.next_sequence is not None and sequence != self.next_sequence:
+            self.lost_frames += (sequence - self.next_sequence) & 0xffff
+        self.next_sequence = (sequence + 1) & 0xffff
+        self.num_frames += 1
+
+        records = np.frombuffer(frame, dtype=RECORD_DTYPE, count=count, offset=HEADER_DTYPE.itemsize)
+
+        # micros() wraps around every ~71 minutes, the uint32 subtraction takes care of it
+        send_delay_us = (int(header["send_us"]) - int(header["first_us"])) & 0xffffffff
+        timestamps = timestamp - (send_delay_us - records["offset_us"].astype(np.float64)) * 1E-6
+
+        data = np.empty((count, 4))
+        data[:, 0] = records["encoder1"]
+        data[:, 1] = records["encoder2"]
+        data[:, 2] = records["analog1"]
+        data[:, 3] = records["analog2"]
+
+        return timestamps, data
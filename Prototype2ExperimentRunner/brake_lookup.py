@@ -0,0 +1,38 @@
+import numpy as np
+
+from experiment_info import ExperimentInfo
+
+
+def get_lookup_paths(brake_type):
+    brake_type_file_name = ExperimentInfo.get_paths(brake_type)
+    return ("lookup_tables/%s_ascending.csv" % str(brake_type_file_name),
+            "lookup_tables/%s_descending.csv" % str(brake_type_file_name))
+
+
+def get_lookup_tables(brake_type):
+    ascending_lookup_filename, descending_lookup_filename = get_lookup_paths(brake_type)
+    with open(ascending_lookup_filename, 'r') as file:
+        data = file.read().splitlines()
+        ascending_command_to_torque = list(map(float, data))
+
+    with open(descending_lookup_filename, 'r') as file:
+        data = file.read().splitlines()
+        descending_command_to_torque = list(map(float, data))
+
+    return ascending_command_to_torque, descending_command_to_torque
+
+
+def commands_to_torque(torque_commands, ascending_command_to_torque, descending_command_to_torque):
+    """
+    Convert brake commands (with repeats removed) to torque in Nm. A command is rising, and looked up in the
+    ascending table, if the next command is larger. Otherwise (including the last command) it's looked up in
+    the descending table. analyze_experiment and the bridge's online stiffness estimate both go through here
+    """
+    torque_commands = np.asarray(torque_commands)
+    rising = np.zeros(len(torque_commands), dtype=bool)
+    rising[:-1] = np.diff(torque_commands) > 0
+
+    command_indices = torque_commands.astype(int)
+    return np.where(rising,
+                    np.take(np.asarray(ascending_command_to_torque, dtype=float), command_indices),
+                    np.take(np.asarray(descending_command_to_torque, dtype=float), command_indices))
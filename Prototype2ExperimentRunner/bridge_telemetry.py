@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import bisect
+from collections import deque
+
+# histogram bin edges in milliseconds
+INTERVAL_BIN_EDGES_MS = (0.0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0, 50.0, 100.0, 1000.0)
+LATENCY_BIN_EDGES_MS = (0.0, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0, 5000.0)
+
+
+class Histogram:
+    def __init__(self, bin_edges):
+        self.bin_edges = bin_edges
+        self.counts = [0] * (len(bin_edges) + 1)  # the last bin holds everything past the last edge
+        self.total = 0
+        self.max_value = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_right(self.bin_edges, value)] += 1
+        self.total += 1
+        self.max_value = max(self.max_value, value)
+
+    def percentile(self, percent):
+        """Upper edge of the bin the percentile falls in"""
+        if self.total == 0:
+            return 0.0
+
+        threshold = self.total * percent / 100.0
+        count = 0
+        for index, bin_count in enumerate(self.counts):
+            count += bin_count
+            if count >= threshold:
+                return self.bin_edges[index] if index < len(self.bin_edges) else self.max_value
+
+        return self.max_value
+
+    def to_dict(self):
+        return {"bin_edges": list(self.bin_edges), "counts": self.counts, "max": self.max_value}
+
+
+class BridgeTelemetry:
+    """
+    Tracks the health of the device link:
+    - the interval between enc packets according to the device's timestamps
+    - how late packets arrive on the host. The device and host clocks aren't synchronized, so latency is
+      measured relative to the smallest (receive time - device timestamp) seen so far
+    - gaps in the enc stream that suggest packets were dropped
+    - the time from sending a brake or motor command to receiving its echo. Commands queued behind pauses
+      go out later, when is estimated by the bridge. Echoes are matched to commands by value, in order, so
+      an echo that arrives before that estimate still answers its command, it just can't be timed
+    """
+
+    def __init__(self, summary_interval=10.0, gap_factor=3.0):
+        self.summary_interval = summary_interval
+        self.gap_factor = gap_factor
+
+        self.interval_histogram = Histogram(INTERVAL_BIN_EDGES_MS)
+        self.latency_histogram = Histogram(LATENCY_BIN_EDGES_MS)
+        self.echo_histograms = {"brake": Histogram(LATENCY_BIN_EDGES_MS), "motor": Histogram(LATENCY_BIN_EDGES_MS)}
+
+        self.num_packets = 0
+        self.first_timestamp = None
+        self.prev_timestamp = None
+        self.average_interval = None
+        self.min_clock_offset = None
+
+        self.num_gaps = 0
+        self.estimated_dropped_packets = 0
+
+        self.pending_commands = {"brake": deque(), "motor": deque()}
+        self.unanswered_commands = {"brake": 0, "motor": 0}
+        self.early_echoes = {"brake": 0, "motor": 0}  # echoed before the estimated send time, so not timed
+
+        self.last_summary_time = time.time()
+
+    def record_packet(self, timestamp, receive_time):
+        self.num_packets += 1
+
+        clock_offset = receive_time - timestamp
+        if self.min_clock_offset is None or clock_offset < self.min_clock_offset:
+            self.min_clock_offset = clock_offset
+        self.latency_histogram.add((clock_offset - self.min_clock_offset) * 1000.0)
+
+        if self.prev_timestamp is None:
+            self.first_timestamp = timestamp
+        else:
+            interval = timestamp - self.prev_timestamp
+            self.interval_histogram.add(interval * 1000.0)
+
+            if self.average_interval is None:
+                self.average_interval = interval
+            elif interval > self.average_interval * self.gap_factor:
+                self.num_gaps += 1
+                self.estimated_dropped_packets += int(round(interval / self.average_interval)) - 1
+            else:
+                self.average_interval += (interval - self.average_interval) * 0.01
+
+        self.prev_timestamp = timestamp
+
+    def record_command(self, kind, value, send_time):
+        self.pending_commands[kind].append((value, send_time))
+
+    def record_echo(self, kind, value, receive_time):
+        pending = self.pending_commands[kind]
+        for index, (command_value, send_time) in enumerate(pending):
+            if command_value == value:
+                break
+        else:
+            return  # not a command the bridge sent, e.g. a step of a precompiled schedule
+
+        # commands are echoed in order, the ones sent before this one were lost
+        for _ in range(index):
+            pending.popleft()
+            self.unanswered_commands[kind] += 1
+        command_value, send_time = pending.popleft()
+        if receive_time >= send_time:
+            self.echo_histograms[kind].add((receive_time - send_time) * 1000.0)
+        else:
+            self.early_echoes[kind] += 1
+
+    def count_unanswered(self, now):
+        """Unanswered commands, including those still pending that should have gone out before now"""
+        return {kind: count + sum(send_time <= now for value, send_time in self.pending_commands[kind])
+                for kind, count in self.unanswered_commands.items()}
+
+    def count_unsent(self, now):
+        """Commands still queued behind pauses, the run ended before they went out"""
+        return {kind: sum(send_time > now for value, send_time in pending)
+                for kind, pending in self.pending_commands.items()}
+
+    def packet_rate(self):
+        if self.prev_timestamp is None or self.prev_timestamp == self.first_timestamp:
+            return 0.0
+        return (self.num_packets - 1) / (self.prev_timestamp - self.first_timestamp)
+
+    def summary(self):
+        now = time.time()
+        return {
+            "num_packets": self.num_packets,
+            "packet_rate_hz": self.packet_rate(),
+            "interval_ms": self.interval_histogram.to_dict(),
+            "latency_ms": self.latency_histogram.to_dict(),
+            "num_gaps": self.num_gaps,
+            "estimated_dropped_packets": self.estimated_dropped_packets,
+            "command_echo_ms": {kind: histogram.to_dict() for kind, histogram in self.echo_histograms.items()},
+            "unanswered_commands": self.count_unanswered(now),
+            "unsent_commands": self.count_unsent(now),
+            "early_echoes": self.early_echoes,
+        }
+
+    def summary_string(self):
+        unanswered = self.count_unanswered(time.time())
+        return "%0.1f packets/s, interval p50 %sms p99 %sms, latency p50 %sms p99 %sms, %s gaps (~%s dropped), " \
+               "brake echo p50 %sms (%s unanswered), motor echo p50 %sms (%s unanswered)" % (
+                   self.packet_rate(),
+                   self.interval_histogram.percentile(50), self.interval_histogram.percentile(99),
+                   self.latency_histogram.percentile(50), self.latency_histogram.percentile(99),
+                   self.num_gaps, self.estimated_dropped_packets,
+                   self.echo_histograms["brake"].percentile(50), unanswered["brake"],
+                   self.echo_histograms["motor"].percentile(50), unanswered["motor"],
+               )
+
+    def print_summary_periodically(self):
+        if time.time() - self.last_summary_time >= self.summary_interval:
+            self.last_summary_time = time.time()
+            print(self.summary_string())
+
+    def write(self, path):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w+') as file:
+            json.dump(self.summary(), file)
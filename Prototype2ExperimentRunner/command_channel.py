@@ -0,0 +1,129 @@
+import time
+import asyncio
+from collections import deque
+
+PENDING = "pending"  # sent or waiting to be sent, not echoed yet
+APPLIED = "applied"  # the device echoed the latest value
+LOST = "lost"  # sent, but no echo came back within echo_timeout
+
+
+class ActuatorState:
+    def __init__(self, kind):
+        self.kind = kind
+        self.requested = None  # the latest value asked for
+        self.unsent = None  # the value waiting for the rate limit, replaced if a newer one comes in
+        self.applied = None  # the latest value the device echoed
+        self.in_flight = deque()  # (value, send time) of commands that haven't been echoed, oldest first
+        self.round_trip_time = None  # seconds from writing the last matched command to receiving its echo
+        self.num_coalesced = 0
+        self.num_lost = 0
+
+    def status(self, echo_timeout):
+        if self.unsent is not None:
+            return PENDING
+        if len(self.in_flight) > 0:
+            if time.time() - self.in_flight[-1][1] > echo_timeout:
+                return LOST
+            return PENDING
+        return APPLIED
+
+
+class CommandChannel:
+    """
+    Sends brake and motor commands from interactive controls (see gui/control_ui.py) to a Prototype2bridge.
+
+    Only the latest value per actuator is kept until it's written, so a burst of updates turns into one
+    command. Writes to the serial link are at least min_interval seconds apart. The device echoes every
+    command it applies, echoes are matched to commands in order to know what's been applied and how long
+    the round trip took. An echo whose value isn't in flight came from some other command (the running
+    profile's), it only updates the applied value.
+    """
+
+    def __init__(self, bridge, min_interval=0.05, echo_timeout=1.0):
+        self.bridge = bridge
+        self.min_interval = min_interval
+        self.echo_timeout = echo_timeout
+
+        self.actuators = {"brake": ActuatorState("brake"), "motor": ActuatorState("motor")}
+        self.queue = deque()  # kinds with an unsent value, in the order they were requested
+        self.last_write_time = 0.0
+        self.flush_handle = None
+
+    def set(self, kind, value):
+        actuator = self.actuators[kind]
+        actuator.requested = value
+        if actuator.unsent is None:
+            self.queue.append(kind)
+        else:
+            actuator.num_coalesced += 1
+        actuator.unsent = value
+        self.flush()
+
+    def flush(self):
+        """Write the next unsent value if the rate limit allows it, otherwise try again once it does"""
+        if self.flush_handle is not None or len(self.queue) == 0:
+            return
+
+        wait_time = self.last_write_time + self.min_interval - time.time()
+        if wait_time > 0.0:
+            self.flush_handle = asyncio.get_event_loop().call_later(wait_time, self.scheduled_flush)
+            return
+
+        kind = self.queue.popleft()
+        actuator = self.actuators[kind]
+        value = actuator.unsent
+        actuator.unsent = None
+
+        self.last_write_time = time.time()
+        actuator.in_flight.append((value, self.last_write_time))
+        if kind == "brake":
+            self.bridge.command_brake(value)
+        else:
+            self.bridge.command_motor(value)
+
+        if len(self.queue) > 0:
+            self.flush_handle = asyncio.get_event_loop().call_later(self.min_interval, self.scheduled_flush)
+
+    def scheduled_flush(self):
+        self.flush_handle = None
+        self.flush()
+
+    def record_echo(self, kind, value, receive_time):
+        """Called by the bridge for every brake or motor packet"""
+        actuator = self.actuators[kind]
+        actuator.applied = value
+
+        in_flight = actuator.in_flight
+        for index, (command_value, send_time) in enumerate(in_flight):
+            if command_value == value and send_time <= receive_time:
+                break
+        else:
+            return  # not one of ours
+
+        # commands are echoed in order, the ones sent before this one were lost
+        for _ in range(index):
+            in_flight.popleft()
+            actuator.num_lost += 1
+        command_value, send_time = in_flight.popleft()
+        actuator.round_trip_time = receive_time - send_time
+
+    def status(self, kind):
+        return self.actuators[kind].status(self.echo_timeout)
+
+    def status_string(self, kind):
+        actuator = self.actuators[kind]
+        status = actuator.status(self.echo_timeout)
+        if status == APPLIED:
+            if actuator.applied is None:
+                return "%s: -" % kind
+            if actuator.round_trip_time is None:
+                return "%s: %s applied" % (kind, actuator.applied)
+            return "%s: %s applied (round trip %0.1fms)" % (
+                kind, actuator.applied, actuator.round_trip_time * 1000.0)
+        return "%s: %s %s (device at %s)" % (
+            kind, actuator.requested, status, "-" if actuator.applied is None else actuator.applied)
+
+    def cancel(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
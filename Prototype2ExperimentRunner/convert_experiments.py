@@ -0,0 +1,75 @@
+import os
+import argparse
+
+import numpy as np
+
+import experiment_format
+from experiment_info import ExperimentInfo
+from experiment_catalog import experiment_file_pattern
+
+
+def find_json_experiments(experiments_dir):
+    """Only files named like experiment runs, so the catalog's index and other JSON files are left alone"""
+    for dirpath, dirnames, filenames in os.walk(experiments_dir):
+        for filename in sorted(filenames):
+            match = experiment_file_pattern.match(filename)
+            if match is not None and match.group(3) in ("json", "jsonl"):
+                yield os.path.join(dirpath, filename)
+
+
+def convert_experiment(path, codec="zlib", remove_original=False):
+    """Convert one JSON experiment (or .jsonl recording) to the binary format. Returns the new file's path"""
+    experiment_info = ExperimentInfo.load_from_file(path)
+    new_path = os.path.splitext(path)[0] + "." + experiment_format.EXTENSION
+
+    streams = {stream: getattr(experiment_info, stream) for stream in ExperimentInfo.SAMPLE_COLUMNS}
+    experiment_format.write_experiment(new_path, experiment_info.get_metadata(), streams, codec)
+
+    # make sure nothing was lost before getting rid of the original
+    converted = ExperimentInfo.load_from_file(new_path)
+    for stream in ExperimentInfo.SAMPLE_COLUMNS:
+        if not np.array_equal(np.array(getattr(converted, stream)), np.array(getattr(experiment_info, stream))):
+            os.remove(new_path)
+            raise ValueError("'%s' didn't survive conversion. Stream '%s' doesn't match" % (path, stream))
+
+    if remove_original:
+        os.remove(path)
+
+    return new_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the JSON experiment archive to the binary format")
+    parser.add_argument("experiments_dir", nargs="?", default="experiments")
+    parser.add_argument("--codec", default="zlib", choices=experiment_format.CODECS)
+    parser.add_argument("--remove-original", action="store_true", help="delete JSON files after converting them")
+    parser.add_argument("--overwrite", action="store_true", help="convert files that were already converted")
+    args = parser.parse_args()
+
+    total_original_size = 0
+    total_new_size = 0
+    for path in find_json_experiments(args.experiments_dir):
+        new_path = os.path.splitext(path)[0] + "." + experiment_format.EXTENSION
+        if os.path.isfile(new_path) and not args.overwrite:
+            print("skipping '%s', already converted" % path)
+            continue
+
+        original_size = os.path.getsize(path)
+        try:
+            convert_experiment(path, args.codec, args.remove_original)
+        except ValueError as error:
+            print("failed to convert '%s': %s" % (path, error))
+            continue
+
+        new_size = os.path.getsize(new_path)
+        total_original_size += original_size
+        total_new_size += new_size
+        print("%s: %0.1f KB -> %0.1f KB" % (path, original_size / 1000, new_size / 1000))
+
+    if total_original_size > 0:
+        print("total: %0.1f MB -> %0.1f MB (%0.1fx smaller)" % (
+            total_original_size / 1e6, total_new_size / 1e6, total_original_size / total_new_size))
+
+
+if __name__ == '__main__':
+    main()
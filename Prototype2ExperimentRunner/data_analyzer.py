@@ -1,5 +1,4 @@
 import os
-import math
 # import scipy
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,9 +6,22 @@ import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 
 from experiment_info import *
+from experiment_catalog import ExperimentCatalog
+from smoothing import savitzky_golay
+from analysis_cache import AnalysisCache, hash_files
+from segment_statistics import SegmentStatistics
+from brake_lookup import get_lookup_paths, get_lookup_tables, commands_to_torque
 
 current_fig_num = 0
 
+# encoder stage parameters
+OUTLIER_STD_DEVS = 6  # encoder deltas this many standard deviations from the mean are removed
+SMOOTHING_WINDOW = 501
+SMOOTHING_ORDER = 5
+
+# part of every cache key, bump it when a stage's outputs change
+ANALYSIS_CACHE_VERSION = 1
+
 
 def press(event):
     """matplotlib key press event. Close all figures when q is pressed"""
@@ -47,125 +59,110 @@ def save_fig(title, brake_type_file_name, conical_annulus_params, experiment_tim
     plt.savefig(path, dpi=200)
 
 
-def savitzky_golay(y, window_size, order, deriv=0, rate=1):
-    try:
-        window_size = np.abs(np.int(window_size))
-        order = np.abs(np.int(order))
-    except ValueError:
-        raise ValueError("window_size and order have to be of type int")
-
-    if window_size % 2 != 1 or window_size < 1:
-        raise TypeError("window_size size must be a positive odd number")
-
-    if window_size < order + 2:
-        raise TypeError("window_size is too small for the polynomials order")
-
-    order_range = range(order + 1)
-    half_window = (window_size - 1) // 2
-    # precompute coefficients
-    b = np.mat([[k ** i for i in order_range] for k in range(-half_window, half_window + 1)])
-    m = np.linalg.pinv(b).A[deriv] * rate ** deriv * math.factorial(deriv)
-    # pad the signal at the extremes with
-    # values taken from the signal itself
-    firstvals = y[0] - np.abs(y[1:half_window + 1][::-1] - y[0])
-    lastvals = y[-1] + np.abs(y[-half_window - 1:-1][::-1] - y[-1])
-    y = np.concatenate((firstvals, y, lastvals))
-    return np.convolve(m[::-1], y, mode='valid')
-
-
-def get_lookup_tables(brake_type):
-    brake_type_file_name = ExperimentInfo.get_paths(brake_type)
-    ascending_lookup_filename = "lookup_tables/%s_ascending.csv" % str(brake_type_file_name)
-    with open(ascending_lookup_filename, 'r') as file:
-        data = file.read().splitlines()
-        ascending_command_to_torque = list(map(float, data))
-
-    descending_lookup_filename = "lookup_tables/%s_descending.csv" % str(brake_type_file_name)
-    with open(descending_lookup_filename, 'r') as file:
-        data = file.read().splitlines()
-        descending_command_to_torque = list(map(float, data))
-
-    return ascending_command_to_torque, descending_command_to_torque
+def get_lookup_version(brake_type):
+    """A hash of the lookup tables, so cached torques are recomputed if the tables are regenerated"""
+    return hash_files(*get_lookup_paths(brake_type))
 
 
 def format_torque_data(experiment_info, ascending_command_to_torque, descending_command_to_torque, settling_time):
-    commanded_torque_data = np.array(experiment_info.commanded_torque_data)
-    torque_timestamps = commanded_torque_data[:, 0] + settling_time  # account for settling time
-    torque_commands = commanded_torque_data[:, 1]
+    torque_timestamps = experiment_info.commanded_torque_data.column("timestamp") + settling_time  # account for settling time
+    torque_commands = experiment_info.commanded_torque_data.column("command")
 
     # remove repeating commands
     repeating_indices = np.where(np.diff(torque_commands) == 0)
     torque_timestamps = np.delete(torque_timestamps, repeating_indices)
     torque_commands = np.delete(torque_commands, repeating_indices)
 
-    # find all zero peaks
+    # find all zero peaks, the first zero command of each run of them
     all_indices_of_zero_torque = np.where(torque_commands == 0)[0]
-    prev_index = all_indices_of_zero_torque[0]
-    zero_torque_valleys = [prev_index]
-    for index in all_indices_of_zero_torque:
-        if index - prev_index > 1:
-            zero_torque_valleys.append(index)
-        prev_index = index
+    zero_torque_valleys = np.append(all_indices_of_zero_torque[0],
+                                    all_indices_of_zero_torque[1:][np.diff(all_indices_of_zero_torque) > 1])
 
-    # where the repeat occurs is when the motor changes directions
-    direction_transition = zero_torque_valleys[experiment_info.repeats]
-
-    # find all rising and falling transitions
-    rising_indices = np.where(np.diff(torque_commands) > 0)[0]
+    # where the repeat occurs is when the motor changes directions. Experiments stopped early once their
+    # stiffness estimate converged may not have gotten that far
+    if len(zero_torque_valleys) > experiment_info.repeats:
+        direction_transition = zero_torque_valleys[experiment_info.repeats]
+    else:
+        direction_transition = len(torque_commands)
 
     # convert command to nm according to direction and whether the torque is rising or falling
-    commanded_torque_nm_data = []
-    for torque_index in range(len(torque_commands)):
-        commanded_torque = torque_commands[torque_index]
-        if torque_index in rising_indices:
-            commanded_torque_nm_data.append(ascending_command_to_torque[int(commanded_torque)])
-        else:
-            commanded_torque_nm_data.append(descending_command_to_torque[int(commanded_torque)])
-
-        if torque_index >= direction_transition:
-            commanded_torque_nm_data[-1] *= -1
+    commanded_torque_nm_data = commands_to_torque(torque_commands, ascending_command_to_torque,
+                                                  descending_command_to_torque)
 
-        if experiment_info.commanded_motor_speed < 0:
-            commanded_torque_nm_data[-1] *= -1
-
-    commanded_torque_nm_data = np.array(commanded_torque_nm_data)
+    second_direction = np.arange(len(torque_commands)) >= direction_transition
+    commanded_torque_nm_data[second_direction] *= -1
+    if experiment_info.commanded_motor_speed < 0:
+        commanded_torque_nm_data *= -1
 
     if len(experiment_info.commanded_motor_data) > 0:
-        selected_index = 0
-        for index in range(0, len(experiment_info.commanded_motor_data) - 1):
-            current_motor_command = experiment_info.commanded_motor_data[index][1]
-            prev_motor_command = experiment_info.commanded_motor_data[index + 1][1]
-            if current_motor_command != prev_motor_command:
-                selected_index = index + 1
-                break
-
-        direction_change_timestamp = experiment_info.commanded_motor_data[selected_index][0]
+        motor_commands = experiment_info.commanded_motor_data.column("command")
+        motor_changes = np.flatnonzero(np.diff(motor_commands) != 0)
+        selected_index = motor_changes[0] + 1 if len(motor_changes) > 0 else 0
+
+        direction_change_timestamp = experiment_info.commanded_motor_data.column("timestamp")[selected_index]
     else:
         direction_change_timestamp = 0.0
 
     return torque_timestamps, commanded_torque_nm_data, direction_change_timestamp
 
 
+def get_adaptive_settling_times(experiment_info):
+    """
+    Adaptively settled steps end as soon as the deflection is steady, so sample each torque command in the
+    middle of the window that was judged steady, just before the next command
+    """
+    torque_timestamps = experiment_info.commanded_torque_data.column("timestamp")
+    next_timestamps = np.append(torque_timestamps[1:], torque_timestamps[-1] + experiment_info.time_interval)
+    return np.maximum(next_timestamps - torque_timestamps - experiment_info.settling_params["window"] / 2, 0.0)
+
+
+def get_settled_windows(experiment_info):
+    """
+    The start and end time of the settled part of each torque command, for the same commands
+    format_torque_data keeps. Settled means from a third of the way through the step to the next command,
+    or the settling window just before the next command if the experiment was adaptively settled
+    """
+    torque_timestamps = experiment_info.commanded_torque_data.column("timestamp")
+    torque_commands = experiment_info.commanded_torque_data.column("command")
+    next_timestamps = np.append(torque_timestamps[1:], torque_timestamps[-1] + experiment_info.time_interval)
+
+    if experiment_info.settling_params is None:
+        starts = np.minimum(torque_timestamps + experiment_info.time_interval / 3, next_timestamps)
+    else:
+        starts = np.maximum(next_timestamps - experiment_info.settling_params["window"], torque_timestamps)
+
+    # format_torque_data keeps the last of each run of repeated commands
+    keep = np.append(np.diff(torque_commands) != 0, True)
+    return starts[keep], next_timestamps[keep]
+
+
 def format_encoder_data(experiment_info, direction_change_timestamp, gear_ratio, direction_switch_time_offset,
                         start_time_offset):
-    encoder_data = np.array(experiment_info.encoder_data)
-    encoder_timestamps = encoder_data[:, 0]
-    encoder_1_ticks = encoder_data[:, 1]
-    encoder_2_ticks = encoder_data[:, 2]
+    encoder_delta, encoder_timestamps, encoder_delta_smoothed, encoder_delta_filtered, encoder_timestamps_filtered = \
+        filter_encoder_data(experiment_info, gear_ratio)
+    encoder_delta_smoothed = correct_backlash(encoder_delta_smoothed, encoder_timestamps, direction_change_timestamp,
+                                              direction_switch_time_offset, start_time_offset)
 
-    # direction_change_index = 0
-    encoder_1_ticks -= encoder_1_ticks[0]
-    encoder_2_ticks -= encoder_2_ticks[0]
+    return encoder_delta, encoder_timestamps, encoder_delta_smoothed, encoder_delta_filtered, encoder_timestamps_filtered
+
+
+def filter_encoder_data(experiment_info, gear_ratio, outlier_std_devs=OUTLIER_STD_DEVS,
+                        smoothing_window=SMOOTHING_WINDOW, smoothing_order=SMOOTHING_ORDER):
+    # columns are views into experiment_info's buffers, so don't modify them in place
+    encoder_timestamps = experiment_info.encoder_data.column("timestamp")
+    encoder_1_ticks = experiment_info.encoder_data.column("encoder1")
+    encoder_2_ticks = experiment_info.encoder_data.column("encoder2")
 
-    encoder_1_ticks *= gear_ratio
-    encoder_2_ticks *= gear_ratio
+    # direction_change_index = 0
+    encoder_1_ticks = (encoder_1_ticks - encoder_1_ticks[0]) * gear_ratio
+    encoder_2_ticks = (encoder_2_ticks - encoder_2_ticks[0]) * gear_ratio
 
     encoder_delta = encoder_1_ticks - encoder_2_ticks
 
     # remove random jumps (software error)
     avg_diff = np.average(encoder_delta)
     std_dev = np.std(encoder_delta)
-    outlier_indices = np.where(np.abs(encoder_delta - avg_diff) > std_dev * 6)[0]
+    outlier_indices = np.where(np.abs(encoder_delta - avg_diff) > std_dev * outlier_std_devs)[0]
 
     encoder_delta_filtered = np.delete(encoder_delta, outlier_indices)
     encoder_timestamps_filtered = np.delete(encoder_timestamps, outlier_indices)
@@ -180,8 +177,15 @@ def format_encoder_data(experiment_info, direction_change_timestamp, gear_ratio,
     #     encoder_delta = np.delete(encoder_delta, deletion_indices)
     #     encoder_timestamps = np.delete(encoder_timestamps, deletion_indices)
 
-    encoder_delta_smoothed = savitzky_golay(encoder_delta_filtered, 501, 5)
+    encoder_delta_smoothed = savitzky_golay(encoder_delta_filtered, smoothing_window, smoothing_order)
+
+    return encoder_delta, encoder_timestamps, encoder_delta_smoothed, encoder_delta_filtered, encoder_timestamps_filtered
 
+
+def correct_backlash(encoder_delta_smoothed, encoder_timestamps, direction_change_timestamp,
+                     direction_switch_time_offset, start_time_offset):
+    """Returns a copy of the smoothed encoder delta with each motor direction's starting offset taken out"""
+    encoder_delta_smoothed = np.copy(encoder_delta_smoothed)
     if direction_change_timestamp > 0.0:
         direction_change_timestamp += direction_switch_time_offset  # add some time, wait for motor to actually change directions
         direction_change_index = np.argmin(np.abs(encoder_timestamps - direction_change_timestamp))
@@ -191,7 +195,7 @@ def format_encoder_data(experiment_info, direction_change_timestamp, gear_ratio,
         encoder_delta_smoothed[:direction_change_index] -= encoder_delta_smoothed[start_index]
         encoder_delta_smoothed[direction_change_index:] -= encoder_delta_smoothed[direction_change_index]
 
-    return encoder_delta, encoder_timestamps, encoder_delta_smoothed, encoder_delta_filtered, encoder_timestamps_filtered
+    return encoder_delta_smoothed
 
 
 def hysteresis_fn(x, a, b, c):
@@ -199,6 +203,87 @@ def hysteresis_fn(x, a, b, c):
     # return a * np.tan(b * x + c)
 
 
+def torque_stage(experiment_info, brake_type):
+    """The torque each command applied in Nm, timestamped once the command has settled"""
+    ascending_command_to_torque, descending_command_to_torque = get_lookup_tables(brake_type)
+
+    if experiment_info.settling_params is None:
+        settling_time = experiment_info.time_interval / 3
+    else:
+        settling_time = get_adaptive_settling_times(experiment_info)
+    torque_timestamps, commanded_torque_nm_data, direction_change_timestamp = \
+        format_torque_data(experiment_info, ascending_command_to_torque,
+                           descending_command_to_torque, settling_time)
+
+    return {
+        "torque_timestamps": torque_timestamps,
+        "commanded_torque_nm_data": commanded_torque_nm_data,
+        "direction_change_timestamp": np.array(direction_change_timestamp),
+        "settled_windows": np.array(get_settled_windows(experiment_info)),
+        "conical_annulus_in": np.array([experiment_info.conical_annulus_length_in,
+                                        experiment_info.conical_annulus_od_in,
+                                        experiment_info.conical_annulus_wall_thickness_in]),
+    }
+
+
+def encoder_stage(experiment_info, gear_ratio, outlier_std_devs, smoothing_window, smoothing_order):
+    """The encoder delta with outliers removed and smoothed"""
+    encoder_delta, encoder_timestamps, encoder_delta_smoothed, encoder_delta_filtered, encoder_timestamps_filtered = \
+        filter_encoder_data(experiment_info, gear_ratio, outlier_std_devs, smoothing_window, smoothing_order)
+
+    return {
+        "encoder_timestamps": encoder_timestamps,
+        "encoder_delta_smoothed": encoder_delta_smoothed,
+        "encoder_delta_filtered": encoder_delta_filtered,
+        "encoder_timestamps_filtered": encoder_timestamps_filtered,
+    }
+
+
+def fit_stage(torque, encoder, direction_switch_time_offset, start_time_offset):
+    """
+    Corrects for backlash, samples the encoder delta at each settled torque and fits a line. A second line
+    is fit to the mean deflection over every settled sample of each step
+    """
+    encoder_delta_smoothed = correct_backlash(
+        encoder["encoder_delta_smoothed"], encoder["encoder_timestamps"], float(torque["direction_change_timestamp"]),
+        direction_switch_time_offset, start_time_offset
+    )
+    encoder_interp = np.interp(torque["torque_timestamps"], encoder["encoder_timestamps_filtered"],
+                               encoder_delta_smoothed)
+    polynomial = np.polyfit(encoder_interp, torque["commanded_torque_nm_data"], 1)
+
+    # the backlash correction is one offset per direction, take the same offsets out of the unsmoothed delta
+    encoder_delta_corrected = encoder["encoder_delta_filtered"] - (encoder["encoder_delta_smoothed"] -
+                                                                   encoder_delta_smoothed)
+    settled_starts, settled_ends = torque["settled_windows"]
+    step_deflection = SegmentStatistics.from_time_windows(encoder["encoder_timestamps_filtered"],
+                                                          encoder_delta_corrected, settled_starts, settled_ends)
+    settled_polynomial = fit_step_means(step_deflection, torque["commanded_torque_nm_data"])
+
+    return {
+        "encoder_interp": encoder_interp,
+        "polynomial": polynomial,
+        "step_count": step_deflection.count,
+        "step_mean": step_deflection.mean,
+        "step_std": step_deflection.std,
+        "step_min": step_deflection.min,
+        "step_max": step_deflection.max,
+        "settled_polynomial": settled_polynomial,
+    }
+
+
+def fit_step_means(step_deflection, commanded_torque_nm_data):
+    """
+    Fit torque against each step's mean deflection, weighted by how many samples the step had. Steps with
+    no settled samples (such as the ones before recording started) are left out
+    """
+    has_samples = step_deflection.count > 0
+    if np.count_nonzero(has_samples) < 2:
+        return np.full(2, np.nan)
+    return np.polyfit(step_deflection.mean[has_samples], commanded_torque_nm_data[has_samples], 1,
+                      w=np.sqrt(step_deflection.count[has_samples]))
+
+
 class ExperimentResults:
     def __init__(self):
         self.torque_input = None
@@ -206,6 +291,10 @@ class ExperimentResults:
         self.encoder_linear_regression = None
         self.lin_reg_coeffs = None
 
+        # every settled sample of each step, and the line fit to the step means
+        self.step_deflection = None
+        self.settled_lin_reg_coeffs = None
+
         self.length = 0.0
         self.outer_diameter = 0.0
         self.wall_thickness = 0.0
@@ -213,35 +302,73 @@ class ExperimentResults:
 
 
 def analyze_experiment(brake_type, conical_annulus_params, experiment_time, direction_switch_time_offset=0.5,
-                       start_time_offset=0.0):
+                       start_time_offset=0.0, cache=None):
+    """
+    The analysis runs in three stages: torque, encoder and fit. If USE_ANALYSIS_CACHE is set (or a cache is
+    given), each stage's output is cached and a stage only runs again if its inputs changed. Changing the
+    offsets only reruns the fit, and the experiment file isn't loaded at all if the other stages are cached
+    """
+    if cache is None and USE_ANALYSIS_CACHE:
+        cache = analysis_cache
+
     gear_ratio = 32.0 / 48.0
     results = ExperimentResults()
-    ascending_command_to_torque, descending_command_to_torque = get_lookup_tables(brake_type)
-
-    experiment_info = ExperimentInfo.load_from_json(brake_type, conical_annulus_params, experiment_time)
-
-    settling_time = experiment_info.time_interval / 3
-    torque_timestamps, commanded_torque_nm_data, direction_change_timestamp = \
-        format_torque_data(experiment_info, ascending_command_to_torque,
-                           descending_command_to_torque, settling_time)
-
-    format_enc_results = format_encoder_data(experiment_info, direction_change_timestamp, gear_ratio,
-                                             direction_switch_time_offset, start_time_offset)
-    # encoder_delta = results[0]
-    # encoder_timestamps = results[1]
-    encoder_delta_smoothed = format_enc_results[2]
-    encoder_delta_filtered = format_enc_results[3]
-    encoder_timestamps_filtered = format_enc_results[4]
-
-    encoder_interp = np.interp(torque_timestamps, encoder_timestamps_filtered, encoder_delta_smoothed)
+    path = ExperimentInfo.find_experiment_path(brake_type, conical_annulus_params, experiment_time)
+
+    torque = None
+    encoder = None
+    fit = None
+    if cache is not None:
+        file_hash = cache.hash_file(path)
+        torque_key = cache.key("torque", version=ANALYSIS_CACHE_VERSION, file_hash=file_hash,
+                               lookup_version=get_lookup_version(brake_type))
+        encoder_key = cache.key("encoder", version=ANALYSIS_CACHE_VERSION, file_hash=file_hash, gear_ratio=gear_ratio,
+                                outlier_std_devs=OUTLIER_STD_DEVS, smoothing_window=SMOOTHING_WINDOW,
+                                smoothing_order=SMOOTHING_ORDER)
+        fit_key = cache.key("fit", version=ANALYSIS_CACHE_VERSION, torque_key=torque_key, encoder_key=encoder_key,
+                            direction_switch_time_offset=direction_switch_time_offset,
+                            start_time_offset=start_time_offset)
+
+        torque = cache.load("torque", torque_key)
+        encoder = cache.load("encoder", encoder_key)
+        fit = cache.load("fit", fit_key)
+
+    if torque is None or encoder is None:
+        experiment_info = ExperimentInfo.load_from_file(path)
+        if torque is None:
+            torque = torque_stage(experiment_info, brake_type)
+            if cache is not None:
+                cache.save("torque", torque_key, torque)
+        if encoder is None:
+            encoder = encoder_stage(experiment_info, gear_ratio, OUTLIER_STD_DEVS, SMOOTHING_WINDOW,
+                                    SMOOTHING_ORDER)
+            if cache is not None:
+                cache.save("encoder", encoder_key, encoder)
+
+    if fit is None:
+        fit = fit_stage(torque, encoder, direction_switch_time_offset, start_time_offset)
+        if cache is not None:
+            cache.save("fit", fit_key, fit)
+
+    torque_timestamps = torque["torque_timestamps"]
+    commanded_torque_nm_data = torque["commanded_torque_nm_data"]
+    encoder_delta_filtered = encoder["encoder_delta_filtered"]
+    encoder_timestamps_filtered = encoder["encoder_timestamps_filtered"]
+    encoder_interp = fit["encoder_interp"]
+    polynomial = fit["polynomial"]
+    brake_type_file_name = ExperimentInfo.get_paths(brake_type)
 
-    polynomial = np.polyfit(encoder_interp, commanded_torque_nm_data, 1)
     linear_regression_fn = np.poly1d(polynomial)
     encoder_lin_reg = linear_regression_fn(encoder_interp)
 
     # popt, pcov = curve_fit(hysteresis_fn, encoder_interp, commanded_torque_nm_data)
 
     if PLOT_RESULTS:
+        encoder_delta_smoothed = correct_backlash(
+            encoder["encoder_delta_smoothed"], encoder["encoder_timestamps"],
+            float(torque["direction_change_timestamp"]), direction_switch_time_offset, start_time_offset
+        )
+
         new_fig()
         plt.plot(torque_timestamps, commanded_torque_nm_data, '.-', label="torque data")
 
@@ -250,7 +377,7 @@ def analyze_experiment(brake_type, conical_annulus_params, experiment_time, dire
         plt.xlabel("time (s)")
         plt.ylabel("applied torque (N•m)")
         if SAVE_FIGS:
-            save_fig(title, experiment_info.brake_type_file_name, conical_annulus_params, experiment_time)
+            save_fig(title, brake_type_file_name, conical_annulus_params, experiment_time)
 
         new_fig()
         # plt.plot(encoder_timestamps, encoder_delta, '-.', label="encoder delta", markersize=0.5)
@@ -264,7 +391,7 @@ def analyze_experiment(brake_type, conical_annulus_params, experiment_time, dire
         plt.xlabel("time (s)")
         plt.ylabel("encoder delta (degrees)")
         if SAVE_FIGS:
-            save_fig(title, experiment_info.brake_type_file_name, conical_annulus_params, experiment_time)
+            save_fig(title, brake_type_file_name, conical_annulus_params, experiment_time)
 
         new_fig()
         plt.plot(encoder_interp, commanded_torque_nm_data, 'x', label="data")
@@ -280,7 +407,7 @@ def analyze_experiment(brake_type, conical_annulus_params, experiment_time, dire
         plt.xlabel("encoder delta (degrees)")
         plt.ylabel("applied torque (N•m)")
         if SAVE_FIGS:
-            save_fig(title, experiment_info.brake_type_file_name, conical_annulus_params, experiment_time)
+            save_fig(title, brake_type_file_name, conical_annulus_params, experiment_time)
 
         plt.show()
 
@@ -288,9 +415,10 @@ def analyze_experiment(brake_type, conical_annulus_params, experiment_time, dire
     results.encoder_output = encoder_interp
     results.encoder_linear_regression = encoder_lin_reg
     results.lin_reg_coeffs = polynomial
-    results.length = experiment_info.conical_annulus_length_in
-    results.outer_diameter = experiment_info.conical_annulus_od_in
-    results.wall_thickness = experiment_info.conical_annulus_wall_thickness_in
+    results.step_deflection = SegmentStatistics(fit["step_count"], fit["step_mean"], fit["step_std"], fit["step_min"],
+                                                fit["step_max"])
+    results.settled_lin_reg_coeffs = fit["settled_polynomial"]
+    results.length, results.outer_diameter, results.wall_thickness = torque["conical_annulus_in"].tolist()
 
     color_offset = results.outer_diameter / 1.5
     color_strength = results.length / 2.0
@@ -319,32 +447,26 @@ def plot_combined_experiments(*results):
 
 SAVE_FIGS = False
 PLOT_RESULTS = False
+USE_ANALYSIS_CACHE = True
+analysis_cache = AnalysisCache()
 
-results_large_1 = analyze_experiment(ExperimentInfo.LARGE_BRAKE, "1.0x0.75x0.125", 1528141782.467071)
-# results_small_1 = analyze_experiment(ExperimentInfo.SMALL_BRAKE, "1.0x0.75x0.125", 1528165346.742316)
-# plot_combined_experiments(results_large_1, results_small_1)
-
-results_large_2 = analyze_experiment(ExperimentInfo.LARGE_BRAKE, "1.5x0.75x0.125", 1528522129.6387455)
-# results_small_2 = analyze_experiment(ExperimentInfo.SMALL_BRAKE, "1.5x0.75x0.125", 1528484673.3223443)
-# plot_combined_experiments(results_large_2, results_small_2)
-
-results_large_3 = analyze_experiment(ExperimentInfo.LARGE_BRAKE, "2.0x0.75x0.125", 1528652317.385782)
-# results_small_3 = analyze_experiment(ExperimentInfo.SMALL_BRAKE, "2.0x0.75x0.125", 1528686077.199882)
-# plot_combined_experiments(results_large_3, results_small_3)
 
-results_large_4 = analyze_experiment(ExperimentInfo.LARGE_BRAKE, "1.0x1.125x0.125", 1528919948.7649128)
-# results_small_4 = analyze_experiment(ExperimentInfo.SMALL_BRAKE, "1.0x1.125x0.125", 1528917061.037878)
-# plot_combined_experiments(results_large_4, results_small_4)
+def main():
+    catalog = ExperimentCatalog()
+    catalog.update()
 
-results_large_5 = analyze_experiment(ExperimentInfo.LARGE_BRAKE, "1.5x1.125x0.125", 1528999619.6089401)
-# results_small_5 = analyze_experiment(ExperimentInfo.SMALL_BRAKE, "1.5x1.125x0.125", 1529003381.230422)
-# plot_combined_experiments(results_large_5, results_small_5)
+    large_brake_results = [
+        analyze_experiment(entry.brake_type, entry.conical_annulus_params, entry.experiment_time)
+        for entry in catalog.latest(brake_type=ExperimentInfo.LARGE_BRAKE, done=True)
+    ]
+    plot_combined_experiments(*large_brake_results)
 
+    # small_brake_results = [
+    #     analyze_experiment(entry.brake_type, entry.conical_annulus_params, entry.experiment_time)
+    #     for entry in catalog.latest(brake_type=ExperimentInfo.SMALL_BRAKE, done=True)
+    # ]
+    # plot_combined_experiments(*small_brake_results)
 
-results_large_6 = analyze_experiment(ExperimentInfo.LARGE_BRAKE, "2.0x1.125x0.125", 1529093204.900008)
-# results_small_6 = analyze_experiment(ExperimentInfo.SMALL_BRAKE, "2.0x1.125x0.125", 1529091554.6897202, 1.0)
-# plot_combined_experiments(results_large_6, results_small_6)
 
-plot_combined_experiments(results_large_1, results_large_2, results_large_3, results_large_4, results_large_5,
-                          results_large_6)
-# plot_combined_experiments(results_small_2, results_small_3, results_small_4, results_small_5, results_small_6)
+if __name__ == '__main__':
+    main()
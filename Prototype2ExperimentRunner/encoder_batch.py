@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class EncoderBatch:
+    """
+    A block of enc packets sent to subscribers as one message.
+    timestamps is an (n,) array, data is an (n, 4) array whose columns match the enc packet's data:
+    encoder 1 angle, encoder 2 angle, encoder 1 analog value, encoder 2 analog value
+    """
+
+    name = "enc_batch"
+
+    def __init__(self, timestamps, data):
+        self.timestamps = timestamps
+        self.data = data
+
+    @property
+    def timestamp(self):
+        return self.timestamps[-1]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+class EncoderBatcher:
+    """Collects enc packets into preallocated arrays until batch_size packets or batch_interval seconds"""
+
+    def __init__(self, batch_size=100, batch_interval=0.05, num_fields=4):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self.timestamps = np.empty(batch_size)
+        self.data = np.empty((batch_size, num_fields))
+        self.size = 0
+
+    def add(self, timestamp, data):
+        """Add one sample. Returns a finished EncoderBatch or None"""
+        self.timestamps[self.size] = timestamp
+        self.data[self.size] = data
+        self.size += 1
+
+        if self.size == self.batch_size or timestamp - self.timestamps[0] >= self.batch_interval:
+            return self.flush()
+        else:
+            return None
+
+    def flush(self):
+        if self.size == 0:
+            return None
+
+        batch = EncoderBatch(self.timestamps[:self.size].copy(), self.data[:self.size].copy())
+        self.size = 0
+        return batch
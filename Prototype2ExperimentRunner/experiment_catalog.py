@@ -0,0 +1,206 @@
+import os
+import re
+import csv
+import json
+
+import experiment_format
+from experiment_info import ExperimentInfo
+
+# file formats in the order ExperimentInfo.load_from_json prefers them
+FORMATS = (experiment_format.EXTENSION, "json", "jsonl")
+
+experiment_file_pattern = re.compile(r"^(large_brake|small_brake)_(\d+(?:\.\d+)?)\.(%s)$" % "|".join(FORMATS))
+brake_types = {
+    ExperimentInfo.get_paths(ExperimentInfo.LARGE_BRAKE): ExperimentInfo.LARGE_BRAKE,
+    ExperimentInfo.get_paths(ExperimentInfo.SMALL_BRAKE): ExperimentInfo.SMALL_BRAKE,
+}
+
+
+def parse_conical_annulus_params(conical_annulus_params):
+    """'1.0x0.75x0.125' -> (1.0, 0.75, 0.125)"""
+    return tuple(float(value) for value in conical_annulus_params.split("x"))
+
+
+class CatalogEntry:
+    def __init__(self, path, conical_annulus_params, brake_type, experiment_time, file_format):
+        self.path = path
+        self.conical_annulus_params = conical_annulus_params
+        self.brake_type = brake_type
+        self.experiment_time = experiment_time  # as it appears in the file name
+        self.file_format = file_format
+
+        self.length, self.outer_diameter, self.wall_thickness = parse_conical_annulus_params(conical_annulus_params)
+        self.start_time = float(experiment_time)
+
+    @property
+    def size(self):
+        return self.length, self.outer_diameter, self.wall_thickness
+
+    def load(self, lazy=False):
+        return ExperimentInfo.load_from_file(self.path, lazy)
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "conical_annulus_params": self.conical_annulus_params,
+            "brake_type": self.brake_type,
+            "experiment_time": self.experiment_time,
+            "file_format": self.file_format,
+        }
+
+    def __repr__(self):
+        return "%s(%s, %s, %s)" % (
+            self.__class__.__name__, ExperimentInfo.get_paths(self.brake_type), self.conical_annulus_params,
+            self.experiment_time)
+
+
+class ExperimentCatalog:
+    """
+    Index over the experiments directory. Everything that's queried is encoded in the directory and file
+    names, so indexing never opens an experiment file. The index is saved next to the experiments and
+    update() only lists size directories whose modification time changed since the last update.
+    """
+
+    def __init__(self, experiments_dir="experiments", index_path=None, sizes_path="conical_annulus_sizes.csv"):
+        self.experiments_dir = experiments_dir
+        self.index_path = index_path if index_path is not None else os.path.join(experiments_dir, "catalog.json")
+        self.sizes_path = sizes_path
+
+        self.directory_mtimes = {}
+        self.entries = {}  # conical_annulus_params -> list of CatalogEntry
+        self.done_sizes = set()
+
+        self.load_index()
+        self.load_sizes()
+
+    def load_index(self):
+        if not os.path.isfile(self.index_path):
+            return
+
+        with open(self.index_path) as file:
+            index = json.load(file)
+
+        self.directory_mtimes = index["directory_mtimes"]
+        self.entries = {}
+        for entry in index["entries"]:
+            entry = CatalogEntry(**entry)
+            self.entries.setdefault(entry.conical_annulus_params, []).append(entry)
+
+    def save_index(self):
+        index = {
+            "directory_mtimes": self.directory_mtimes,
+            "entries": [entry.to_dict() for entries in self.entries.values() for entry in entries],
+        }
+        with open(self.index_path, 'w+') as file:
+            json.dump(index, file)
+
+    def load_sizes(self):
+        """Read which conical annulus sizes are marked as done"""
+        self.done_sizes = set()
+        if not os.path.isfile(self.sizes_path):
+            return
+
+        with open(self.sizes_path) as file:
+            for row in csv.DictReader(file):
+                if row["done"] == "y":
+                    self.done_sizes.add((float(row["length"]), float(row["outer diameter"]),
+                                         float(row["wall thickness"])))
+
+    def update(self):
+        """Bring the index up to date with the experiments directory. Returns True if anything changed."""
+        if not os.path.isdir(self.experiments_dir):
+            return False
+
+        changed = False
+        directories = set()
+        for directory in os.scandir(self.experiments_dir):
+            if not directory.is_dir():
+                continue
+            directories.add(directory.name)
+
+            mtime = directory.stat().st_mtime
+            if self.directory_mtimes.get(directory.name) == mtime:
+                continue
+
+            self.entries[directory.name] = self.index_directory(directory.path, directory.name)
+            self.directory_mtimes[directory.name] = mtime
+            changed = True
+
+        for removed in set(self.directory_mtimes) - directories:
+            del self.directory_mtimes[removed]
+            self.entries.pop(removed, None)
+            changed = True
+
+        if changed:
+            self.save_index()
+
+        return changed
+
+    def index_directory(self, path, conical_annulus_params):
+        try:
+            parse_conical_annulus_params(conical_annulus_params)
+        except ValueError:
+            return []
+
+        runs = {}
+        for filename in os.listdir(path):
+            match = experiment_file_pattern.match(filename)
+            if match is None:
+                continue
+
+            brake_type_file_name, experiment_time, file_format = match.groups()
+            key = (brake_type_file_name, experiment_time)
+
+            # if a run was converted, only keep the format it would be loaded from
+            if key in runs and FORMATS.index(runs[key].file_format) <= FORMATS.index(file_format):
+                continue
+
+            runs[key] = CatalogEntry(
+                os.path.join(path, filename), conical_annulus_params, brake_types[brake_type_file_name],
+                experiment_time, file_format
+            )
+
+        return sorted(runs.values(), key=lambda entry: entry.start_time)
+
+    def is_done(self, entry):
+        return entry.size in self.done_sizes
+
+    def query(self, brake_type=None, length=None, outer_diameter=None, wall_thickness=None, after=None,
+              before=None, done=None):
+        """
+        Find experiments matching all of the given filters, sorted by start time. after and before can be
+        unix timestamps or datetimes.
+        """
+        if hasattr(after, "timestamp"):
+            after = after.timestamp()
+        if hasattr(before, "timestamp"):
+            before = before.timestamp()
+
+        results = []
+        for entries in self.entries.values():
+            for entry in entries:
+                if brake_type is not None and entry.brake_type != brake_type:
+                    continue
+                if length is not None and entry.length != length:
+                    continue
+                if outer_diameter is not None and entry.outer_diameter != outer_diameter:
+                    continue
+                if wall_thickness is not None and entry.wall_thickness != wall_thickness:
+                    continue
+                if after is not None and entry.start_time < after:
+                    continue
+                if before is not None and entry.start_time > before:
+                    continue
+                if done is not None and self.is_done(entry) != done:
+                    continue
+                results.append(entry)
+
+        return sorted(results, key=lambda entry: entry.start_time)
+
+    def latest(self, **filters):
+        """The most recent experiment matching the filters for each conical annulus size, sorted by size"""
+        latest_entries = {}
+        for entry in self.query(**filters):
+            latest_entries[entry.size] = entry  # query results are in chronological order
+
+        return [latest_entries[size] for size in sorted(latest_entries)]
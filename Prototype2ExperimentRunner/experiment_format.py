@@ -0,0 +1,144 @@
+"""
+Compact binary experiment files (.p2e)
+
+The file starts with MAGIC, a little endian uint32 giving the length of a JSON header and the header
+itself. The header holds the experiment metadata and a table describing every sample column. Column
+payloads follow the header, each starting on an 8 byte boundary (offsets are relative to the start of the
+first payload).
+
+Columns are float64. Before compression, each column's bit patterns are reinterpreted as int64 and delta
+encoded (exact, unlike subtracting floats), then byte shuffled so the slowly changing high bytes of
+neighboring samples end up next to each other.
+"""
+
+import json
+import lzma
+import zlib
+import struct
+
+import numpy as np
+
+
+MAGIC = b"P2E\x01"
+EXTENSION = "p2e"
+CODECS = ("zlib", "lzma", "raw")
+
+_header_length_struct = struct.Struct("<I")
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def encode_column(values, codec="zlib"):
+    values = np.ascontiguousarray(values, dtype="<f8")
+    if codec == "raw":
+        return values.tobytes()
+
+    bits = values.view("<i8")
+    deltas = np.diff(bits, prepend=np.int64(0))  # wraps around on overflow, which cumsum undoes
+    shuffled = deltas.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+    if codec == "zlib":
+        return zlib.compress(shuffled, 9)
+    elif codec == "lzma":
+        return lzma.compress(shuffled)
+    else:
+        raise ValueError("Unknown column codec: '%s'" % codec)
+
+
+def decode_column(payload, codec, length):
+    if codec == "raw":
+        return np.frombuffer(payload, dtype="<f8", count=length)
+
+    if codec == "zlib":
+        shuffled = zlib.decompress(payload)
+    elif codec == "lzma":
+        shuffled = lzma.decompress(payload)
+    else:
+        raise ValueError("Unknown column codec: '%s'" % codec)
+
+    deltas = np.frombuffer(shuffled, dtype=np.uint8).reshape(8, length).T.copy().view("<i8").ravel()
+    return np.cumsum(deltas, dtype=np.int64).view("<f8")
+
+
+def write_experiment(path, metadata, streams, codec="zlib"):
+    """
+    Write an experiment to path. streams maps a stream name (ExperimentInfo attribute) to a SampleBuffer.
+    """
+    if codec not in CODECS:
+        raise ValueError("Unknown column codec: '%s'" % codec)
+
+    columns = []
+    payloads = []
+    offset = 0
+    for stream, buffer in streams.items():
+        for name in buffer.column_names:
+            payload = encode_column(buffer.column(name), codec)
+            columns.append({
+                "stream": stream, "name": name, "codec": codec,
+                "length": len(buffer), "offset": offset, "size": len(payload)
+            })
+            payloads.append(payload)
+            offset = _align(offset + len(payload))
+
+    header = json.dumps({"metadata": metadata, "columns": columns}).encode()
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(_header_length_struct.pack(len(header)))
+        file.write(header)
+        data_start = _align(file.tell())
+        for column, payload in zip(columns, payloads):
+            file.seek(data_start + column["offset"])
+            file.write(payload)
+
+
+def read_header(file):
+    """Read the header from an open file. Returns the header dictionary and where the column data starts"""
+    magic = file.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("'%s' is not a Prototype 2 experiment file" % file.name)
+
+    header_length = _header_length_struct.unpack(file.read(_header_length_struct.size))[0]
+    header = json.loads(file.read(header_length).decode())
+
+    return header, _align(file.tell())
+
+
+class ExperimentFile:
+    """
+    Opens a .p2e file by reading only its header. Sample columns are read when they're asked for. Raw
+    columns are memory-mapped, so only the pages that get touched are ever read from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.header, self.data_start = read_header(file)
+
+        self.metadata = self.header["metadata"]
+        self.streams = {}
+        for column in self.header["columns"]:
+            self.streams.setdefault(column["stream"], []).append(column)
+
+    def read_column(self, column):
+        if column["codec"] == "raw" and column["length"] > 0:
+            return np.memmap(self.path, dtype="<f8", mode='r', offset=self.data_start + column["offset"],
+                             shape=(column["length"],))
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.data_start + column["offset"])
+            return decode_column(file.read(column["size"]), column["codec"], column["length"])
+
+    def read_stream(self, stream):
+        """Returns a list of (column name, array) for the stream"""
+        return [(column["name"], self.read_column(column)) for column in self.streams[stream]]
+
+
+def read_experiment(path):
+    """Returns the experiment's metadata and a dictionary of stream name -> list of (column name, array)"""
+    experiment_file = ExperimentFile(path)
+    streams = {stream: experiment_file.read_stream(stream) for stream in experiment_file.streams}
+
+    return experiment_file.metadata, streams
@@ -2,11 +2,21 @@ import os
 import json
 import time
 
+import experiment_format
+from sample_buffer import SampleBuffer
+from experiment_recorder import ExperimentRecorder
+
 
 class ExperimentInfo:
     LARGE_BRAKE = 0
     SMALL_BRAKE = 1
 
+    SAMPLE_COLUMNS = {
+        "commanded_torque_data": ("timestamp", "command"),
+        "commanded_motor_data": ("timestamp", "command"),
+        "encoder_data": ("timestamp", "encoder1", "encoder2"),
+    }
+
     def __init__(self):
         self.brake_type = ExperimentInfo.LARGE_BRAKE
         self.conical_annulus_length = 0.0
@@ -23,16 +33,28 @@ class ExperimentInfo:
         self.max_torque_command = 0
         self.repeats = 0
         self.brake_type_file_name = ""
+        self.device_name = "prototype2"  # which rig ran the experiment
 
-        self.commanded_torque_data = []
-        self.commanded_motor_data = []
-        self.encoder_data = []
+        self.commanded_torque_data = SampleBuffer(self.SAMPLE_COLUMNS["commanded_torque_data"])
+        self.commanded_motor_data = SampleBuffer(self.SAMPLE_COLUMNS["commanded_motor_data"])
+        self.encoder_data = SampleBuffer(self.SAMPLE_COLUMNS["encoder_data"])
 
         self.start_time = time.time()
         self.initial_encoder_time = None
 
         self.encoder_start_values = [0.0, 0.0]
 
+        # only set for experiments run with adaptive settling
+        self.settling_params = None
+        self.step_dwell_times = []  # [timestamp the step started, dwell time, max dwell time] for each step
+
+        # only set for experiments run with an online stiffness estimate
+        self.stiffness_params = None
+        self.stiffness_estimate = None
+
+        self._recorder = None
+        self._experiment_file = None
+
     @classmethod
     def get_paths(cls, brake_type):
         if brake_type == ExperimentInfo.LARGE_BRAKE:
@@ -66,21 +88,54 @@ class ExperimentInfo:
         return new_obj
 
     @classmethod
-    def load_from_json(cls, brake_type, conical_annulus_params, experiment_time):
-        cm_to_in = 1 / 2.54
+    def load_from_json(cls, brake_type, conical_annulus_params, experiment_time, lazy=False):
+        """Load a saved experiment in whichever format it was saved as (.p2e, .json or a .jsonl recording)"""
+        return cls.load_from_file(cls.find_experiment_path(brake_type, conical_annulus_params, experiment_time), lazy)
+
+    @classmethod
+    def find_experiment_path(cls, brake_type, conical_annulus_params, experiment_time):
         brake_type_file_name = cls.get_paths(brake_type)
+        base_path = "experiments/%s/%s_%s" % (conical_annulus_params, brake_type_file_name, experiment_time)
 
-        with open(
-                "experiments/%s/%s_%s.json" % (conical_annulus_params, brake_type_file_name, experiment_time)) as file:
-            params = json.load(file)
+        for extension in (experiment_format.EXTENSION, "json", "jsonl"):
+            path = "%s.%s" % (base_path, extension)
+            if os.path.isfile(path):
+                return path
+
+        raise FileNotFoundError("No experiment file found matching '%s.*'" % base_path)
+
+    @classmethod
+    def load_from_file(cls, path, lazy=False):
+        """
+        If lazy is True and the file is in the binary format, only the metadata is read. Sample streams are
+        read (or memory-mapped) the first time they're accessed.
+        """
+        cm_to_in = 1 / 2.54
 
         new_obj = cls()
-        new_obj.__dict__ = params
+        if path.endswith("." + experiment_format.EXTENSION):
+            experiment_file = experiment_format.ExperimentFile(path)
+            params = dict(experiment_file.metadata)
+            new_obj._experiment_file = experiment_file
+            for stream in cls.SAMPLE_COLUMNS:
+                del new_obj.__dict__[stream]  # let __getattr__ load it
+            if not lazy:
+                for stream in cls.SAMPLE_COLUMNS:
+                    getattr(new_obj, stream)
+        elif path.endswith(".jsonl"):
+            # the run was streamed to disk and never written out as a whole
+            params = ExperimentRecorder.load(path)
+        else:
+            with open(path) as file:
+                params = json.load(file)
+
+        new_obj.__dict__.update(params)
         if "initial_encoder_time" not in params:
             new_obj.initial_encoder_time = new_obj.start_time
 
-        if "commanded_motor_data" not in params:
-            new_obj.commanded_motor_data = []
+        for stream, column_names in cls.SAMPLE_COLUMNS.items():
+            if stream in new_obj.__dict__ and not isinstance(getattr(new_obj, stream), SampleBuffer):
+                setattr(new_obj, stream, SampleBuffer.from_rows(column_names, getattr(new_obj, stream)))
 
         if "conical_annulus_length_in" not in params:
             new_obj.conical_annulus_length_in = round(new_obj.conical_annulus_length * cm_to_in, 4)
@@ -91,31 +146,109 @@ class ExperimentInfo:
 
         return new_obj
 
+    def __getattr__(self, name):
+        # only called when name isn't set, which is how sample streams of lazily loaded experiments get read
+        experiment_file = self.__dict__.get("_experiment_file")
+        if experiment_file is None or name not in self.SAMPLE_COLUMNS:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+        if name in experiment_file.streams:
+            columns = experiment_file.read_stream(name)
+            buffer = SampleBuffer.from_columns([column_name for column_name, values in columns],
+                                               [values for column_name, values in columns])
+        else:
+            # older experiments don't have commanded_motor_data
+            buffer = SampleBuffer(self.SAMPLE_COLUMNS[name])
+
+        setattr(self, name, buffer)
+        return buffer
+
     def record_torque_command(self, timestamp, command):
-        self.commanded_torque_data.append((timestamp, command))
+        self._record("commanded_torque_data", (timestamp, command))
 
     def record_motor_command(self, timestamp, command):
-        self.commanded_motor_data.append((timestamp, command))
+        self._record("commanded_motor_data", (timestamp, command))
 
     def record_encoders(self, timestamp, encoder1_deg, encoder2_deg):
-        self.encoder_data.append((timestamp, encoder1_deg, encoder2_deg))
+        self._record("encoder_data", (timestamp, encoder1_deg, encoder2_deg))
+
+    def _record(self, stream, sample):
+        if self._recorder is None:
+            getattr(self, stream).append(sample)
+        else:
+            self._recorder.record(stream, sample)
 
     def record_encoder_start_vals(self, timestamp, encoder1_deg, encoder2_deg):
         self.initial_encoder_time = timestamp
         self.encoder_start_values[0] = encoder1_deg
         self.encoder_start_values[1] = encoder2_deg
+        if self._recorder is not None:
+            self._recorder.update_metadata(initial_encoder_time=timestamp,
+                                           encoder_start_values=self.encoder_start_values)
         print("initial encoder values @ %s: %s, %s" % (timestamp, encoder1_deg, encoder2_deg))
 
-    def write_experiment_to_file(self):
+    def record_settling_params(self, settling_params):
+        self.settling_params = settling_params
+        if self._recorder is not None:
+            self._recorder.update_metadata(settling_params=settling_params)
+
+    def record_step_dwell(self, timestamp, dwell_time, max_dwell_time):
+        self.step_dwell_times.append([timestamp, dwell_time, max_dwell_time])
+        if self._recorder is not None:
+            self._recorder.update_metadata(step_dwell_times=self.step_dwell_times)
+
+    def record_stiffness_params(self, stiffness_params):
+        self.stiffness_params = stiffness_params
+        if self._recorder is not None:
+            self._recorder.update_metadata(stiffness_params=stiffness_params)
+
+    def record_stiffness_estimate(self, stiffness_estimate):
+        self.stiffness_estimate = stiffness_estimate
+        if self._recorder is not None:
+            self._recorder.update_metadata(stiffness_estimate=stiffness_estimate)
+
+    def get_experiment_path(self, extension="json", directory="experiments"):
         conical_annulus_params = "%sx%sx%s" % (
         self.conical_annulus_length_in, self.conical_annulus_od_in, self.conical_annulus_wall_thickness_in)
-        path = "experiments/%s/%s_%s.json" % (conical_annulus_params, self.brake_type_file_name, self.start_time)
+        return "%s/%s/%s_%s.%s" % (directory, conical_annulus_params, self.brake_type_file_name, self.start_time,
+                                   extension)
+
+    def get_metadata(self):
+        return {key: value for key, value in self.__dict__.items()
+                if not key.startswith("_") and key not in self.SAMPLE_COLUMNS}
+
+    def to_dict(self):
+        params = self.get_metadata()
+        for stream in self.SAMPLE_COLUMNS:
+            params[stream] = getattr(self, stream).tolist()
+        return params
+
+    def start_recording(self, flush_interval=1.0):
+        """Stream samples to an append-only file as they're recorded instead of holding them in memory"""
+        self._recorder = ExperimentRecorder(self.get_experiment_path("jsonl"), self.get_metadata(), flush_interval)
+
+    def stop_recording(self):
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def write_experiment_to_file(self, file_format="json", codec="zlib"):
+        if file_format == "json":
+            path = self.get_experiment_path()
+        else:
+            path = self.get_experiment_path(experiment_format.EXTENSION)
 
         if not os.path.isdir(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
 
-        with open(path, 'w+') as file:
-            json.dump(self.__dict__, file)
+        if file_format == "json":
+            with open(path, 'w+') as file:
+                json.dump(self.to_dict(), file)
+        else:
+            streams = {stream: getattr(self, stream) for stream in self.SAMPLE_COLUMNS}
+            experiment_format.write_experiment(path, self.get_metadata(), streams, codec)
+
+        return path
 
 
 LENGTH = 2.0
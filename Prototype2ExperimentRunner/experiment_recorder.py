@@ -0,0 +1,90 @@
+import os
+import json
+import threading
+
+
+class ExperimentRecorder:
+    """
+    Append-only log of an experiment that is written while the run is going.
+
+    Every line of the file is a JSON object. Lines with a "meta" key hold experiment metadata (later lines
+    override earlier ones), all other lines hold a chunk of samples keyed by the ExperimentInfo attribute
+    they belong to. Pending samples are written out in chunks and the file is flushed to disk on a timer,
+    so a killed process keeps everything up to the last flush.
+    """
+
+    STREAMS = ("encoder_data", "commanded_torque_data", "commanded_motor_data")
+
+    def __init__(self, path, metadata, flush_interval=1.0, chunk_size=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+
+        self.lock = threading.Lock()
+        self.pending = {stream: [] for stream in self.STREAMS}
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.file = open(path, 'a')
+        self._write_line({"meta": metadata})
+        self.flush()
+
+        self.stop_event = threading.Event()
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def record(self, stream, sample):
+        with self.lock:
+            chunk = self.pending[stream]
+            chunk.append(sample)
+            if len(chunk) >= self.chunk_size:
+                self._write_chunk(stream)
+
+    def update_metadata(self, **metadata):
+        with self.lock:
+            self._write_line({"meta": metadata})
+
+    def flush(self):
+        with self.lock:
+            for stream in self.STREAMS:
+                if len(self.pending[stream]) > 0:
+                    self._write_chunk(stream)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.stop_event.set()
+        self.flush_thread.join()
+        self.flush()
+        self.file.close()
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def _write_chunk(self, stream):
+        self._write_line({stream: self.pending[stream]})
+        self.pending[stream] = []
+
+    def _write_line(self, obj):
+        self.file.write(json.dumps(obj) + "\n")
+
+    @classmethod
+    def load(cls, path):
+        """Read a recording back into the same dictionary layout write_experiment_to_file produces"""
+        params = {stream: [] for stream in cls.STREAMS}
+        with open(path) as file:
+            for line in file:
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    break  # the process was killed mid-write, everything before this line is intact
+
+                if "meta" in obj:
+                    params.update(obj["meta"])
+                else:
+                    for stream, samples in obj.items():
+                        params[stream].extend(samples)
+
+        return params
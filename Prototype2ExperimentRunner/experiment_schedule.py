@@ -0,0 +1,225 @@
+"""
+Experiment profiles and the precompiled schedules that get uploaded to Prototype2.ino.
+
+A profile is written to a "commander", anything with command_brake, command_motor and write_pause.
+Prototype2bridge is one (commands are timed on the host), ExperimentSchedule is another (commands are
+compiled into a table the firmware runs on its own clock). With adaptive settling the bridge walks a
+schedule's entries itself, moving on as soon as the deflection settles.
+"""
+
+from collections import deque
+
+# these must match Prototype2.ino
+MAX_SCHEDULE_ENTRIES = 0x7fff  # the device counts entries in an int
+SCHEDULE_BUFFER_ENTRIES = 48  # the device's ring buffer, topped up while the schedule runs
+SCHEDULE_TIME_UNIT = 0.01  # seconds
+SCHEDULE_DT_MASK = 0x1fff
+SCHEDULE_BRAKE_FLAG = 0x2000
+SCHEDULE_MOTOR_FLAG = 0x4000
+SCHEDULE_REVERSE_FLAG = 0x8000
+
+ENTRIES_PER_UPLOAD_COMMAND = 6  # keeps each upload command inside the Uno's 64 byte serial buffer
+
+
+def write_staircase_profile(commander, command_interval, time_interval, motor_command, repeats, max_torque_command):
+    commander.command_motor(motor_command)
+    commander.write_pause(5)  # wait for twist to settle
+
+    for _ in range(2):  # command in both directions
+        for _ in range(repeats):
+            command_rise(commander, max_torque_command, command_interval, time_interval)
+
+            commander.command_brake(max_torque_command)
+            commander.write_pause(5)
+
+            command_fall(commander, max_torque_command, command_interval, time_interval)
+
+            commander.command_brake(0)
+            commander.write_pause(5)  # ensure brake dynamics reset
+
+        commander.command_motor(-motor_command)
+
+    commander.write_pause(time_interval)
+    commander.command_motor(0)
+
+
+def command_rise(commander, max_torque_command, command_interval, time_interval):
+    commander.command_brake(0)
+    brake_command = 0
+    for brake_command in range(0, max_torque_command + 1, command_interval):
+        commander.command_brake(brake_command)
+        commander.write_pause(time_interval)
+
+    if brake_command != max_torque_command:
+        commander.command_brake(max_torque_command)
+        commander.write_pause(time_interval)
+
+
+def command_fall(commander, max_torque_command, command_interval, time_interval):
+    commander.command_brake(max_torque_command)
+    brake_command = 0
+    for brake_command in range(max_torque_command, -1, -command_interval):
+        commander.command_brake(brake_command)
+        commander.write_pause(time_interval)
+
+    if brake_command != 0:
+        commander.command_brake(0)
+        commander.write_pause(time_interval)
+
+
+class ExperimentSchedule:
+    """
+    Table of (time offset, brake, motor) entries. brake or motor is None when that entry doesn't change it.
+    Commands issued at the same time offset are merged into one entry, the latest value for each actuator
+    winning.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.time_offset = 0.0
+
+    @classmethod
+    def from_profile(cls, command_interval, time_interval, motor_command, repeats, max_torque_command):
+        schedule = cls()
+        write_staircase_profile(schedule, command_interval, time_interval, motor_command, repeats,
+                                max_torque_command)
+        return schedule
+
+    def command_brake(self, command):
+        self.add_entry(brake=int(command))
+
+    def command_motor(self, command):
+        self.add_entry(motor=int(command))
+
+    def write_pause(self, pause_time):
+        self.time_offset += pause_time
+
+    def add_entry(self, brake=None, motor=None):
+        if len(self.entries) > 0 and self.entries[-1][0] == self.time_offset:
+            prev_time_offset, prev_brake, prev_motor = self.entries.pop()
+            brake = prev_brake if brake is None else brake
+            motor = prev_motor if motor is None else motor
+        self.entries.append((self.time_offset, brake, motor))
+
+    def steps(self):
+        """(brake, motor, max dwell) for each entry. The dwell is how long the entry waits before the next one"""
+        steps = []
+        for index, (time_offset, brake, motor) in enumerate(self.entries):
+            if index + 1 < len(self.entries):
+                max_dwell = self.entries[index + 1][0] - time_offset
+            else:
+                max_dwell = 0.0
+            steps.append((brake, motor, max_dwell))
+        return steps
+
+    @property
+    def num_commands(self):
+        return sum((brake is not None) + (motor is not None) for time_offset, brake, motor in self.entries)
+
+    @property
+    def duration(self):
+        return self.entries[-1][0] if len(self.entries) > 0 else 0.0
+
+    def validate(self):
+        """Raise a ValueError if the firmware can't run this schedule"""
+        if len(self.entries) == 0:
+            raise ValueError("Schedule is empty")
+
+        prev_time_offset = 0.0
+        for time_offset, brake, motor in self.entries:
+            if time_offset < prev_time_offset:
+                raise ValueError("Schedule entries aren't in order at %ss" % time_offset)
+            if brake is not None and not 0 <= brake <= 255:
+                raise ValueError("Brake command %s at %ss is out of range (0...255)" % (brake, time_offset))
+            if motor is not None and not -255 <= motor <= 255:
+                raise ValueError("Motor command %s at %ss is out of range (-255...255)" % (motor, time_offset))
+            prev_time_offset = time_offset
+
+        num_device_entries = len(self.encode())
+        if num_device_entries > MAX_SCHEDULE_ENTRIES:
+            raise ValueError("Schedule has %s entries, the firmware can run at most %s" % (
+                num_device_entries, MAX_SCHEDULE_ENTRIES))
+
+    def encode(self):
+        """
+        Pack the schedule into the firmware's 4 byte entries: a 16 bit header (13 bits of delay since the
+        previous entry in SCHEDULE_TIME_UNITs plus brake, motor and reverse flags), the brake value and the
+        motor speed. Delays that don't fit in 13 bits are padded with entries that don't change anything.
+        """
+        device_entries = []
+        prev_time_units = 0
+        for time_offset, brake, motor in self.entries:
+            # round absolute times so quantization error doesn't accumulate
+            time_units = int(round(time_offset / SCHEDULE_TIME_UNIT))
+            delay = time_units - prev_time_units
+            prev_time_units = time_units
+
+            while delay > SCHEDULE_DT_MASK:
+                device_entries.append((SCHEDULE_DT_MASK, 0, 0))
+                delay -= SCHEDULE_DT_MASK
+
+            header = delay
+            if brake is not None:
+                header |= SCHEDULE_BRAKE_FLAG
+            if motor is not None:
+                header |= SCHEDULE_MOTOR_FLAG
+                if motor < 0:
+                    header |= SCHEDULE_REVERSE_FLAG
+            device_entries.append((header, brake or 0, abs(motor or 0)))
+
+        return device_entries
+
+    def upload_chunks(self):
+        """The device entries, split up into as many as fit in one upload command"""
+        device_entries = self.encode()
+        return [device_entries[index:index + ENTRIES_PER_UPLOAD_COMMAND]
+                for index in range(0, len(device_entries), ENTRIES_PER_UPLOAD_COMMAND)]
+
+    def checksum(self):
+        """Sum of the uploaded bytes, the firmware echoes the same sum back (15 bits so it fits in an int)"""
+        total = 0
+        for header, brake, motor in self.encode():
+            total += (header >> 8) + (header & 0xff) + brake + motor
+        return total & 0x7fff
+
+    def estimate_string(self):
+        hours, remainder = divmod(int(self.duration), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return "%s entries, %s commands, estimated duration %d:%02d:%02d" % (
+            len(self.entries), self.num_commands, hours, minutes, seconds)
+
+
+class ScheduleUploader:
+    """
+    Uploads a schedule into the firmware's ring buffer one e command at a time. The device answers s and
+    every e command with a schedule_entries packet (entries received, entries run), and sends another one
+    whenever a command's worth of room frees up while the schedule runs. The next e command only goes out
+    once the previous one has been acknowledged and fits, so there's never more than one upload command in
+    the Uno's 64 byte serial buffer. The schedule is started as soon as the buffer is full (or everything
+    is uploaded), the rest being uploaded while it runs.
+    """
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.chunks = deque(schedule.upload_chunks())
+        self.num_entries = sum(len(chunk) for chunk in self.chunks)
+        self.num_sent = 0
+        self.started = False
+
+    def start_command(self):
+        return "s%d" % self.num_entries
+
+    def acknowledge(self, num_received, num_run):
+        """Returns the commands to send in response to a schedule_entries packet"""
+        if num_received != self.num_sent:
+            return []  # the last e command hasn't been read yet
+
+        room = SCHEDULE_BUFFER_ENTRIES - (num_received - num_run)
+        if len(self.chunks) > 0 and len(self.chunks[0]) <= room:
+            chunk = self.chunks.popleft()
+            self.num_sent += len(chunk)
+            return ["e" + "".join("%04x%02x%02x" % entry for entry in chunk)]
+        elif not self.started:
+            self.started = True
+            return ["x"]
+        return []
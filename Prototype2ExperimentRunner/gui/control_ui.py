@@ -37,18 +37,26 @@ class TkinterGUI(Node):
         self.set_brake_button.pack()
         self.stop_brake_button.pack()
 
+        # what the device has applied, updated every frame from the bridge's command channel
+        self.motor_status_label = Label(self.root, text="motor: -", anchor=W)
+        self.brake_status_label = Label(self.root, text="brake: -", anchor=W)
+        self.motor_status_label.pack(fill=X)
+        self.brake_status_label.pack(fill=X)
+
         self.prototype2_bridge_tag = "prototype2_bridge"
         self.prototype2_bridge_sub = self.define_subscription(
             self.prototype2_bridge_tag,
             queue_size=None,
-            required_attributes=("command_brake", "command_motor")
+            required_attributes=("command_channel",)
         )
         self.prototype2_bridge = None
+        self.command_channel = None
 
         # self.pickle_file_path = pickle_file_path
 
     def take(self):
         self.prototype2_bridge = self.prototype2_bridge_sub.get_producer()
+        self.command_channel = self.prototype2_bridge.command_channel
 
     # def load_constants(self):
     #     if os.path.isfile(self.pickle_file_path):
@@ -67,6 +75,7 @@ class TkinterGUI(Node):
     async def loop(self):
         try:
             while self.is_running:
+                self.update_status()
                 self.root.update()
 
                 await asyncio.sleep(self.interval)
@@ -77,17 +86,21 @@ class TkinterGUI(Node):
     # async def teardown(self):
     #     self.save_constants()
 
+    def update_status(self):
+        self.motor_status_label.config(text=self.command_channel.status_string("motor"))
+        self.brake_status_label.config(text=self.command_channel.status_string("brake"))
+
     def set_motor(self):
-        self.prototype2_bridge.command_motor(self.motor_speed_slider.get())
+        self.command_channel.set("motor", self.motor_speed_slider.get())
 
     def set_brake(self):
-        self.prototype2_bridge.command_brake(self.brake_power_slider.get())
+        self.command_channel.set("brake", self.brake_power_slider.get())
 
     def stop_motor(self):
-        self.prototype2_bridge.command_motor(0)
+        self.command_channel.set("motor", 0)
 
     def stop_brake(self):
-        self.prototype2_bridge.command_brake(0)
+        self.command_channel.set("brake", 0)
 
     def shutdown_tk(self):
         self.is_running = False
\ No newline at end of file
@@ -1,40 +1,83 @@
 import asyncio
 from threading import Event
 
+import numpy as np
 from atlasbuggy import Node
 
+from encoder_batch import EncoderBatch
+from sliding_window import SlidingWindowBuffer
+from subscriber_queue import SubscriberQueue, subscription_queue_size, DROP_OLDEST
+
+
+def decimate_min_max(x, y, num_columns):
+    """
+    Reduce a line to the minimum and maximum of each of num_columns equal slices of its x range. Drawn one
+    column per pixel this looks the same as the full line, spikes included
+    """
+    if len(x) <= num_columns * 2:
+        return x, y
+
+    edges = np.linspace(x[0], x[-1], num_columns + 1)
+    starts = np.unique(np.searchsorted(x, edges[:-1], side="left"))
+
+    decimated_x = np.repeat(x[starts], 2)
+    decimated_y = np.empty(len(starts) * 2)
+    decimated_y[0::2] = np.minimum.reduceat(y, starts)
+    decimated_y[1::2] = np.maximum.reduceat(y, starts)
+    return decimated_x, decimated_y
+
 
 class DataPlotter(Node):
-    def __init__(self, enabled=True):
+    def __init__(self, enabled=True, fig_num=1, title=None, blit=True, ring_buffer=None, queue_size=1024,
+                 queue_policy=DROP_OLDEST, smoothing=None):
         super(DataPlotter, self).__init__(enabled)
 
+        # in a plot process (see plot_process.py) samples come from a SharedRingBuffer instead of the bridge
+        self.ring_buffer = ring_buffer
+
         self.pause_time = 1 / 30
         self.exit_event = Event()
         self.plot_paused = False
 
         self.prototype2_bridge_tag = "prototype2_bridge"
-        self.prototype2_bridge_sub = self.define_subscription(self.prototype2_bridge_tag)
+        # bounded so a plot that falls behind can't hold an unbounded backlog of the bridge's messages
+        self.prototype2_bridge_sub = self.define_subscription(
+            self.prototype2_bridge_tag, queue_size=subscription_queue_size(queue_size, queue_policy))
         self.prototype2_bridge_queue = None
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy  # what happens to messages when the plot falls behind
 
         self.diff_plot_time_window = 120.0
         self.enc_plot_time_window = 5.0
 
-        self.encoder_diff_timestamps = []
-        self.encoder_diff_data = []
-
-        self.encoder_timestamps = []
-        self.encoder_data_1 = []
-        self.encoder_data_2 = []
+        # timestamp, encoder difference
+        self.encoder_diff_window = SlidingWindowBuffer(2, self.diff_plot_time_window)
+        # timestamp, encoder 1 analog value, encoder 2 analog value
+        self.encoder_window = SlidingWindowBuffer(3, self.enc_plot_time_window)
 
         self.initial_val_enc_1 = None
         self.initial_val_enc_2 = None
 
         self.gear_ratio = 32.0 / 48.0
 
+        # optionally smooth the encoder difference as it comes in with a causal StreamingSavitzkyGolay, which
+        # outputs a sample for every one that comes in
+        if smoothing is not None and not smoothing.causal:
+            raise ValueError("The plot can only smooth with a causal filter, it doesn't wait for samples")
+        self.smoothing = smoothing
+
+        # only the lines are redrawn each frame on top of a cached background. Axes are rescaled (and the
+        # whole figure redrawn) when data leaves their limits, with headroom so it doesn't happen every frame
+        self.blit = blit
+        self.background = None
+        self.rescale_headroom = 0.2
+
         self.plt = None
         if self.enabled:
             self.enable_matplotlib()
-            self.fig = self.plt.figure(1)
+            self.fig = self.plt.figure(fig_num)
+            if title is not None:
+                self.fig.suptitle(title)
             self.fig.canvas.mpl_connect('key_press_event', self.press)
             self.fig.canvas.mpl_connect('close_event', lambda event: self.exit_event.set())
 
@@ -43,7 +86,15 @@ class DataPlotter(Node):
         self.plt = plt
 
     def take(self):
-        self.prototype2_bridge_queue = self.prototype2_bridge_sub.get_queue()
+        self.prototype2_bridge_queue = SubscriberQueue(self.prototype2_bridge_sub.get_queue(), self.queue_size,
+                                                       self.queue_policy)
+
+    @property
+    def dropped_count(self):
+        """Messages from the bridge the queue policy threw away"""
+        if self.prototype2_bridge_queue is None:
+            return 0
+        return self.prototype2_bridge_queue.dropped
 
     async def setup(self):
         # if self.is_subscribed(self.bno055_tag):
@@ -61,57 +112,112 @@ class DataPlotter(Node):
         self.diff_line = self.diff_plot.plot([], [], '-', label="enc diff")[0]
         self.encoder_line_1 = self.encoder_plot.plot([], [], '.-', label="enc1")[0]
         self.encoder_line_2 = self.encoder_plot.plot([], [], '.-', label="enc2")[0]
-        self.encoder_plot.legend(fontsize="x-small", shadow="True", loc=0)
+        self.encoder_plot.legend(fontsize="x-small", shadow=True, loc=0)
+
+        # the bridge's online stiffness estimate, if it's making one
+        self.stiffness_text = self.diff_plot.text(0.01, 0.95, "", transform=self.diff_plot.transAxes,
+                                                  verticalalignment="top", fontsize="small")
+
+        self.blit = self.blit and self.fig.canvas.supports_blit
+        if self.blit:
+            for artist in (self.diff_line, self.encoder_line_1, self.encoder_line_2, self.stiffness_text):
+                artist.set_animated(True)
+            self.fig.canvas.mpl_connect('draw_event', self.cache_background)
 
         self.plt.ion()
         self.plt.show(block=False)
+        self.fig.canvas.draw()
 
     async def loop(self):
         while True:
             if self.exit_event.is_set():
                 return
 
-            if self.plot_paused:
-                await self.draw()
-                continue
-
+            # keep draining while paused so messages don't pile up, the windows only keep their last seconds
             await self.get_encoder_data()
-            if len(self.encoder_diff_timestamps) == 0:
-                await self.draw()
-                continue
+            self.encoder_diff_window.trim()
+            self.encoder_window.trim()
 
-            while self.encoder_diff_timestamps[-1] - self.encoder_diff_timestamps[0] > self.diff_plot_time_window:
-                self.encoder_diff_timestamps.pop(0)
-                self.encoder_diff_data.pop(0)
-
-            while self.encoder_timestamps[-1] - self.encoder_timestamps[0] > self.enc_plot_time_window:
-                self.encoder_timestamps.pop(0)
-                self.encoder_data_1.pop(0)
-                self.encoder_data_2.pop(0)
-
-            self.plot_data()
+            if not self.plot_paused and len(self.encoder_diff_window) > 0:
+                self.plot_data()
             await self.draw()
 
     def plot_data(self):
-        self.encoder_line_1.set_xdata(self.encoder_timestamps)
-        self.encoder_line_1.set_ydata(self.encoder_data_1)
+        encoder_columns = int(self.encoder_plot.bbox.width)
+        encoder_x, encoder_y_1 = decimate_min_max(
+            self.encoder_window.timestamps, self.encoder_window.column(1), encoder_columns)
+        encoder_x, encoder_y_2 = decimate_min_max(
+            self.encoder_window.timestamps, self.encoder_window.column(2), encoder_columns)
+        diff_x, diff_y = decimate_min_max(
+            self.encoder_diff_window.timestamps, self.encoder_diff_window.column(1), int(self.diff_plot.bbox.width))
+
+        self.encoder_line_1.set_data(encoder_x, encoder_y_1)
+        self.encoder_line_2.set_data(encoder_x, encoder_y_2)
+        self.diff_line.set_data(diff_x, diff_y)
+
+        if self.blit:
+            rescaled = self.rescale_if_needed(self.encoder_plot, encoder_x, (encoder_y_1, encoder_y_2),
+                                              self.enc_plot_time_window)
+            rescaled = self.rescale_if_needed(self.diff_plot, diff_x, (diff_y,), self.diff_plot_time_window) \
+                or rescaled
+            if rescaled:
+                self.fig.canvas.draw()  # redraws ticks and labels, the background is cached again
+        else:
+            self.encoder_plot.relim()
+            self.encoder_plot.autoscale_view()
+
+            self.diff_plot.relim()
+            self.diff_plot.autoscale_view()
+
+    def rescale_if_needed(self, axes, x, ys, time_window):
+        """Set new limits if any of the data is outside the current ones. Returns True if they changed"""
+        x_min, x_max = axes.get_xlim()
+        y_min, y_max = axes.get_ylim()
+        data_y_min = min(np.min(y) for y in ys)
+        data_y_max = max(np.max(y) for y in ys)
+
+        rescale_x = x[0] < x_min or x[-1] > x_max
+        rescale_y = data_y_min < y_min or data_y_max > y_max
+        if not rescale_x and not rescale_y:
+            return False
+
+        if rescale_x:
+            axes.set_xlim(x[0], max(x[-1], x[0] + time_window) + time_window * self.rescale_headroom)
+
+        margin = (data_y_max - data_y_min) * self.rescale_headroom / 2
+        if margin == 0.0:
+            margin = 1.0
+        axes.set_ylim(data_y_min - margin, data_y_max + margin)
+
+        return True
+
+    def cache_background(self, event):
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+        self.diff_plot.draw_artist(self.diff_line)
+        self.diff_plot.draw_artist(self.stiffness_text)
+        self.encoder_plot.draw_artist(self.encoder_line_1)
+        self.encoder_plot.draw_artist(self.encoder_line_2)
 
-        self.encoder_line_2.set_xdata(self.encoder_timestamps)
-        self.encoder_line_2.set_ydata(self.encoder_data_2)
-
-        self.diff_line.set_xdata(self.encoder_diff_timestamps)
-        self.diff_line.set_ydata(self.encoder_diff_data)
+    async def get_encoder_data(self):
+        if self.ring_buffer is not None:
+            rows = self.ring_buffer.read()
+            if len(rows) > 0:
+                self.add_encoder_batch(EncoderBatch(rows[:, 0], rows[:, 1:]))
+            return
 
-        self.encoder_plot.relim()
-        self.encoder_plot.autoscale_view()
+        for message in self.prototype2_bridge_queue.drain():
+            # message = await asyncio.wait_for(self.prototype2_bridge_queue.get(), timeout=1)
 
-        self.diff_plot.relim()
-        self.diff_plot.autoscale_view()
+            if message.name == "enc_batch":
+                self.add_encoder_batch(message)
+                continue
 
-    async def get_encoder_data(self):
-        while not self.prototype2_bridge_queue.empty():
-            # message = await asyncio.wait_for(self.prototype2_bridge_queue.get(), timeout=1)
-            message = self.prototype2_bridge_queue.get_nowait()
+            if message.name == "stiffness":
+                self.stiffness_text.set_text("stiffness: %s" % message)
+                continue
 
             if self.initial_val_enc_1 is None:
                 self.initial_val_enc_1 = message.data[0]
@@ -125,11 +231,29 @@ class DataPlotter(Node):
             # enc1_angle = message.data[0] * self.gear_ratio
             # enc2_angle = message.data[1] * self.gear_ratio
 
-            self.encoder_timestamps.append(message.timestamp)
-            self.encoder_diff_timestamps.append(message.timestamp)
-            self.encoder_diff_data.append(enc1_angle - enc2_angle)
-            self.encoder_data_1.append(message.data[2])
-            self.encoder_data_2.append(message.data[3])
+            encoder_diff = enc1_angle - enc2_angle
+            if self.smoothing is not None:
+                encoder_diff = self.smoothing.process((encoder_diff,))[0]
+
+            self.encoder_diff_window.append(message.timestamp, encoder_diff)
+            self.encoder_window.append(message.timestamp, message.data[2], message.data[3])
+
+    def add_encoder_batch(self, batch):
+        if self.initial_val_enc_1 is None:
+            self.initial_val_enc_1 = batch.data[0, 0]
+
+        if self.initial_val_enc_2 is None:
+            self.initial_val_enc_2 = batch.data[0, 1]
+
+        enc1_angles = (batch.data[:, 0] - self.initial_val_enc_1) * self.gear_ratio
+        enc2_angles = (batch.data[:, 1] - self.initial_val_enc_2) * self.gear_ratio
+
+        encoder_diffs = enc1_angles - enc2_angles
+        if self.smoothing is not None:
+            encoder_diffs = self.smoothing.process(encoder_diffs)
+
+        self.encoder_diff_window.extend(batch.timestamps, encoder_diffs)
+        self.encoder_window.extend(batch.timestamps, batch.data[:, 2], batch.data[:, 3])
 
     def press(self, event):
         """matplotlib key press event. Close all figures when q is pressed"""
@@ -140,9 +264,17 @@ class DataPlotter(Node):
             print("Plot is paused:", self.plot_paused)
 
     async def draw(self):
-        self.fig.canvas.draw()
-        self.plt.pause(self.pause_time)
+        if self.blit and self.background is not None:
+            self.fig.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.fig.canvas.blit(self.fig.bbox)
+            self.fig.canvas.flush_events()
+        else:
+            self.fig.canvas.draw()
+            self.plt.pause(self.pause_time)
         await asyncio.sleep(self.pause_time)
 
     async def teardown(self):
+        if self.dropped_count > 0:
+            print("Plot dropped %s messages (%s)" % (self.dropped_count, self.queue_policy))
         self.plt.close("all")
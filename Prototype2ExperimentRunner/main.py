@@ -1,33 +1,164 @@
+import argparse
+
 from atlasbuggy import Orchestrator, run
 
 from experiment_info import *
 from gui.data_plotter import DataPlotter
+from plot_process import PlotProcess
 from prototype2_bridge import Prototype2bridge
+from rig_status import RigStatusView
+from simulated_prototype2 import SimulatedPrototype2, SimulatedDeviceFactory
+from smoothing import StreamingSavitzkyGolay
+from stiffness_estimator import StiffnessEstimator
 
 
 class ExperimentOrchestrator(Orchestrator):
-    def __init__(self, event_loop, experiment_info):
+    def __init__(self, event_loop, rigs, adaptive=False, plot_enabled=True, binary_framing=False,
+                 plot_process=False, estimate_stiffness=False, stop_when_converged=False, precompiled=False,
+                 smooth_window=None, smooth_order=3):
+        """
+        rigs is a list of (device name, experiment info, device). device is None for a real Arduino.
+        If precompiled is True, each rig's experiment is uploaded as a schedule and run on the device's clock.
+        If plot_process is True, each rig is plotted by a separate process instead of a DataPlotter node.
+        If estimate_stiffness is True, each rig's stiffness is estimated as its steps settle.
+        If smooth_window is set, the plotted encoder difference is smoothed as it comes in
+        """
         super(ExperimentOrchestrator, self).__init__(event_loop)
+        self.adaptive = adaptive
+        self.precompiled = precompiled
+
+        self.bridges = []
+        self.plots = []
+        self.plot_processes = []
+        for index, (device_name, experiment_info, device) in enumerate(rigs):
+            if plot_enabled and plot_process:
+                process = PlotProcess(title=device_name, smooth_window=smooth_window, smooth_order=smooth_order)
+                self.plot_processes.append(process)
+                ring_buffer = process.ring_buffer
+            else:
+                ring_buffer = None
 
-        self.bridge = Prototype2bridge(experiment_info)
-        self.plot = DataPlotter(enabled=True)
+            bridge = Prototype2bridge(experiment_info, device=device, device_name=device_name,
+                                      verbose=len(rigs) == 1, binary_framing=binary_framing,
+                                      ring_buffer=ring_buffer,
+                                      stiffness_estimator=StiffnessEstimator() if estimate_stiffness else None,
+                                      stop_when_converged=stop_when_converged)
+            self.bridges.append(bridge)
 
-        # self.add_nodes(self.bridge)
-        self.subscribe(self.bridge, self.plot, self.plot.prototype2_bridge_tag)
+            if ring_buffer is None:
+                if smooth_window is not None:
+                    smoothing = StreamingSavitzkyGolay(smooth_window, smooth_order, causal=True)
+                else:
+                    smoothing = None
+                plot = DataPlotter(enabled=plot_enabled, fig_num=index + 1, title=device_name, smoothing=smoothing)
+                self.subscribe(bridge, plot, plot.prototype2_bridge_tag)
+                self.plots.append(plot)
+            else:
+                self.add_nodes(bridge)
+
+        if len(self.bridges) > 1:
+            self.status_view = RigStatusView(self.bridges)
+            self.add_nodes(self.status_view)
 
     async def setup(self):
-        self.bridge.generate_experiment(
-            self.bridge.experiment_info.command_interval,
-            self.bridge.experiment_info.time_interval,
-            self.bridge.experiment_info.commanded_motor_speed,
-            self.bridge.experiment_info.repeats,
-            self.bridge.experiment_info.max_torque_command,
-        )
+        for process in self.plot_processes:
+            process.start()
+
+        for bridge in self.bridges:
+            bridge.generate_experiment(
+                bridge.experiment_info.command_interval,
+                bridge.experiment_info.time_interval,
+                bridge.experiment_info.commanded_motor_speed,
+                bridge.experiment_info.repeats,
+                bridge.experiment_info.max_torque_command,
+                precompiled=self.precompiled,
+                adaptive=self.adaptive,
+            )
+
+    async def teardown(self):
+        await super(ExperimentOrchestrator, self).teardown()
+        for process in self.plot_processes:
+            process.stop()
+
+
+def parse_rig(rig):
+    """
+    Parse a rig argument, device_name:brake:LENGTHxODxWALL (inches), brake being large or small.
+    The step profile is the same as large_brake_experiment's or small_brake_experiment's. device_name is
+    the DEVICE_NAME the rig's board was flashed with (see firmware/platformio.ini)
+    """
+    try:
+        device_name, brake, conical_annulus_params = rig.split(":")
+        length, outer_diameter, wall_thickness = [float(value) for value in conical_annulus_params.split("x")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Expected device_name:brake:LENGTHxODxWALL, got '%s'" % rig)
+
+    if brake == "large":
+        template = large_brake_experiment
+    elif brake == "small":
+        template = small_brake_experiment
+    else:
+        raise argparse.ArgumentTypeError("Brake type must be large or small, got '%s'" % brake)
+
+    experiment_info = ExperimentInfo.load_from_params(
+        template.brake_type, length, outer_diameter, wall_thickness, template.commanded_motor_speed,
+        template.command_interval, template.time_interval, template.repeats
+    )
+    return device_name, experiment_info
 
 
 def main():
-    # run(ExperimentOrchestrator, large_brake_experiment)  # no extra resistor
-    run(ExperimentOrchestrator, small_brake_experiment)  # with extra resistor
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rig", type=parse_rig, action="append", dest="rigs",
+                        help="device_name:brake:LENGTHxODxWALL, e.g. prototype2:small:2.0x1.125x0.125. "
+                             "device_name must match the DEVICE_NAME the board was flashed with (prototype2 "
+                             "unless set in firmware/platformio.ini). Repeat to run several rigs at once")
+    parser.add_argument("--simulated", action="store_true", help="run against a simulated Prototype 2")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="simulated seconds per real second. 0 runs as fast as possible")
+    timing = parser.add_mutually_exclusive_group()
+    timing.add_argument("--adaptive", action="store_true",
+                        help="move on to the next command as soon as the deflection settles")
+    timing.add_argument("--precompiled", action="store_true",
+                        help="upload the experiment to the device and run it on the device's clock")
+    parser.add_argument("--no-plot", action="store_true")
+    parser.add_argument("--plot-process", action="store_true",
+                        help="plot in a separate process so the plots can't slow down reading the device")
+    parser.add_argument("--binary-framing", action="store_true",
+                        help="have the device pack encoder samples into binary frames")
+    parser.add_argument("--estimate-stiffness", action="store_true",
+                        help="estimate the stiffness as each step settles and show it while the experiment runs")
+    parser.add_argument("--stop-when-converged", action="store_true",
+                        help="end the experiment once the stiffness estimate converges (implies --estimate-stiffness)")
+    parser.add_argument("--smooth-window", type=int,
+                        help="smooth the plotted encoder difference as it comes in with a causal Savitzky-Golay "
+                             "filter over this many samples (odd)")
+    parser.add_argument("--smooth-order", type=int, default=3, help="polynomial order of --smooth-window's filter")
+    args = parser.parse_args()
+
+    if args.smooth_window is not None and (args.smooth_window % 2 != 1 or args.smooth_window < args.smooth_order + 2):
+        parser.error("--smooth-window must be odd and at least --smooth-order + 2")
+
+    if args.rigs is None:
+        # experiment_info = large_brake_experiment  # no extra resistor
+        experiment_info = small_brake_experiment  # with extra resistor
+        args.rigs = [("prototype2", experiment_info)]
+
+    device_names = [device_name for device_name, experiment_info in args.rigs]
+    if len(set(device_names)) != len(device_names):
+        parser.error("Each rig needs its own device name")
+
+    rigs = []
+    for device_name, experiment_info in args.rigs:
+        device = None
+        if args.simulated:
+            device = SimulatedPrototype2(device_name, SimulatedDeviceFactory(), experiment_info.brake_type,
+                                         time_scale=args.time_scale if args.time_scale > 0 else None)
+        rigs.append((device_name, experiment_info, device))
+
+    run(ExperimentOrchestrator, rigs, args.adaptive, not args.no_plot, args.binary_framing, args.plot_process,
+        args.estimate_stiffness or args.stop_when_converged, args.stop_when_converged, args.precompiled,
+        args.smooth_window, args.smooth_order)
 
 
 main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import asyncio
+import argparse
+import subprocess
+
+from gui.data_plotter import DataPlotter
+from shared_ring_buffer import SharedRingBuffer
+from smoothing import StreamingSavitzkyGolay
+
+NUM_COLUMNS = 5  # timestamp followed by the enc packet's data
+
+
+class PlotProcess:
+    """
+    Runs a DataPlotter in a separate process so redraws and window events can't hold up the bridge.
+    The bridge writes encoder samples into ring_buffer, the plot process reads them from shared memory.
+    The bridge never waits on the plot process, closing or crashing it doesn't affect the run.
+    """
+
+    def __init__(self, title=None, capacity=2 ** 18, smooth_window=None, smooth_order=3):
+        self.title = title
+        self.smooth_window = smooth_window  # the plot process builds its own StreamingSavitzkyGolay from these
+        self.smooth_order = smooth_order
+        self.ring_buffer = SharedRingBuffer.create(NUM_COLUMNS, capacity)
+        self.process = None
+
+    def start(self):
+        command = [sys.executable, os.path.abspath(__file__), self.ring_buffer.name]
+        if self.title is not None:
+            command += ["--title", self.title]
+        if self.smooth_window is not None:
+            command += ["--smooth-window", str(self.smooth_window), "--smooth-order", str(self.smooth_order)]
+        self.process = subprocess.Popen(command)
+
+    def stop(self):
+        """Tell the plot process the run is over. It stays open until its window is closed"""
+        self.ring_buffer.close_writer()
+        if self.process is not None and self.process.poll() is not None and self.process.returncode != 0:
+            print("Plot process exited with code %s during the run" % self.process.returncode)
+        self.ring_buffer.close()
+
+
+async def run_plotter(plotter):
+    await plotter.setup()
+    await plotter.loop()
+    await plotter.teardown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot the encoder samples a bridge writes to shared memory")
+    parser.add_argument("ring_buffer_name")
+    parser.add_argument("--title")
+    parser.add_argument("--smooth-window", type=int)
+    parser.add_argument("--smooth-order", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.smooth_window is not None:
+        smoothing = StreamingSavitzkyGolay(args.smooth_window, args.smooth_order, causal=True)
+    else:
+        smoothing = None
+
+    ring_buffer = SharedRingBuffer.attach(args.ring_buffer_name)
+    plotter = DataPlotter(title=args.title, ring_buffer=ring_buffer, smoothing=smoothing)
+    asyncio.run(run_plotter(plotter))
+
+    if ring_buffer.lost_rows > 0:
+        print("The plot fell behind and skipped %s samples" % ring_buffer.lost_rows)
+    ring_buffer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,129 +1,428 @@
 import time
 import asyncio
+from collections import deque
+
+import numpy as np
 from atlasbuggy import Node
 from arduino_factory import DeviceFactory, Arduino
 
+from serial_reader import SerialReader
+from encoder_batch import EncoderBatch, EncoderBatcher
+from binary_framing import FrameDecoder, FrameError
+from bridge_telemetry import BridgeTelemetry
+from command_channel import CommandChannel
+from experiment_schedule import ExperimentSchedule, ScheduleUploader, write_staircase_profile
+from settling_detector import SettlingDetector
+from stiffness_estimator import StiffnessEstimator
+from brake_lookup import get_lookup_tables, commands_to_torque
+
 
 class Prototype2bridge(Node):
-    def __init__(self, experiment_info, enabled=True, record_to_file=True):
+    def __init__(self, experiment_info, enabled=True, record_to_file=True, broadcast_batch_size=None,
+                 broadcast_batch_interval=0.05, device=None, settling_detector=None, device_name="prototype2",
+                 verbose=True, binary_framing=False, ring_buffer=None, stiffness_estimator=None,
+                 stop_when_converged=False):
         super(Prototype2bridge, self).__init__(enabled)
-        self.factory = DeviceFactory()
-        self.prototype2_bridge_arduino = Arduino("prototype2", self.factory)
+        self.device_name = device_name
+        self.verbose = verbose  # print every command echo. Turned off when a status view covers several rigs
+
+        if device is None:
+            self.factory = DeviceFactory()
+            self.prototype2_bridge_arduino = Arduino(device_name, self.factory)
+        else:
+            # a stand-in for the Arduino such as SimulatedPrototype2
+            self.factory = device.factory
+            self.prototype2_bridge_arduino = device
         self.experiment_info = experiment_info
+        self.experiment_info.device_name = device_name
 
-        self.timestamp_sum = 0.0
         self.num_packets = 0
+        self.telemetry = BridgeTelemetry()
+        self.command_schedule_time = 0.0  # when the last queued command will actually be sent
+        self.command_channel = CommandChannel(self)  # for interactive controls such as TkinterGUI
         self.record_to_file = record_to_file
 
+        self.prev_brake_val = 0
+        self.motor_val = 0
+        self.cycle_num = 1
+        self.done = False
+        self.initial_enc_recorded = False
+
+        self.reader = None
+        self.uploaded_schedule = None
+        self.schedule_uploader = None
+
+        # opt in to the device packing encoder samples into binary frames (see binary_framing.py)
+        self.binary_framing = binary_framing
+        self.frame_decoder = FrameDecoder()
+
+        # adaptive settling: steps are sent one at a time once the previous one's deflection is steady
+        self.settling_detector = SettlingDetector() if settling_detector is None else settling_detector
+        self.adaptive_steps = None
+        self.current_step = None
+        self.step_start_time = 0.0
+
+        # online stiffness estimate: each step's torque (from the lookup tables) against its settled deflection
+        self.gear_ratio = 32.0 / 48.0
+        self.stiffness_estimator = stiffness_estimator
+        self.stop_when_converged = stop_when_converged  # end the experiment as soon as the estimate converges
+        self.lookup_tables = None
+        self.deflection_window = SettlingDetector(window=0.5)  # only used for its mean deflection
+        self.reference_deflection = None  # the deflection at zero torque, taken again when the motor reverses
+        self.reference_time = None
+        self.stiffness_step = None  # brake command, when to sample the deflection (None waits for adaptive settling)
+        self.measured_step = None  # brake command, torque sign and deflection, waiting on the next command
+        self.stiffness_updated = False
+        self.stiffness_converged = False
+        if self.stiffness_estimator is not None:
+            self.lookup_tables = get_lookup_tables(experiment_info.brake_type)
+
+        # samples are also written here for a plot running in another process (see plot_process.py)
+        self.ring_buffer = ring_buffer
+
+        # opt in to sending subscribers blocks of encoder packets instead of every packet
+        if broadcast_batch_size is None:
+            self.batcher = None
+        else:
+            self.batcher = EncoderBatcher(broadcast_batch_size, broadcast_batch_interval)
+
     async def setup(self):
         # start_packet = self.prototype2_bridge_arduino.start()
         self.prototype2_bridge_arduino.start()
+        if self.binary_framing:
+            self.prototype2_bridge_arduino.write("f1")
+        if self.record_to_file:
+            self.experiment_info.start_recording()
+        if self.stiffness_estimator is not None:
+            self.experiment_info.record_stiffness_params(self.stiffness_estimator.get_params())
+
+        self.reader = SerialReader(self.prototype2_bridge_arduino, self.factory, asyncio.get_event_loop())
+        self.reader.start()
 
     async def loop(self):
-        prev_brake_val = 0
-        cycle_num = 1
-        initial_enc_recorded = False
         if self.record_to_file:
-            print("Cycle #%s of %s" % (cycle_num, self.experiment_info.repeats * 2))
-
-        while self.factory.ok():
-            packet = self.prototype2_bridge_arduino.read()
-            await asyncio.sleep(0.0)
-
-            if packet.name is None:
-                self.logger.warning("No packets found!")
-
-            elif packet.name == "enc":
-                encoder1_deg = packet.data[0]
-                encoder2_deg = packet.data[1]
-                self.timestamp_sum += packet.timestamp
-                self.num_packets += 1
-
-                if self.record_to_file:
-                    if not initial_enc_recorded:
-                        # self.experiment_info.record_encoder_start_vals(packet.timestamp, encoder1_deg, encoder2_deg)
-                        # initial_enc_recorded = True
-                        if packet.timestamp >= 2.0:
-                            self.experiment_info.record_encoder_start_vals(packet.timestamp, encoder1_deg, encoder2_deg)
-                            initial_enc_recorded = True
-                        else:
-                            continue
-
-                self.experiment_info.record_encoders(packet.timestamp, encoder1_deg, encoder2_deg)
-                await self.broadcast(packet)
-
-            elif packet.name == "brake":
-                brake_val = packet.data[0]
-                self.experiment_info.record_torque_command(packet.timestamp, brake_val)
+            self.report("Cycle #%s of %s" % (self.cycle_num, self.experiment_info.repeats * 2))
+
+        while True:
+            batch = await self.reader.get_batch()
+            if batch is None:
+                await self.flush_encoder_batch()
+                self.done = True
+                return
+
+            for receive_time, packet, broadcast in batch:
+                if not await self.process_packet(packet, receive_time, broadcast):
+                    self.reader.stop()  # nothing reads its queue from here on, don't let it wait for room
+                    await self.flush_encoder_batch()
+                    self.done = True
+                    return
+
+            self.telemetry.print_summary_periodically()
+
+    async def process_packet(self, packet, receive_time, broadcast=True):
+        """
+        Record and forward a packet. Returns False once the experiment is done. If broadcast is False
+        (the reader fell behind, see SerialReader) encoder samples are only recorded
+        """
+        if packet.name is None:
+            self.logger.warning("No packets found!")
+
+        elif packet.name == "enc":
+            if self.record_encoder_sample(packet.timestamp, packet.data, receive_time) and broadcast:
+                if self.ring_buffer is not None:
+                    self.ring_buffer.write_row(packet.timestamp, *packet.data)
+
+                if self.batcher is None:
+                    await self.broadcast(packet)
+                else:
+                    encoder_batch = self.batcher.add(packet.timestamp, packet.data)
+                    if encoder_batch is not None:
+                        await self.broadcast(encoder_batch)
+
+        elif packet.name == "encb":
+            await self.process_encoder_frame(packet, receive_time, broadcast)
+
+        elif packet.name == "brake":
+            brake_val = packet.data[0]
+            self.experiment_info.record_torque_command(packet.timestamp, brake_val)
+            self.telemetry.record_echo("brake", brake_val, receive_time)
+            self.command_channel.record_echo("brake", brake_val, receive_time)
+            if self.verbose:
                 print("Torque value '%s' processed" % brake_val)
-                if brake_val != prev_brake_val:
-                    prev_brake_val = brake_val
-                    if brake_val == 0:
-                        cycle_num += 1
-                        if cycle_num > self.experiment_info.repeats * 2:
-
-                            print("Experiment done")
-                            return
-                        if self.record_to_file:
-                            print("Cycle #%s of %s" % (cycle_num, self.experiment_info.repeats * 2))
-
-            elif packet.name == "motor":
-                motor_val = packet.data[0]
-                self.experiment_info.record_motor_command(packet.timestamp, motor_val)
+            if brake_val != self.prev_brake_val:
+                if self.stiffness_estimator is not None:
+                    self.start_stiffness_step(packet.timestamp, brake_val)
+                self.prev_brake_val = brake_val
+                if brake_val == 0:
+                    self.cycle_num += 1
+                    if self.cycle_num > self.experiment_info.repeats * 2:
+
+                        self.report("Experiment done")
+                        return False
+                    if self.record_to_file:
+                        self.report("Cycle #%s of %s" % (self.cycle_num, self.experiment_info.repeats * 2))
+
+        elif packet.name == "schedule_entries":
+            if self.schedule_uploader is not None:
+                for command in self.schedule_uploader.acknowledge(packet.data[0], packet.data[1]):
+                    self.prototype2_bridge_arduino.write(command)
+
+        elif packet.name == "schedule":
+            num_entries, num_received = packet.data[0], packet.data[1]
+            if num_entries < 0:
+                self.logger.warning("Schedule failed to start! Device hadn't received any entries")
+            else:
+                self.report("Schedule of %s entries started on the device, %s uploaded so far" % (
+                    num_entries, num_received))
+
+        elif packet.name == "schedule_done":
+            num_entries, checksum = packet.data[0], packet.data[1]
+            if self.uploaded_schedule is None or checksum != self.uploaded_schedule.checksum():
+                self.logger.warning("Schedule upload was corrupted! Device ran %s entries, checksum %s" % (
+                    num_entries, checksum))
+            else:
+                self.report("Device finished its schedule")
+
+        elif packet.name == "motor":
+            motor_val = packet.data[0]
+            if motor_val != self.motor_val and motor_val != 0:
+                # backlash shifts the deflection whenever the motor starts or reverses, measure from here
+                self.reference_deflection = None
+                self.reference_time = packet.timestamp + 0.5
+            self.motor_val = motor_val
+            self.experiment_info.record_motor_command(packet.timestamp, motor_val)
+            self.telemetry.record_echo("motor", motor_val, receive_time)
+            self.command_channel.record_echo("motor", motor_val, receive_time)
+            if self.verbose:
                 print("Motor speed '%s' processed" % motor_val)
 
-    def generate_experiment(self, command_interval, time_interval, motor_command, repeats, max_torque_command):
-        self.command_motor(motor_command)
-        self.prototype2_bridge_arduino.write_pause(5)  # wait for twist to settle
+        if self.stiffness_updated:
+            self.stiffness_updated = False
+            await self.broadcast(self.stiffness_estimator.get_estimate(packet.timestamp))
+            if self.stop_when_converged and self.stiffness_converged:
+                self.report("Stiffness estimate converged, stopping early")
+                return False
+
+        return True
+
+    def record_encoder_sample(self, timestamp, data, receive_time):
+        """Returns False if the sample came in before recording started and shouldn't be passed on"""
+        encoder1_deg = data[0]
+        encoder2_deg = data[1]
+        self.num_packets += 1
+        self.telemetry.record_packet(timestamp, receive_time)
+
+        if self.adaptive_steps is not None:
+            self.settling_detector.add(timestamp, encoder1_deg - encoder2_deg)
+            self.run_adaptive_steps(timestamp)
+
+        if self.stiffness_estimator is not None:
+            self.update_stiffness(timestamp, encoder1_deg - encoder2_deg)
+
+        if self.record_to_file:
+            if not self.initial_enc_recorded:
+                # self.experiment_info.record_encoder_start_vals(timestamp, encoder1_deg, encoder2_deg)
+                # self.initial_enc_recorded = True
+                if timestamp >= 2.0:
+                    self.experiment_info.record_encoder_start_vals(timestamp, encoder1_deg, encoder2_deg)
+                    self.initial_enc_recorded = True
+                else:
+                    return False
+
+        self.experiment_info.record_encoders(timestamp, encoder1_deg, encoder2_deg)
+        return True
+
+    async def process_encoder_frame(self, packet, receive_time, broadcast=True):
+        """Unpack a binary frame of encoder samples, record them and pass them on as one EncoderBatch"""
+        try:
+            timestamps, data = self.frame_decoder.decode(packet.data[0], packet.timestamp)
+        except FrameError as error:
+            self.logger.warning("Dropped an encoder frame: %s" % error)
+            return
+
+        keep = np.array([self.record_encoder_sample(timestamp, sample, receive_time)
+                         for timestamp, sample in zip(timestamps.tolist(), data.tolist())], dtype=bool)
+        if not np.all(keep):
+            timestamps = timestamps[keep]
+            data = data[keep]
+        if len(timestamps) == 0 or not broadcast:
+            return
+
+        if self.ring_buffer is not None:
+            self.ring_buffer.write(np.column_stack((timestamps, data)))
+
+        if self.batcher is None:
+            await self.broadcast(EncoderBatch(timestamps, data))
+        else:
+            for timestamp, sample in zip(timestamps, data):
+                encoder_batch = self.batcher.add(timestamp, sample)
+                if encoder_batch is not None:
+                    await self.broadcast(encoder_batch)
 
-        for _ in range(2):  # command in both directions
-            for _ in range(repeats):
-                self.command_rise(max_torque_command, command_interval, time_interval)
+    async def flush_encoder_batch(self):
+        if self.batcher is not None:
+            encoder_batch = self.batcher.flush()
+            if encoder_batch is not None:
+                await self.broadcast(encoder_batch)
 
-                self.command_brake(max_torque_command)
-                self.prototype2_bridge_arduino.write_pause(5)
+    def generate_experiment(self, command_interval, time_interval, motor_command, repeats, max_torque_command,
+                            precompiled=False, adaptive=False):
+        """
+        Send the experiment's commands. If precompiled is True, the experiment is compiled into a schedule
+        that's uploaded to the firmware and run on its clock. If adaptive is True, each step is sent as soon
+        as the previous one has settled, the profile's pauses only being the longest a step waits. Otherwise
+        each command is timed by the host.
+        """
+        if precompiled and adaptive:
+            raise ValueError("A precompiled schedule runs on fixed timing, it can't settle adaptively")
 
-                self.command_fall(max_torque_command, command_interval, time_interval)
+        if adaptive:
+            schedule = ExperimentSchedule.from_profile(command_interval, time_interval, motor_command, repeats,
+                                                       max_torque_command)
+            self.report("Settling adaptively: %s at most" % schedule.estimate_string())
+            self.experiment_info.record_settling_params(self.settling_detector.get_params())
+            self.adaptive_steps = deque(schedule.steps())
+        elif precompiled:
+            schedule = ExperimentSchedule.from_profile(command_interval, time_interval, motor_command, repeats,
+                                                       max_torque_command)
+            schedule.validate()
+            self.report("Uploading schedule: %s" % schedule.estimate_string())
+            self.upload_schedule(schedule)
+        else:
+            write_staircase_profile(self, command_interval, time_interval, motor_command, repeats,
+                                    max_torque_command)
 
-                self.command_brake(0)
-                self.prototype2_bridge_arduino.write_pause(5)  # ensure brake dynamics reset
+    def run_adaptive_steps(self, timestamp):
+        """Called for every enc packet. Sends the next step once the current one settles or times out"""
+        if self.current_step is not None:
+            dwell_time = timestamp - self.step_start_time
+            max_dwell_time = self.current_step[2]
+            settled = self.settling_detector.is_settled(timestamp)
+            if not settled and dwell_time < max_dwell_time:
+                return
 
-            self.command_motor(-motor_command)
+            self.experiment_info.record_step_dwell(self.step_start_time, dwell_time, max_dwell_time)
+            if self.stiffness_estimator is not None and self.current_step[0] is not None:
+                self.measure_stiffness_step(timestamp)
+            if self.verbose:
+                if settled:
+                    print("Settled after %0.2fs (at most %ss)" % (dwell_time, max_dwell_time))
+                else:
+                    print("Didn't settle within %ss" % max_dwell_time)
+            self.current_step = None
 
-        self.prototype2_bridge_arduino.write_pause(time_interval)
-        self.command_motor(0)
+        if len(self.adaptive_steps) == 0:
+            return
 
-    def command_rise(self, max_torque_command, command_interval, time_interval):
-        self.command_brake(0)
-        brake_command = 0
-        for brake_command in range(0, max_torque_command + 1, command_interval):
-            self.command_brake(brake_command)
-            self.prototype2_bridge_arduino.write_pause(time_interval)
+        brake, motor, max_dwell_time = self.adaptive_steps.popleft()
+        if brake is not None:
+            self.command_brake(brake)
+        if motor is not None:
+            self.command_motor(motor)
 
-        if brake_command != max_torque_command:
-            self.command_brake(max_torque_command)
-            self.prototype2_bridge_arduino.write_pause(time_interval)
+        if max_dwell_time > 0.0:
+            self.current_step = brake, motor, max_dwell_time
+            self.step_start_time = timestamp
+            self.settling_detector.reset(timestamp)
 
-    def command_fall(self, max_torque_command, command_interval, time_interval):
-        self.command_brake(max_torque_command)
-        brake_command = 0
-        for brake_command in range(max_torque_command, -1, -command_interval):
-            self.command_brake(brake_command)
-            self.prototype2_bridge_arduino.write_pause(time_interval)
+    def start_stiffness_step(self, timestamp, brake_val):
+        """
+        Called for every new brake command. With host timing the deflection is sampled a third of the way
+        through the step, like analyze_experiment does. Adaptive steps are sampled once they settle.
+        A step's torque depends on whether the next command is larger (see commands_to_torque), so the
+        previous step is only added to the estimate now
+        """
+        if self.measured_step is not None:
+            brake_command, sign, deflection = self.measured_step
+            self.measured_step = None
+            torque = commands_to_torque([brake_command, brake_val], *self.lookup_tables)[0]
+            self.add_stiffness_sample(timestamp, deflection, sign * torque)
 
-        if brake_command != 0:
-            self.command_brake(0)
-            self.prototype2_bridge_arduino.write_pause(time_interval)
+        if self.adaptive_steps is None:
+            sample_time = timestamp + self.experiment_info.time_interval / 3
+        else:
+            sample_time = None
+        self.stiffness_step = brake_val, sample_time
+
+    def update_stiffness(self, timestamp, deflection):
+        self.deflection_window.add(timestamp, deflection * self.gear_ratio)
+
+        if self.reference_time is not None and timestamp >= self.reference_time:
+            self.reference_deflection = self.deflection_window.mean()
+            self.reference_time = None
+
+        if self.stiffness_step is not None and self.stiffness_step[1] is not None and \
+                timestamp >= self.stiffness_step[1]:
+            self.measure_stiffness_step(timestamp)
+
+    def measure_stiffness_step(self, timestamp):
+        """Measure the current step's deflection"""
+        if self.stiffness_step is None:
+            return
+        brake_command = self.stiffness_step[0]
+        self.stiffness_step = None
+        if self.reference_deflection is None:
+            return
+
+        sign = -1 if self.motor_val < 0 else 1
+        self.measured_step = brake_command, sign, self.deflection_window.mean() - self.reference_deflection
+
+    def add_stiffness_sample(self, timestamp, deflection, torque):
+        self.stiffness_estimator.add(deflection, torque)
+        self.stiffness_updated = True
+        self.stiffness_converged = self.stiffness_estimator.is_converged()
+        self.experiment_info.record_stiffness_estimate(self.stiffness_estimator.get_results())
+        if self.verbose:
+            print("Stiffness estimate: %s" % self.stiffness_estimator.get_estimate(timestamp))
+
+    def upload_schedule(self, schedule):
+        """The rest of the schedule is sent as the device acknowledges each part, see ScheduleUploader"""
+        self.uploaded_schedule = schedule
+        self.schedule_uploader = ScheduleUploader(schedule)
+        self.prototype2_bridge_arduino.write(self.schedule_uploader.start_command())
+
+    def write_pause(self, pause_time):
+        self.command_schedule_time = max(self.command_schedule_time, time.time()) + pause_time
+        self.prototype2_bridge_arduino.write_pause(pause_time)
 
     def command_brake(self, command):
-        self.prototype2_bridge_arduino.write("b" + str(int(command)))
+        self.write_command("brake", "b", int(command))
 
     def command_motor(self, command):
-        self.prototype2_bridge_arduino.write("m" + str(int(command)))
+        self.write_command("motor", "m", int(command))
+
+    def write_command(self, kind, prefix, value):
+        # commands queue up behind any pauses, so they're sent once all the pauses before them are over
+        self.command_schedule_time = max(self.command_schedule_time, time.time())
+        self.telemetry.record_command(kind, value, self.command_schedule_time)
+        self.prototype2_bridge_arduino.write(prefix + str(value))
+
+    def report(self, message):
+        print("%s: %s" % (self.device_name, message))
 
     async def teardown(self):
+        self.command_channel.cancel()
+        if self.reader is not None:
+            self.reader.stop()
         self.factory.stop_all()
+        if self.reader is not None:
+            self.reader.join(timeout=1.0)
+            if self.reader.overflow_count > 0:
+                self.report("Reader queue overflowed %s times, %s encoder packets recorded but not broadcast, "
+                            "%s dropped" % (self.reader.overflow_count, self.reader.skipped_packets,
+                                            self.reader.dropped_packets))
+            if self.reader.blocked_count > 0:
+                self.report("Reader stopped reading %s times for %0.2fs waiting for the bridge to catch up" % (
+                    self.reader.blocked_count, self.reader.blocked_time))
         if self.record_to_file:
-            self.experiment_info.write_experiment_to_file()
+            self.experiment_info.stop_recording()
 
-        print("time fps avg: %0.4f" % (self.timestamp_sum / self.num_packets))
+        self.report(self.telemetry.summary_string())
+        if self.stiffness_estimator is not None and self.stiffness_estimator.num_steps > 0:
+            self.report("Stiffness estimate: %s" % self.stiffness_estimator.get_estimate(0.0))
+        if self.frame_decoder.num_frames > 0:
+            self.report("%s encoder frames, %s lost, %s failed their checks" % (
+                self.frame_decoder.num_frames, self.frame_decoder.lost_frames, self.frame_decoder.bad_frames))
+        if self.record_to_file:
+            # kept out of experiments/ so the catalog and converter don't take it for a run
+            self.telemetry.write(self.experiment_info.get_experiment_path("json", directory="telemetry"))
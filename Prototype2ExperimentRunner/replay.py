@@ -0,0 +1,52 @@
+import argparse
+
+from atlasbuggy import Orchestrator, run
+
+from experiment_info import *
+from gui.data_plotter import DataPlotter
+from gui.control_ui import TkinterGUI
+from prototype2_bridge import Prototype2bridge
+from replay_prototype2 import ReplayPrototype2
+from simulated_prototype2 import SimulatedDeviceFactory
+
+
+class ReplayOrchestrator(Orchestrator):
+    def __init__(self, event_loop, experiment_path, speed, plot_enabled, gui_enabled):
+        super(ReplayOrchestrator, self).__init__(event_loop)
+
+        recorded_experiment = ExperimentInfo.load_from_file(experiment_path)
+        self.device = ReplayPrototype2("prototype2", SimulatedDeviceFactory(), recorded_experiment, speed)
+
+        # the bridge records into its own copy so the replayed data isn't modified
+        experiment_info = ExperimentInfo()
+        experiment_info.__dict__.update(recorded_experiment.get_metadata())
+
+        self.bridge = Prototype2bridge(experiment_info, record_to_file=False, device=self.device)
+
+        self.plot = DataPlotter(enabled=plot_enabled)
+        self.subscribe(self.bridge, self.plot, self.plot.prototype2_bridge_tag)
+
+        if gui_enabled:
+            self.gui = TkinterGUI()
+            self.subscribe(self.bridge, self.gui, self.gui.prototype2_bridge_tag)
+
+    async def teardown(self):
+        await super(ReplayOrchestrator, self).teardown()
+        print("Pipeline sustained %0.1f samples/s, %s encoder packets the reader couldn't keep up with weren't "
+              "broadcast" % (self.device.samples_per_second(), self.bridge.reader.skipped_packets))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a recorded experiment through the live pipeline")
+    parser.add_argument("experiment_path", help="path to a .p2e, .json or .jsonl experiment file")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="recorded seconds per real second. 0 replays as fast as possible")
+    parser.add_argument("--no-plot", action="store_true")
+    parser.add_argument("--gui", action="store_true")
+    args = parser.parse_args()
+
+    speed = args.speed if args.speed > 0 else None
+    run(ReplayOrchestrator, args.experiment_path, speed, not args.no_plot, args.gui)
+
+
+main()
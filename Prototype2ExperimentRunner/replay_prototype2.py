@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+
+from simulated_prototype2 import SimulatedPacket, SimulatedPrototype2
+
+ENCODER_EVENT = 0
+BRAKE_EVENT = 1
+MOTOR_EVENT = 2
+
+
+class ReplayPrototype2:
+    """
+    Streams a recorded experiment through the same interface as arduino_factory's Arduino so it goes
+    through the live pipeline. Encoder samples and brake/motor echoes come out in timestamp order with
+    their original timestamps. Commands written to the device are ignored since the recorded ones are
+    replayed instead.
+
+    speed is how many recorded seconds pass per real second. None replays as fast as possible.
+    """
+
+    def __init__(self, device_name, factory, experiment_info, speed=1.0):
+        self.device_name = device_name
+        self.factory = factory
+        self.speed = speed
+
+        self.encoder_data = experiment_info.encoder_data
+        self.torque_commands = experiment_info.commanded_torque_data.column("command")
+        self.motor_commands = experiment_info.commanded_motor_data.column("command")
+
+        # merge all streams into one timeline. Commands go before encoder samples with the same timestamp
+        timestamps = np.concatenate((
+            experiment_info.commanded_torque_data.column("timestamp"),
+            experiment_info.commanded_motor_data.column("timestamp"),
+            self.encoder_data.column("timestamp"),
+        ))
+        kinds = np.concatenate((
+            np.full(len(self.torque_commands), BRAKE_EVENT),
+            np.full(len(self.motor_commands), MOTOR_EVENT),
+            np.full(len(self.encoder_data), ENCODER_EVENT),
+        ))
+        indices = np.concatenate((
+            np.arange(len(self.torque_commands)),
+            np.arange(len(self.motor_commands)),
+            np.arange(len(self.encoder_data)),
+        ))
+        order = np.lexsort((kinds == ENCODER_EVENT, timestamps))
+        self.timestamps = timestamps[order]
+        self.kinds = kinds[order]
+        self.indices = indices[order]
+
+        self.event_index = 0
+        self.num_encoder_samples = 0
+        self.real_start_time = 0.0
+        self.real_end_time = None
+        self.ignored_commands = 0
+
+    def start(self):
+        self.real_start_time = time.time()
+
+    def write(self, command):
+        self.ignored_commands += 1
+
+    def write_pause(self, pause_time):
+        pass
+
+    def read(self):
+        if self.event_index >= len(self.timestamps):
+            if self.real_end_time is None:
+                self.real_end_time = time.time()
+                print("Replayed %s encoder samples in %0.2fs (%0.1f samples/s)" % (
+                    self.num_encoder_samples, self.real_elapsed_time(), self.samples_per_second()))
+            self.factory.stop_all()
+            return SimulatedPacket(None, self.timestamps[-1] if len(self.timestamps) > 0 else 0.0, [])
+
+        timestamp = self.timestamps[self.event_index]
+        kind = self.kinds[self.event_index]
+        index = self.indices[self.event_index]
+        self.event_index += 1
+
+        if self.speed is not None:
+            sleep_time = (timestamp - self.timestamps[0]) / self.speed - (time.time() - self.real_start_time)
+            if sleep_time > 0.0:
+                time.sleep(sleep_time)
+
+        if kind == BRAKE_EVENT:
+            return SimulatedPacket("brake", timestamp, [int(self.torque_commands[index])])
+        elif kind == MOTOR_EVENT:
+            return SimulatedPacket("motor", timestamp, [int(self.motor_commands[index])])
+        else:
+            self.num_encoder_samples += 1
+            timestamp, encoder1_angle, encoder2_angle = self.encoder_data[index]
+
+            # analog values aren't recorded, recreate them from the angles
+            return SimulatedPacket("enc", timestamp, [
+                encoder1_angle, encoder2_angle,
+                SimulatedPrototype2.analog_value(encoder1_angle), SimulatedPrototype2.analog_value(encoder2_angle)
+            ])
+
+    def real_elapsed_time(self):
+        end_time = self.real_end_time if self.real_end_time is not None else time.time()
+        return end_time - self.real_start_time
+
+    def samples_per_second(self):
+        elapsed_time = self.real_elapsed_time()
+        return self.num_encoder_samples / elapsed_time if elapsed_time > 0.0 else 0.0
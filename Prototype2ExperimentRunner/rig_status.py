@@ -0,0 +1,54 @@
+import math
+import time
+import asyncio
+
+from atlasbuggy import Node
+
+from experiment_info import ExperimentInfo
+
+
+class RigStatusView(Node):
+    """Prints one line per rig every interval seconds until every rig's experiment is done"""
+
+    def __init__(self, bridges, interval=5.0, enabled=True):
+        super(RigStatusView, self).__init__(enabled)
+        self.bridges = bridges
+        self.interval = interval
+        self.start_time = time.time()
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.print_status()
+            if all(bridge.done for bridge in self.bridges):
+                return
+
+    def print_status(self):
+        print("%-12s %-20s %-6s %-9s %-6s %-6s %-10s %-5s %-18s" % (
+            "rig", "annulus (in)", "brake", "cycle", "torque", "motor", "packets/s", "gaps", "stiffness (Nm/deg)"))
+        for bridge in self.bridges:
+            print("%-12s %-20s %-6s %-9s %-6s %-6s %-10.1f %-5s %-18s" % self.status_row(bridge))
+        print("%0.1fs elapsed" % (time.time() - self.start_time))
+
+    @staticmethod
+    def status_row(bridge):
+        experiment_info = bridge.experiment_info
+        annulus = "%sx%sx%s" % (experiment_info.conical_annulus_length_in, experiment_info.conical_annulus_od_in,
+                                experiment_info.conical_annulus_wall_thickness_in)
+        brake = "large" if experiment_info.brake_type == ExperimentInfo.LARGE_BRAKE else "small"
+        if bridge.done:
+            cycle = "done"
+        else:
+            cycle = "%s/%s" % (min(bridge.cycle_num, experiment_info.repeats * 2), experiment_info.repeats * 2)
+
+        estimator = bridge.stiffness_estimator
+        if estimator is None or estimator.num_steps == 0:
+            stiffness = "-"
+        elif math.isinf(estimator.slope_interval()):
+            stiffness = "%0.4f" % estimator.slope
+        else:
+            stiffness = "%0.4f+/-%0.4f%s" % (estimator.slope, estimator.slope_interval(),
+                                             "*" if estimator.is_converged() else "")
+
+        return (bridge.device_name, annulus, brake, cycle, bridge.prev_brake_val, bridge.motor_val,
+                bridge.telemetry.packet_rate(), bridge.telemetry.num_gaps, stiffness)
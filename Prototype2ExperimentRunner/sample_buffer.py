@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class SampleBuffer:
+    """
+    Growable columnar buffer of samples. Each column is stored in its own contiguous typed array whose
+    capacity doubles when it fills up, so appending is amortized O(1) and columns are handed out as
+    zero-copy NumPy views.
+    """
+
+    def __init__(self, column_names, capacity=1024, dtype=np.float64):
+        self.column_names = tuple(column_names)
+        self._columns = [np.empty(max(capacity, 1), dtype=dtype) for _ in self.column_names]
+        self._size = 0
+
+    @classmethod
+    def from_rows(cls, column_names, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(column_names))
+        buffer = cls(column_names, len(rows))
+        buffer.extend(rows)
+        return buffer
+
+    @classmethod
+    def from_columns(cls, column_names, columns):
+        """Wrap existing column arrays without copying them. They're only copied if the buffer grows."""
+        buffer = cls(column_names, 1)
+        buffer._columns = list(columns)
+        buffer._size = len(buffer._columns[0])
+        return buffer
+
+    @property
+    def capacity(self):
+        return len(self._columns[0])
+
+    def append(self, sample):
+        if self._size == self.capacity:
+            self._grow(self._size + 1)
+        for column, value in zip(self._columns, sample):
+            column[self._size] = value
+        self._size += 1
+
+    def extend(self, rows):
+        """Append an (n, num_columns) array of samples"""
+        rows = np.asarray(rows)
+        self.extend_columns(*rows.T)
+
+    def extend_columns(self, *columns):
+        """Append one equal length array per column"""
+        length = len(columns[0])
+        if self._size + length > self.capacity:
+            self._grow(self._size + length)
+        for column, values in zip(self._columns, columns):
+            column[self._size:self._size + length] = values
+        self._size += length
+
+    def _grow(self, min_capacity):
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for index, column in enumerate(self._columns):
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[index] = grown
+
+    def column(self, key):
+        """Zero-copy view of one column, looked up by name or index"""
+        if isinstance(key, str):
+            key = self.column_names.index(key)
+        return self._columns[key][:self._size]
+
+    def columns(self):
+        return [column[:self._size] for column in self._columns]
+
+    def tolist(self):
+        return np.column_stack(self.columns()).tolist()
+
+    def __array__(self, dtype=None, copy=None):
+        return np.column_stack(self.columns()).astype(dtype, copy=False)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        return tuple(column[index] for column in self.columns())
+
+    def __iter__(self):
+        return zip(*self.columns())
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class SegmentStatistics:
+    """
+    The sample count, mean, standard deviation, minimum and maximum of a signal over each of a set of
+    segments, such as the settled part of every brake step.
+
+    Segments are found with a binary search on the timestamps. Their samples are gathered into one
+    contiguous array so every statistic is a single ufunc.reduceat over it, O(n) in the number of samples
+    however many segments there are. Empty segments have a count of 0 and nan for everything else.
+    """
+
+    def __init__(self, count, mean, std, minimum, maximum):
+        self.count = count
+        self.mean = mean
+        self.std = std
+        self.min = minimum
+        self.max = maximum
+
+    def __len__(self):
+        return len(self.count)
+
+    @classmethod
+    def from_time_windows(cls, timestamps, values, starts, ends):
+        """Statistics of the values with starts[i] <= timestamp < ends[i]. timestamps must be sorted"""
+        start_indices = np.searchsorted(timestamps, starts, side="left")
+        end_indices = np.searchsorted(timestamps, ends, side="left")
+        return cls.from_indices(values, start_indices, end_indices)
+
+    @classmethod
+    def from_indices(cls, values, start_indices, end_indices):
+        """Statistics of values[start_indices[i]:end_indices[i]]"""
+        values = np.asarray(values, dtype=float)
+        start_indices = np.asarray(start_indices, dtype=np.int64)
+        count = np.maximum(np.asarray(end_indices, dtype=np.int64) - start_indices, 0)
+
+        num_segments = len(count)
+        mean = np.full(num_segments, np.nan)
+        std = np.full(num_segments, np.nan)
+        minimum = np.full(num_segments, np.nan)
+        maximum = np.full(num_segments, np.nan)
+
+        non_empty = count > 0
+        if not np.any(non_empty):
+            return cls(count, mean, std, minimum, maximum)
+
+        # gather the segments' samples back to back, offsets being where each one starts
+        segment_counts = count[non_empty]
+        offsets = np.cumsum(segment_counts) - segment_counts
+        indices = np.arange(offsets[-1] + segment_counts[-1]) - np.repeat(offsets - start_indices[non_empty],
+                                                                           segment_counts)
+        samples = values[indices]
+
+        segment_mean = np.add.reduceat(samples, offsets) / segment_counts
+        # two passes so the variance doesn't lose precision when the mean is large compared to the spread
+        deviations = samples - np.repeat(segment_mean, segment_counts)
+        segment_variance = np.add.reduceat(deviations * deviations, offsets) / segment_counts
+
+        mean[non_empty] = segment_mean
+        std[non_empty] = np.sqrt(segment_variance)
+        minimum[non_empty] = np.minimum.reduceat(samples, offsets)
+        maximum[non_empty] = np.maximum.reduceat(samples, offsets)
+
+        return cls(count, mean, std, minimum, maximum)
@@ -0,0 +1,125 @@
+import time
+import queue
+import asyncio
+import threading
+
+ENCODER_PACKETS = ("enc", "encb")  # only recorded, not passed on, if the queue is full
+
+
+class SerialReader(threading.Thread):
+    """
+    Reads and decodes packets from a device on a dedicated thread and hands them to the event loop in
+    batches of (receive time, packet, broadcast) through a bounded queue. The event loop only wakes up when
+    a batch is ready.
+
+    If the consumer falls behind and the queue fills up, the batch that didn't fit is carried over into the
+    next one, so nothing is lost from the recording. Its encoder packets (samples or binary frames) have
+    broadcast set to False though, and are counted as skipped: the bridge records them without passing
+    them on to subscribers, which sheds the work of plotting them until it catches up. Once max_carry_over
+    packets are carried over the reader stops reading and waits for room, the device's serial buffer taking
+    up the slack (and overflowing if the consumer is stalled for long, which shows up as gaps in the
+    telemetry), so a stalled event loop can't make the carried over batch grow without limit.
+    """
+
+    def __init__(self, device, factory, event_loop, queue_size=64, batch_size=32, batch_interval=0.01,
+                 max_carry_over=2048, block_timeout=0.1):
+        super(SerialReader, self).__init__(daemon=True)
+        self.device = device
+        self.factory = factory
+        self.event_loop = event_loop
+
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_carry_over = max_carry_over
+        self.block_timeout = block_timeout  # how often a blocked reader checks whether it's been stopped
+
+        self.queue = queue.Queue(queue_size)
+        self.batch_ready = asyncio.Event()
+        self.stop_event = threading.Event()
+        self.finished = False
+
+        self.overflow_count = 0
+        self.skipped_packets = 0  # recorded but not broadcast
+        self.dropped_packets = 0  # never handed to the bridge at all, only if it stopped reading at the end
+        self.blocked_count = 0  # times the carried over batch hit max_carry_over and reading paused
+        self.blocked_time = 0.0  # seconds spent not reading the device because of it
+
+    def run(self):
+        batch = []
+        num_carried_over = 0
+        batch_start_time = time.time()
+        while self.factory.ok() and not self.stop_event.is_set():
+            packet = self.device.read()
+            batch.append((time.time(), packet, True))
+
+            if len(batch) - num_carried_over >= self.batch_size or \
+                    time.time() - batch_start_time >= self.batch_interval:
+                batch = self.hand_off(batch, num_carried_over)
+                num_carried_over = len(batch)
+                batch_start_time = time.time()
+
+        # once stop() is called the bridge is done with the run and nothing reads the rest. Otherwise the
+        # device went away while the bridge is still reading, give it a chance to make room for the last batch
+        if len(batch) > 0 and not self.stop_event.is_set():
+            try:
+                self.queue.put(batch, timeout=1.0)
+            except queue.Full:
+                self.overflow_count += 1
+                self.dropped_packets += len(batch)
+        self.finished = True
+        self.event_loop.call_soon_threadsafe(self.batch_ready.set)
+
+    def hand_off(self, batch, num_carried_over=0):
+        """
+        Put the batch in the queue. Returns whatever has to be carried over into the next batch. The first
+        num_carried_over packets didn't fit last time and have already been marked
+        """
+        if len(batch) == 0:
+            return batch
+
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.overflow_count += 1
+            for index in range(num_carried_over, len(batch)):
+                receive_time, packet, broadcast = batch[index]
+                if packet.name in ENCODER_PACKETS:
+                    batch[index] = receive_time, packet, False
+                    self.skipped_packets += 1
+            if len(batch) >= self.max_carry_over:
+                return self.wait_for_room(batch)
+            return batch
+
+        self.event_loop.call_soon_threadsafe(self.batch_ready.set)
+        return []
+
+    def wait_for_room(self, batch):
+        """Block until the batch fits in the queue. Returns it if the reader is stopped first"""
+        self.blocked_count += 1
+        start_time = time.time()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(batch, timeout=self.block_timeout)
+                except queue.Full:
+                    continue
+                self.event_loop.call_soon_threadsafe(self.batch_ready.set)
+                return []
+            return batch
+        finally:
+            self.blocked_time += time.time() - start_time
+
+    async def get_batch(self):
+        """Wait for the next batch of packets. Returns None once the reader has stopped and the queue is empty"""
+        while True:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                if self.finished:
+                    # the final batch is queued before finished is set
+                    return None if self.queue.empty() else self.queue.get_nowait()
+                self.batch_ready.clear()
+                await self.batch_ready.wait()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,66 @@
+import math
+from collections import deque
+
+
+class SettlingDetector:
+    """
+    Decides when the conical annulus' deflection (encoder1 - encoder2) has stopped moving after a command.
+    Keeps the variance of the deflection over the last window seconds. The deflection counts as settled
+    once the window is full, the step has lasted at least min_dwell seconds and the standard deviation
+    over the window is within tolerance degrees.
+    """
+
+    def __init__(self, window=1.0, tolerance=0.1, min_dwell=1.0):
+        self.window = window
+        self.tolerance = tolerance
+        self.min_dwell = min_dwell
+
+        self.samples = deque()
+        self.reference = 0.0  # samples are stored relative to this so the running sums don't lose precision
+        self.total = 0.0
+        self.total_squared = 0.0
+        self.start_time = None
+
+    def reset(self, timestamp):
+        """Start a new step. Samples from before the command don't count towards settling"""
+        self.samples.clear()
+        self.total = 0.0
+        self.total_squared = 0.0
+        self.start_time = timestamp
+
+    def add(self, timestamp, deflection):
+        if len(self.samples) == 0:
+            self.reference = deflection
+            self.total = 0.0
+            self.total_squared = 0.0
+
+        value = deflection - self.reference
+        self.samples.append((timestamp, value))
+        self.total += value
+        self.total_squared += value * value
+
+        while self.samples[0][0] < timestamp - self.window:
+            old_timestamp, old_value = self.samples.popleft()
+            self.total -= old_value
+            self.total_squared -= old_value * old_value
+
+    def variance(self):
+        if len(self.samples) < 2:
+            return float("inf")
+        mean = self.total / len(self.samples)
+        return max(self.total_squared / len(self.samples) - mean * mean, 0.0)
+
+    def mean(self):
+        if len(self.samples) == 0:
+            return None
+        return self.reference + self.total / len(self.samples)
+
+    def is_settled(self, timestamp):
+        if self.start_time is None or len(self.samples) < 2:
+            return False
+        if timestamp - self.start_time < max(self.min_dwell, self.window):
+            return False
+        return math.sqrt(self.variance()) <= self.tolerance
+
+    def get_params(self):
+        return {"window": self.window, "tolerance": self.tolerance, "min_dwell": self.min_dwell}
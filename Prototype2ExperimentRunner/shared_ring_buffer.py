@@ -0,0 +1,112 @@
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+HEADER_SIZE = 8  # int64s: write count, capacity, number of columns, writer closed, write count once the
+                 # block being written is done, the rest are unused
+
+
+class SharedRingBuffer:
+    """
+    Rows of float64 samples in shared memory, written by one process and read by others.
+
+    The writer never waits for readers. Once the buffer is full the oldest rows are overwritten, a reader
+    that falls too far behind skips ahead and counts the rows it lost. The header's write count is only
+    advanced after a row is written, and the slots the writer is filling in at any moment (the next one,
+    or the whole block for write) are counted as lost too, so readers never see a partially written row.
+    """
+
+    def __init__(self, memory, is_writer):
+        self.memory = memory
+        self.is_writer = is_writer
+
+        self.header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=memory.buf)
+        self.capacity = int(self.header[1])
+        self.num_columns = int(self.header[2])
+        self.data = np.ndarray((self.capacity, self.num_columns), dtype=np.float64, buffer=memory.buf,
+                               offset=self.header.nbytes)
+
+        self.read_count = 0
+        self.lost_rows = 0
+
+    @classmethod
+    def create(cls, num_columns, capacity=2 ** 18):
+        size = (HEADER_SIZE + capacity * num_columns) * 8
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=memory.buf)
+        header[:] = 0
+        header[1] = capacity
+        header[2] = num_columns
+        del header  # the memory can't be closed while arrays still point into it
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name):
+        memory = shared_memory.SharedMemory(name=name)
+        # only the writer should unlink the memory, don't let this process' resource tracker do it on exit
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return cls(memory, False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def write_count(self):
+        return int(self.header[0])
+
+    @property
+    def writer_closed(self):
+        return self.header[3] != 0
+
+    def write_row(self, *values):
+        count = int(self.header[0])
+        self.data[count % self.capacity] = values
+        self.header[0] = count + 1
+
+    def write(self, rows):
+        """Write an (n, num_columns) array of rows"""
+        rows = rows[-self.capacity:]
+        count = int(self.header[0])
+        self.header[4] = count + len(rows)  # readers treat these slots as being overwritten from now on
+        start = count % self.capacity
+        length = min(len(rows), self.capacity - start)
+        self.data[start:start + length] = rows[:length]
+        self.data[:len(rows) - length] = rows[length:]
+        self.header[0] = count + len(rows)
+
+    def unsafe_count(self):
+        """Rows before this one minus capacity may be getting overwritten. The writer is always about to
+        fill in the slot after the last row it wrote, or is in the middle of a block"""
+        return max(int(self.header[0]) + 1, int(self.header[4]))
+
+    def read(self):
+        """Copy out every row written since the last read"""
+        write_count = int(self.header[0])
+        lost = self.unsafe_count() - self.capacity - self.read_count
+        if lost > 0:
+            self.lost_rows += lost
+            self.read_count += lost
+
+        rows = self.data[np.arange(self.read_count, write_count) % self.capacity]
+
+        # rows the writer got to again while they were being copied are garbage
+        overwritten = self.unsafe_count() - self.capacity - self.read_count
+        if overwritten > 0:
+            rows = rows[overwritten:]
+            self.lost_rows += overwritten
+            self.read_count += overwritten
+
+        # the writer may have gotten past write_count, in which case the rows it's lost are skipped next time
+        self.read_count = max(self.read_count, write_count)
+        return rows
+
+    def close_writer(self):
+        self.header[3] = 1
+
+    def close(self):
+        del self.header
+        del self.data
+        self.memory.close()
+        if self.is_writer:
+            self.memory.unlink()
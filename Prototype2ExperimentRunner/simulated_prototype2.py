@@ -0,0 +1,281 @@
+import math
+import time
+import random
+from collections import deque
+
+import numpy as np
+
+from experiment_info import ExperimentInfo
+from brake_lookup import get_lookup_tables
+from experiment_schedule import SCHEDULE_TIME_UNIT, SCHEDULE_DT_MASK, SCHEDULE_BRAKE_FLAG, SCHEDULE_MOTOR_FLAG, \
+    SCHEDULE_REVERSE_FLAG, SCHEDULE_BUFFER_ENTRIES, ENTRIES_PER_UPLOAD_COMMAND
+from binary_framing import FRAME_RECORDS, RECORD_DTYPE, encode_frame
+
+ENCODER_MIN_VAL = 3  # matches AbsoluteEncoder.h
+ENCODER_MAX_VAL = 1021
+
+
+class SimulatedPacket:
+    def __init__(self, name, timestamp, data):
+        self.name = name
+        self.timestamp = timestamp
+        self.data = data
+
+
+class SimulatedDeviceFactory:
+    """Stands in for arduino_factory's DeviceFactory"""
+
+    def __init__(self):
+        self.running = True
+
+    def ok(self):
+        return self.running
+
+    def stop_all(self):
+        self.running = False
+
+
+class SimulatedPrototype2:
+    """
+    Stands in for the Prototype 2 Arduino. Speaks the same protocol as Prototype2.ino: b<n> and m<n>
+    commands are echoed back as brake and motor packets, enc packets (ffdd) are streamed at sample_rate
+    unless the device is paused, and precompiled schedules (s, e, x and q commands) run on the device's
+    clock out of a ring buffer of SCHEDULE_BUFFER_ENTRIES, acknowledging uploads with schedule_entries. f1 switches enc packets to binary encb frames, f0 switches back. Commands can be queued with
+    write_pause like arduino_factory's Arduino.
+
+    The motor turns the input shaft at a speed proportional to its command. The brake's torque comes from
+    the lookup tables (ascending or descending depending on which way the command moved) and deflects the
+    conical annulus by torque / stiffness degrees, approaching it with a first order response.
+
+    time_scale sets how many simulated seconds pass per real second. None runs as fast as possible.
+    """
+
+    def __init__(self, device_name, factory, brake_type=ExperimentInfo.LARGE_BRAKE, stiffness=0.05,
+                 sample_rate=1000.0, time_scale=1.0, max_motor_speed=180.0, response_time=0.3, noise=0.05,
+                 gear_ratio=32.0 / 48.0, seed=None):
+        self.device_name = device_name
+        self.factory = factory
+
+        self.ascending_command_to_torque, self.descending_command_to_torque = get_lookup_tables(brake_type)
+        self.stiffness = stiffness  # N*m / degree
+        self.sample_period = 1.0 / sample_rate
+        self.time_scale = time_scale
+        self.max_motor_speed = max_motor_speed  # degrees per second of the input shaft at full command
+        self.response_time = response_time
+        self.noise = noise
+        self.gear_ratio = gear_ratio
+        self.random = random.Random(seed)
+
+        self.started = False
+        self.paused = False
+        self.real_start_time = 0.0
+        self.time = 0.0
+
+        self.scheduled_commands = deque()  # (device time, command)
+        self.schedule_cursor = 0.0
+        self.outgoing = deque()
+
+        self.schedule = []  # every entry received. Only SCHEDULE_BUFFER_ENTRIES of them can be waiting to run
+        self.schedule_expected_length = 0
+        self.schedule_checksum = 0
+        self.schedule_index = 0
+        self.schedule_step_time = 0.0
+        self.schedule_running = False
+
+        self.binary_framing = False
+        self.frame_records = []  # (time, enc packet data)
+        self.frame_sequence = 0
+
+        self.brake_val = 0
+        self.motor_val = 0
+        self.brake_torque = 0.0
+        self.input_angle = 0.0
+        self.deflection = 0.0
+
+    def start(self):
+        self.started = True
+        self.real_start_time = time.time()
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self):
+        self.paused = False
+
+    def write(self, command):
+        self.schedule_cursor = max(self.schedule_cursor, self.time)
+        self.scheduled_commands.append((self.schedule_cursor, command))
+
+    def write_pause(self, pause_time):
+        self.schedule_cursor = max(self.schedule_cursor, self.time) + pause_time
+
+    def read(self):
+        if not self.started or not self.factory.ok():
+            self.stop()
+            return SimulatedPacket(None, self.time, [])
+
+        while len(self.outgoing) == 0:
+            self.apply_due_commands()
+            if len(self.outgoing) > 0:
+                break
+
+            if self.paused:
+                # nothing is streamed while paused. Skip ahead to the next command or time out like a read would
+                next_command_time = self.next_command_time()
+                if next_command_time is None:
+                    self.advance(0.1)
+                    return SimulatedPacket(None, self.time, [])
+                self.advance(max(next_command_time - self.time, 0.0))
+            else:
+                self.advance(self.sample_period)
+                self.add_encoder_sample(self.encoder_packet())
+
+        return self.outgoing.popleft()
+
+    def stop(self):
+        self.schedule_running = False
+        self.set_brake(0)
+        self.motor_val = 0
+
+    def next_command_time(self):
+        times = []
+        if len(self.scheduled_commands) > 0:
+            times.append(self.scheduled_commands[0][0])
+        if self.schedule_entry_ready():
+            times.append(self.schedule_step_time + self.schedule_entry_delay())
+        return min(times) if len(times) > 0 else None
+
+    def apply_due_commands(self):
+        while len(self.scheduled_commands) > 0 and self.scheduled_commands[0][0] <= self.time:
+            command = self.scheduled_commands.popleft()[1]
+            self.process_command(command)
+
+        while self.schedule_entry_ready() and self.schedule_step_time + self.schedule_entry_delay() <= self.time:
+            self.run_schedule_entry()
+
+    def schedule_entry_ready(self):
+        """False while the schedule is waiting on the host to upload its next entry"""
+        return self.schedule_running and self.schedule_index < len(self.schedule)
+
+    def schedule_entry_delay(self):
+        return (self.schedule[self.schedule_index][0] & SCHEDULE_DT_MASK) * SCHEDULE_TIME_UNIT
+
+    def run_schedule_entry(self):
+        header, brake, motor = self.schedule[self.schedule_index]
+        self.schedule_step_time += self.schedule_entry_delay()
+
+        if header & SCHEDULE_BRAKE_FLAG:
+            self.process_command("b%d" % brake)
+        if header & SCHEDULE_MOTOR_FLAG:
+            self.process_command("m%d" % (-motor if header & SCHEDULE_REVERSE_FLAG else motor))
+
+        self.schedule_index += 1
+        if self.schedule_index >= self.schedule_expected_length:
+            self.schedule_running = False
+            self.outgoing.append(SimulatedPacket("schedule_done", self.time, [
+                len(self.schedule), self.schedule_checksum & 0x7fff]))
+        elif len(self.schedule) < self.schedule_expected_length and \
+                SCHEDULE_BUFFER_ENTRIES - (len(self.schedule) - self.schedule_index) == ENTRIES_PER_UPLOAD_COMMAND:
+            self.outgoing.append(self.schedule_entries_packet())
+
+    def schedule_entries_packet(self):
+        return SimulatedPacket("schedule_entries", self.time, [len(self.schedule), self.schedule_index])
+
+    def process_command(self, command):
+        if command[0] == 'b':
+            self.set_brake(int(command[1:]))
+            self.outgoing.append(SimulatedPacket("brake", self.time, [self.brake_val]))
+        elif command[0] == 'm':
+            self.motor_val = int(command[1:])
+            self.outgoing.append(SimulatedPacket("motor", self.time, [self.motor_val]))
+        elif command[0] == 's':
+            self.schedule_running = False
+            self.schedule_expected_length = int(command[1:])
+            self.schedule = []
+            self.schedule_index = 0
+            self.schedule_checksum = 0
+            self.outgoing.append(self.schedule_entries_packet())
+        elif command[0] == 'e':
+            for index in range(0, len(command) - 8, 8):
+                if len(self.schedule) >= self.schedule_expected_length or \
+                        len(self.schedule) - self.schedule_index >= SCHEDULE_BUFFER_ENTRIES:
+                    break
+                entry = bytes.fromhex(command[index + 1:index + 9])
+                self.schedule.append(((entry[0] << 8) | entry[1], entry[2], entry[3]))
+                self.schedule_checksum += sum(entry)
+            self.outgoing.append(self.schedule_entries_packet())
+        elif command[0] == 'x':
+            if len(self.schedule) > 0:
+                self.schedule_index = 0
+                self.schedule_step_time = self.time
+                self.schedule_running = True
+                self.outgoing.append(SimulatedPacket("schedule", self.time, [
+                    self.schedule_expected_length, len(self.schedule)]))
+            else:
+                self.outgoing.append(SimulatedPacket("schedule", self.time, [-1, 0]))
+        elif command[0] == 'q':
+            self.stop()
+        elif command[0] == 'f':
+            if self.binary_framing and len(self.frame_records) > 0:
+                self.outgoing.append(self.encoder_frame())
+            self.binary_framing = command[1:] == "1"
+
+    def set_brake(self, brake_val):
+        brake_val = min(max(brake_val, 0), 255)
+        if brake_val > self.brake_val:
+            self.brake_torque = self.ascending_command_to_torque[brake_val]
+        elif brake_val < self.brake_val:
+            self.brake_torque = self.descending_command_to_torque[brake_val]
+        self.brake_val = brake_val
+
+    def advance(self, dt):
+        if self.time_scale is not None:
+            # don't get ahead of the real clock
+            sleep_time = (self.time + dt) / self.time_scale - (time.time() - self.real_start_time)
+            if sleep_time > 0.0:
+                time.sleep(sleep_time)
+
+        self.time += dt
+
+        # the brake holds the output shaft back, the spring's deflection carries the brake's torque
+        direction = (self.motor_val > 0) - (self.motor_val < 0)
+        target_deflection = direction * self.brake_torque / self.stiffness
+        self.deflection += (target_deflection - self.deflection) * (1.0 - math.exp(-dt / self.response_time))
+        self.input_angle += self.motor_val / 255.0 * self.max_motor_speed * dt
+
+    def add_encoder_sample(self, packet):
+        if not self.binary_framing:
+            self.outgoing.append(packet)
+            return
+
+        self.frame_records.append((packet.timestamp, packet.data))
+        if len(self.frame_records) >= FRAME_RECORDS:
+            self.outgoing.append(self.encoder_frame())
+
+    def encoder_frame(self):
+        first_time = self.frame_records[0][0]
+        records = np.array([
+            (data[0], data[1], data[2], data[3], int(round((timestamp - first_time) * 1E6)))
+            for timestamp, data in self.frame_records
+        ], dtype=RECORD_DTYPE)
+        payload = encode_frame(self.frame_sequence, int(round(first_time * 1E6)), int(round(self.time * 1E6)),
+                               records)
+
+        self.frame_sequence += 1
+        self.frame_records = []
+        return SimulatedPacket("encb", self.time, [payload])
+
+    def encoder_packet(self):
+        output_angle = self.input_angle - self.deflection
+
+        # encoders are geared up from the shafts
+        encoder1_angle = self.input_angle / self.gear_ratio + self.random.gauss(0.0, self.noise)
+        encoder2_angle = output_angle / self.gear_ratio + self.random.gauss(0.0, self.noise)
+
+        return SimulatedPacket("enc", self.time, [
+            encoder1_angle, encoder2_angle, self.analog_value(encoder1_angle), self.analog_value(encoder2_angle)
+        ])
+
+    @staticmethod
+    def analog_value(angle):
+        return int(ENCODER_MIN_VAL + (angle % 360.0) / 360.0 * (ENCODER_MAX_VAL - ENCODER_MIN_VAL))
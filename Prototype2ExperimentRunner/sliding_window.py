@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class SlidingWindowBuffer:
+    """
+    The last window seconds of a few columns of samples, the first column being the timestamps.
+
+    Samples are appended into preallocated arrays. Once the end of the arrays is reached, the samples
+    still in the window are copied back to the start (the arrays grow if the window no longer fits in
+    half of them), so appending is amortized O(1) and every column stays available as a contiguous view
+    without copying. Old samples are trimmed with a binary search on the timestamps.
+    """
+
+    def __init__(self, num_columns, window, capacity=1024):
+        self.window = window
+        self.data = np.empty((num_columns, capacity))
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def capacity(self):
+        return self.data.shape[1]
+
+    def append(self, *values):
+        self.make_room(1)
+        self.data[:, self.end] = values
+        self.end += 1
+
+    def extend(self, *columns):
+        """Add a block of samples, one array per column"""
+        length = len(columns[0])
+        self.make_room(length)
+        for index, column in enumerate(columns):
+            self.data[index, self.end:self.end + length] = column
+        self.end += length
+
+    def make_room(self, length):
+        if self.end + length <= self.capacity:
+            return
+
+        size = len(self)
+        if size + length > self.capacity // 2:
+            capacity = self.capacity
+            while size + length > capacity // 2:
+                capacity *= 2
+            data = np.empty((self.data.shape[0], capacity))
+        else:
+            data = self.data
+
+        data[:, :size] = self.data[:, self.start:self.end]
+        self.data = data
+        self.start = 0
+        self.end = size
+
+    def trim(self):
+        """Drop the samples more than window seconds older than the newest one"""
+        if len(self) == 0:
+            return
+        timestamps = self.data[0, self.start:self.end]
+        self.start += int(np.searchsorted(timestamps, timestamps[-1] - self.window, side="left"))
+
+    def column(self, index):
+        return self.data[index, self.start:self.end]
+
+    @property
+    def timestamps(self):
+        return self.column(0)
@@ -0,0 +1,133 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import oaconvolve
+
+# below this many multiply-adds np.convolve is faster than overlap-add
+DIRECT_CONVOLUTION_LIMIT = 2 ** 20
+
+
+@lru_cache(maxsize=64)
+def _savitzky_golay_coefficients(window_size, order, deriv, position):
+    order_range = np.arange(order + 1)
+    half_window = (window_size - 1) // 2
+    b = np.arange(-half_window, half_window + 1, dtype=float)[:, np.newaxis] ** order_range
+    pseudo_inverse = np.linalg.pinv(b)
+
+    # the fitted polynomial's deriv-th derivative, evaluated position samples from the middle of the window
+    powers = order_range[deriv:]
+    weights = np.array([math.factorial(power) / math.factorial(power - deriv) for power in powers.tolist()])
+    coefficients = (weights * float(position) ** (powers - deriv)).dot(pseudo_inverse[deriv:])
+    coefficients.setflags(write=False)
+    return coefficients
+
+
+def savitzky_golay_coefficients(window_size, order, deriv=0, rate=1, position=0):
+    """
+    Weights that, correlated with window_size samples, give the deriv-th derivative of the order-th degree
+    polynomial fit to them. position is where in the window the fit is evaluated, 0 being the middle sample
+    and (window_size - 1) // 2 the newest one. Coefficients are cached, only the rate scaling is redone
+    """
+    try:
+        window_size = abs(int(window_size))
+        order = abs(int(order))
+    except ValueError:
+        raise ValueError("window_size and order have to be of type int")
+
+    if window_size % 2 != 1 or window_size < 1:
+        raise TypeError("window_size size must be a positive odd number")
+
+    if window_size < order + 2:
+        raise TypeError("window_size is too small for the polynomials order")
+
+    coefficients = _savitzky_golay_coefficients(window_size, order, int(deriv), int(position))
+    if deriv == 0:
+        return coefficients
+    return coefficients * (rate ** deriv)
+
+
+def correlate_valid(y, coefficients, method="auto"):
+    """np.convolve(coefficients[::-1], y, mode='valid'), with overlap-add FFT convolution for long signals"""
+    if method == "auto":
+        method = "direct" if len(y) * len(coefficients) <= DIRECT_CONVOLUTION_LIMIT else "fft"
+
+    if method == "direct":
+        return np.convolve(coefficients[::-1], y, mode='valid')
+    elif method == "fft":
+        return oaconvolve(y, coefficients[::-1], mode='valid')
+    else:
+        raise ValueError("Unknown convolution method '%s', expected auto, direct or fft" % method)
+
+
+def savitzky_golay(y, window_size, order, deriv=0, rate=1, method="auto"):
+    """
+    Smooth (or differentiate) y with a Savitzky-Golay filter. The signal is padded at the extremes with
+    values taken from the signal itself, so the result is as long as y
+    """
+    coefficients = savitzky_golay_coefficients(window_size, order, deriv, rate)
+    half_window = (len(coefficients) - 1) // 2
+
+    y = np.asarray(y, dtype=float)
+    firstvals = y[0] - np.abs(y[1:half_window + 1][::-1] - y[0])
+    lastvals = y[-1] + np.abs(y[-half_window - 1:-1][::-1] - y[-1])
+    y = np.concatenate((firstvals, y, lastvals))
+    return correlate_valid(y, coefficients, method)
+
+
+class StreamingSavitzkyGolay:
+    """
+    A Savitzky-Golay filter fed one chunk of a signal at a time, keeping only the last window of samples.
+
+    Centered (the default), each sample is output once half a window of samples after it has come in,
+    and flush() outputs the rest at the end. The output is the same as savitzky_golay's on the whole signal.
+
+    Causal, every sample is output as soon as it comes in, using the polynomial fit to the window ending at
+    it. That follows the signal with no delay (good for a live plot) at the cost of being noisier. Until a
+    full window has come in, the first sample stands in for the ones before it.
+    """
+
+    def __init__(self, window_size, order, deriv=0, rate=1, causal=False):
+        self.causal = causal
+        self.half_window = (abs(int(window_size)) - 1) // 2
+        position = self.half_window if causal else 0
+        self.coefficients = savitzky_golay_coefficients(window_size, order, deriv, rate, position)
+
+        self.history = None  # the last window_size - 1 samples (including any padding)
+        self.pending = np.empty(0)  # centered mode buffers the first samples until the start can be padded
+
+    def process(self, chunk):
+        """Returns the smoothed samples that are ready. Centered, nothing comes out for the first half window"""
+        chunk = np.asarray(chunk, dtype=float)
+
+        if self.history is None:
+            if self.causal:
+                if len(chunk) == 0:
+                    return chunk
+                self.history = np.full(len(self.coefficients) - 1, chunk[0])
+            else:
+                self.pending = np.concatenate((self.pending, chunk))
+                if len(self.pending) < self.half_window + 1:
+                    return np.empty(0)
+                first = self.pending[0]
+                firstvals = first - np.abs(self.pending[1:self.half_window + 1][::-1] - first)
+                self.history = firstvals
+                chunk = self.pending
+                self.pending = np.empty(0)
+
+        samples = np.concatenate((self.history, chunk))
+        self.history = samples[max(len(samples) - (len(self.coefficients) - 1), 0):]
+        if len(samples) < len(self.coefficients):
+            return np.empty(0)
+        return correlate_valid(samples, self.coefficients)
+
+    def flush(self):
+        """Centered mode: output the last half window of samples, padding the end like savitzky_golay does"""
+        if self.causal or self.history is None:
+            return np.empty(0)
+
+        y = self.history[-(self.half_window + 1):]
+        lastvals = y[-1] + np.abs(y[:-1][::-1] - y[-1])
+        output = correlate_valid(np.concatenate((self.history, lastvals)), self.coefficients)
+        self.history = None
+        return output
@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+from scipy.stats import t as student_t
+
+
+class StiffnessEstimate:
+    """A snapshot of a StiffnessEstimator, broadcast by the bridge each time a step is added"""
+
+    def __init__(self, timestamp, slope, intercept, slope_interval, num_steps, converged):
+        self.name = "stiffness"
+        self.timestamp = timestamp
+        self.slope = slope
+        self.intercept = intercept
+        self.slope_interval = slope_interval
+        self.num_steps = num_steps
+        self.converged = converged
+
+    def __str__(self):
+        if math.isinf(self.slope_interval):
+            return "%0.4f Nm/deg (%s steps)" % (self.slope, self.num_steps)
+        return "%0.4f +/- %0.4f Nm/deg (%s steps%s)" % (
+            self.slope, self.slope_interval, self.num_steps, ", converged" if self.converged else "")
+
+
+class StiffnessEstimator:
+    """
+    Fits torque = slope * deflection + intercept one settled step at a time with recursive least squares,
+    the same line analyze_experiment fits with np.polyfit once the experiment is over (torques being looked
+    up the same way, see brake_lookup.commands_to_torque).
+
+    The residual sum of squares is updated along with the fit, so the slope's confidence interval is
+    available after every step. The estimate has converged once at least min_steps steps are in and the
+    interval is within tolerance (a fraction) of the slope.
+    """
+
+    def __init__(self, confidence=0.95, tolerance=0.02, min_steps=6, initial_covariance=1E6):
+        self.confidence = confidence
+        self.tolerance = tolerance
+        self.min_steps = min_steps
+        self.initial_covariance = initial_covariance
+
+        self.coefficients = np.zeros(2)  # slope, intercept
+        self.covariance = np.eye(2) * initial_covariance
+        self.residual_sum_squares = 0.0
+        self.num_steps = 0
+
+    def add(self, deflection, torque):
+        x = np.array([deflection, 1.0])
+        covariance_x = self.covariance.dot(x)
+        denominator = 1.0 + x.dot(covariance_x)
+
+        error = torque - x.dot(self.coefficients)
+        gain = covariance_x / denominator
+
+        self.coefficients += gain * error
+        self.covariance -= np.outer(gain, covariance_x)
+        self.residual_sum_squares += error * error / denominator
+        self.num_steps += 1
+
+    @property
+    def slope(self):
+        return float(self.coefficients[0])
+
+    @property
+    def intercept(self):
+        return float(self.coefficients[1])
+
+    def slope_interval(self):
+        """Half the width of the slope's confidence interval. Infinite until there are residuals to go on"""
+        degrees_of_freedom = self.num_steps - 2
+        if degrees_of_freedom < 1:
+            return float("inf")
+        residual_variance = self.residual_sum_squares / degrees_of_freedom
+        standard_error = math.sqrt(max(residual_variance * self.covariance[0, 0], 0.0))
+        return float(student_t.ppf((1.0 + self.confidence) / 2, degrees_of_freedom)) * standard_error
+
+    def is_converged(self):
+        if self.num_steps < self.min_steps:
+            return False
+        return self.slope_interval() <= self.tolerance * abs(self.slope)
+
+    def get_estimate(self, timestamp):
+        return StiffnessEstimate(timestamp, self.slope, self.intercept, self.slope_interval(), self.num_steps,
+                                 self.is_converged())
+
+    def get_params(self):
+        return {"confidence": self.confidence, "tolerance": self.tolerance, "min_steps": self.min_steps}
+
+    def get_results(self):
+        slope_interval = self.slope_interval()
+        return {
+            "slope": self.slope,
+            "intercept": self.intercept,
+            "slope_interval": None if math.isinf(slope_interval) else slope_interval,
+            "num_steps": self.num_steps,
+            "converged": self.is_converged(),
+        }
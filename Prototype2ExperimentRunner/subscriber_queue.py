@@ -0,0 +1,54 @@
+from collections import deque
+
+DROP_OLDEST = "drop_oldest"  # keep the newest maxsize messages waiting, throw away the ones before them
+DROP_NEWEST = "drop_newest"  # keep the oldest maxsize messages waiting, throw away the ones after them
+BLOCK = "block"  # the producer waits for room, nothing is dropped
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+def subscription_queue_size(maxsize, policy):
+    """
+    The queue_size to pass define_subscription. With BLOCK atlasbuggy bounds the subscription itself so the
+    producer waits in put, the drop policies leave it unbounded and are applied by SubscriberQueue.drain
+    """
+    check_policy(maxsize, policy)
+    return maxsize if policy == BLOCK else 0
+
+
+def check_policy(maxsize, policy):
+    if maxsize <= 0:
+        raise ValueError("A subscriber queue needs a maximum size, got %s" % maxsize)
+    if policy not in POLICIES:
+        raise ValueError("Unknown queue policy '%s', expected one of %s" % (policy, ", ".join(POLICIES)))
+
+
+class SubscriberQueue:
+    """
+    Wraps a subscription's queue (from get_queue()) to apply a policy when more than maxsize messages are
+    waiting for the subscriber, counting the messages it drops. Call drain() once per iteration of the
+    subscriber's loop, it empties the queue so a subscriber that falls behind never holds more than what
+    arrived since its last iteration, and only handles maxsize messages of it.
+    """
+
+    def __init__(self, queue, maxsize, policy=DROP_OLDEST):
+        check_policy(maxsize, policy)
+        self.queue = queue
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+
+    def drain(self):
+        """Every waiting message the policy keeps, oldest first"""
+        if self.policy == DROP_OLDEST:
+            messages = deque(maxlen=self.maxsize)
+        else:
+            messages = deque()
+
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+            if len(messages) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    continue
+            messages.append(message)  # with DROP_OLDEST the deque pushes the oldest one out
+        return messages
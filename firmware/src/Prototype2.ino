@@ -6,7 +6,12 @@
 
 #include "ArduinoFactoryBridge.h"
 
-ArduinoFactoryBridge bridge("prototype2");
+// the name the host opens the device by (main.py's --rig), set per bench with a build flag in platformio.ini
+#ifndef DEVICE_NAME
+#define DEVICE_NAME "prototype2"
+#endif
+
+ArduinoFactoryBridge bridge(DEVICE_NAME);
 AbsoluteEncoder enc1(A0);
 AbsoluteEncoder enc2(A1, true);
 
@@ -17,6 +22,50 @@ Adafruit_DCMotor *motor = AFMS.getMotor(4);
 int brake_val = 0;
 int motor_val = 0;
 
+// precompiled experiment schedule, see experiment_schedule.py for the format. It runs out of a ring buffer
+// that the host tops up while the schedule runs, so the schedule can be longer than the buffer
+#define SCHEDULE_BUFFER_ENTRIES 48
+#define ENTRIES_PER_UPLOAD_COMMAND 6
+#define SCHEDULE_TIME_UNIT_MS 10
+#define SCHEDULE_DT_MASK 0x1fff
+#define SCHEDULE_BRAKE_FLAG 0x2000
+#define SCHEDULE_MOTOR_FLAG 0x4000
+#define SCHEDULE_REVERSE_FLAG 0x8000
+
+struct ScheduleEntry {
+    uint16_t header;
+    uint8_t brake;
+    uint8_t motor;
+};
+
+ScheduleEntry schedule[SCHEDULE_BUFFER_ENTRIES];
+int schedule_expected_length = 0;
+int schedule_received = 0;  // entries uploaded so far
+int schedule_index = 0;  // entries run so far
+uint16_t schedule_checksum = 0;
+bool schedule_running = false;
+uint32_t schedule_step_time = 0;
+
+// binary framing of the enc stream, see binary_framing.py for the format
+#define FRAME_RECORDS 8
+#define FRAME_HEADER_SIZE 11
+#define FRAME_RECORD_SIZE 14
+#define FRAME_SIZE (FRAME_HEADER_SIZE + FRAME_RECORDS * FRAME_RECORD_SIZE + 2)
+
+const char BASE64_CHARS[] PROGMEM = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+
+// the binary frame is built at the end of frame_text and base64 encoded into the start of the same buffer
+// as it's sent. Each 3 bytes read become 4 characters written, so the text never catches up with the bytes
+// that haven't been read yet as long as the frame starts at least FRAME_SIZE / 3 bytes in
+#define FRAME_TEXT_SIZE ((FRAME_SIZE + 2) / 3 * 4)
+
+bool binary_framing = false;
+char frame_text[FRAME_TEXT_SIZE + 1];
+uint8_t *const frame = (uint8_t *)frame_text + FRAME_TEXT_SIZE - FRAME_SIZE;
+uint8_t frame_count = 0;
+uint16_t frame_sequence = 0;
+uint32_t frame_first_us = 0;
+
 void setup() {
     bridge.begin();
 
@@ -48,40 +97,224 @@ void setMotorSpeed(int speed) {
     motor->setSpeed(abs(speed));
 }
 
+void setBrake(int value) {
+    brake_val = value;
+    analogWrite(BRAKE_CONTROL_PIN, brake_val);
+    bridge.write("brake", "d", brake_val);  // echo value back
+}
+
+void setMotor(int value) {
+    motor_val = value;
+    setMotorSpeed(motor_val);
+    bridge.write("motor", "d", motor_val);  // echo value back
+}
+
+uint8_t parseHexByte(const char *hex) {
+    char digits[3] = {hex[0], hex[1], '\0'};
+    return (uint8_t)strtoul(digits, NULL, 16);
+}
+
+void writeScheduleEntries() {
+    // acknowledges an upload command, or tells the host there's room for the next one
+    bridge.write("schedule_entries", "dd", schedule_received, schedule_index);
+}
+
+void appendScheduleEntries(const char *hex) {
+    // each entry is 8 hex characters: 4 for the header, 2 for the brake, 2 for the motor
+    size_t length = strlen(hex);
+    for (size_t index = 0; index + 8 <= length; index += 8) {
+        if (schedule_received >= schedule_expected_length ||
+                schedule_received - schedule_index >= SCHEDULE_BUFFER_ENTRIES) {
+            return;
+        }
+        uint8_t header_high = parseHexByte(hex + index);
+        uint8_t header_low = parseHexByte(hex + index + 2);
+        ScheduleEntry *entry = &schedule[schedule_received % SCHEDULE_BUFFER_ENTRIES];
+        entry->header = ((uint16_t)header_high << 8) | header_low;
+        entry->brake = parseHexByte(hex + index + 4);
+        entry->motor = parseHexByte(hex + index + 6);
+        schedule_checksum += header_high + header_low + entry->brake + entry->motor;
+        schedule_received++;
+    }
+}
+
+void runSchedule() {
+    if (!schedule_running || schedule_index >= schedule_received) {
+        return;  // not running, or waiting on the host to upload the next entry
+    }
+    ScheduleEntry *entry = &schedule[schedule_index % SCHEDULE_BUFFER_ENTRIES];
+    uint32_t delay_ms = (uint32_t)(entry->header & SCHEDULE_DT_MASK) * SCHEDULE_TIME_UNIT_MS;
+    if (millis() - schedule_step_time < delay_ms) {
+        return;
+    }
+    schedule_step_time += delay_ms;  // step relative to the schedule, not to when this ran, so errors don't add up
+
+    if (entry->header & SCHEDULE_BRAKE_FLAG) {
+        setBrake(entry->brake);
+    }
+    if (entry->header & SCHEDULE_MOTOR_FLAG) {
+        setMotor((entry->header & SCHEDULE_REVERSE_FLAG) ? -(int)entry->motor : (int)entry->motor);
+    }
+
+    schedule_index++;
+    if (schedule_index >= schedule_expected_length) {
+        schedule_running = false;
+        bridge.write("schedule_done", "dd", schedule_index, schedule_checksum & 0x7fff);
+    }
+    else if (schedule_received < schedule_expected_length &&
+            SCHEDULE_BUFFER_ENTRIES - (schedule_received - schedule_index) == ENTRIES_PER_UPLOAD_COMMAND) {
+        writeScheduleEntries();
+    }
+}
+
+uint16_t fletcher16(uint8_t *data, int length) {
+    uint16_t sum1 = 0;
+    uint16_t sum2 = 0;
+    for (int index = 0; index < length; index++) {
+        sum1 = (sum1 + data[index]) % 255;
+        sum2 = (sum2 + sum1) % 255;
+    }
+    return (sum2 << 8) | sum1;
+}
+
+void base64Encode(uint8_t *data, int length, char *text) {
+    for (int index = 0; index < length; index += 3) {
+        uint32_t group = (uint32_t)data[index] << 16;
+        if (index + 1 < length) group |= (uint32_t)data[index + 1] << 8;
+        if (index + 2 < length) group |= data[index + 2];
+
+        *text++ = pgm_read_byte(&BASE64_CHARS[(group >> 18) & 0x3f]);
+        *text++ = pgm_read_byte(&BASE64_CHARS[(group >> 12) & 0x3f]);
+        *text++ = index + 1 < length ? pgm_read_byte(&BASE64_CHARS[(group >> 6) & 0x3f]) : '=';
+        *text++ = index + 2 < length ? pgm_read_byte(&BASE64_CHARS[group & 0x3f]) : '=';
+    }
+    *text = '\0';
+}
+
+void sendFrame() {
+    if (frame_count == 0) {
+        return;
+    }
+    // the AVR is little endian like the frame format, so values are copied in as they are
+    uint32_t send_us = micros();
+    memcpy(frame, &frame_sequence, 2);
+    frame[2] = frame_count;
+    memcpy(frame + 3, &frame_first_us, 4);
+    memcpy(frame + 7, &send_us, 4);
+
+    int length = FRAME_HEADER_SIZE + frame_count * FRAME_RECORD_SIZE;
+    uint16_t checksum = fletcher16(frame, length);
+    memcpy(frame + length, &checksum, 2);
+    length += 2;
+
+    base64Encode(frame, length, frame_text);
+    bridge.write("encb", "s", frame_text);
+
+    frame_sequence++;
+    frame_count = 0;
+}
+
+void addFrameRecord() {
+    uint32_t now = micros();
+    if (frame_count == 0) {
+        frame_first_us = now;
+    }
+    uint8_t *record = frame + FRAME_HEADER_SIZE + frame_count * FRAME_RECORD_SIZE;
+
+    float angle1 = enc1.getFullAngle();
+    float angle2 = enc2.getFullAngle();
+    uint16_t analog1 = enc1.getAnalogValue();
+    uint16_t analog2 = enc2.getAnalogValue();
+    uint32_t offset_us = now - frame_first_us;
+    uint16_t offset = offset_us > 0xffff ? 0xffff : offset_us;
+
+    memcpy(record, &angle1, 4);
+    memcpy(record + 4, &angle2, 4);
+    memcpy(record + 8, &analog1, 2);
+    memcpy(record + 10, &analog2, 2);
+    memcpy(record + 12, &offset, 2);
+
+    frame_count++;
+    if (frame_count >= FRAME_RECORDS) {
+        sendFrame();
+    }
+}
+
 void loop()
 {
     enc1.read();
     enc2.read();
 
     if (!bridge.isPaused()) {
-        bridge.write("enc", "ffdd", enc1.getFullAngle(), enc2.getFullAngle(), enc1.getAnalogValue(), enc2.getAnalogValue());
-        delay(1);
+        if (binary_framing) {
+            // no delay, a sample takes about half the serial bandwidth of a text enc packet
+            addFrameRecord();
+        }
+        else {
+            bridge.write("enc", "ffdd", enc1.getFullAngle(), enc2.getFullAngle(), enc1.getAnalogValue(), enc2.getAnalogValue());
+            delay(1);
+        }
     }
 
     if (bridge.available()) {
         int status = bridge.read();
         String command = bridge.getCommand();
+        // arguments are parsed in place, substring() would copy them into another String on the heap
+        const char *arguments = command.c_str() + 1;
         switch (status) {
             case 0:  // command
                 switch (command.charAt(0)) {
                     case 'b':
-                        brake_val = command.substring(1).toInt();
-                        analogWrite(BRAKE_CONTROL_PIN, brake_val);
-                        bridge.write("brake", "d", brake_val);  // echo value back
+                        setBrake(atoi(arguments));
                         break;
                     case 'm':
-                        motor_val = command.substring(1).toInt();
-                        setMotorSpeed(motor_val);
-                        bridge.write("motor", "d", motor_val);  // echo value back
+                        setMotor(atoi(arguments));
+                        break;
+                    case 's':  // start uploading a schedule of n entries
+                        schedule_running = false;
+                        schedule_expected_length = atoi(arguments);
+                        schedule_received = 0;
+                        schedule_index = 0;
+                        schedule_checksum = 0;
+                        writeScheduleEntries();
+                        break;
+                    case 'e':  // schedule entries
+                        appendScheduleEntries(arguments);
+                        writeScheduleEntries();
+                        break;
+                    case 'x':  // run the schedule, the rest of it is uploaded as it runs
+                        if (schedule_received > 0) {
+                            schedule_index = 0;
+                            schedule_step_time = millis();
+                            schedule_running = true;
+                            bridge.write("schedule", "dd", schedule_expected_length, schedule_received);
+                        }
+                        else {
+                            bridge.write("schedule", "dd", -1, 0);
+                        }
+                        break;
+                    case 'q':  // abort the schedule
+                        schedule_running = false;
+                        setBrake(0);
+                        setMotor(0);
+                        break;
+                    case 'f':  // f1 packs enc samples into binary frames, f0 goes back to text enc packets
+                        sendFrame();
+                        binary_framing = command.charAt(1) == '1';
                         break;
                 }
                 break;
             // case 1:  // start
             case 2:  // stop
+                schedule_running = false;
+                binary_framing = false;
+                frame_count = 0;
                 setMotorSpeed(0);
                 analogWrite(BRAKE_CONTROL_PIN, 0);
                 break;
         }
 
     }
+
+    runSchedule();
 }